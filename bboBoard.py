@@ -0,0 +1,179 @@
+"""
+bboBoard.py
+
+同一台机器上多个策略进程共享的BBO行情板。行情进程(marketDataFeed.py)订阅一次交易所BBO,
+把每个symbol的最新买卖价写入共享内存; 策略进程直接从共享内存读取, 不再各自订阅和解析websocket。
+
+每个symbol占一个固定槽位, 槽位使用seqlock保护: 写入前后各把序号加一, 序号为奇数表示正在写入,
+读取时序号为奇数或前后不一致则重读。读取方通过序号判断行情是否有更新。
+"""
+
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class BboBoard:
+    """共享内存BBO行情板"""
+
+    VERSION = 1
+    SYMBOL_SIZE = 32  # symbol名称的最大字节数
+
+    HEADER_DTYPE = np.dtype(
+        [
+            ("version", "<u8"),
+            ("capacity", "<u8"),
+            ("count", "<u8"),  # 已登记的symbol数量
+            ("heartbeat", "<f8"),  # 行情进程最近一次心跳，单位为毫秒
+        ]
+    )
+    SLOT_DTYPE = np.dtype(
+        [
+            ("seq", "<u8"),
+            ("ask_price", "<f8"),
+            ("ask_qty", "<f8"),
+            ("bid_price", "<f8"),
+            ("bid_qty", "<f8"),
+            ("timestamp", "<i8"),
+        ]
+    )
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner  # 创建者负责释放共享内存
+        self.header = np.ndarray((1,), dtype=self.HEADER_DTYPE, buffer=shm.buf)
+        self.capacity = int(self.header["capacity"][0])
+        offset = self.HEADER_DTYPE.itemsize
+        self.names = np.ndarray(
+            (self.capacity,), dtype=f"S{self.SYMBOL_SIZE}", buffer=shm.buf, offset=offset
+        )
+        offset += self.capacity * self.SYMBOL_SIZE
+        self.slots = np.ndarray(
+            (self.capacity,), dtype=self.SLOT_DTYPE, buffer=shm.buf, offset=offset
+        )
+        # 各字段的视图, 读写时不复制数据
+        self.seq = self.slots["seq"]
+        self.ask_price = self.slots["ask_price"]
+        self.ask_qty = self.slots["ask_qty"]
+        self.bid_price = self.slots["bid_price"]
+        self.bid_qty = self.slots["bid_qty"]
+        self.timestamp = self.slots["timestamp"]
+        self.index = {}  # <symbol, 槽位>
+        self.known = 0  # 已读取到本地的symbol数量
+
+    @classmethod
+    def size(cls, capacity):
+        return (
+            cls.HEADER_DTYPE.itemsize
+            + capacity * cls.SYMBOL_SIZE
+            + capacity * cls.SLOT_DTYPE.itemsize
+        )
+
+    @classmethod
+    def create(cls, name, capacity=256):
+        """创建共享内存, 已存在同名的残留共享内存时先释放"""
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.size(capacity))
+        shm.buf[: cls.size(capacity)] = bytes(cls.size(capacity))
+        header = np.ndarray((1,), dtype=cls.HEADER_DTYPE, buffer=shm.buf)
+        header["capacity"] = capacity
+        header["version"] = cls.VERSION
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """连接行情进程创建的共享内存, 不存在或版本不一致时返回None"""
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return None
+        header = np.ndarray((1,), dtype=cls.HEADER_DTYPE, buffer=shm.buf)
+        if int(header["version"][0]) != cls.VERSION:
+            shm.close()
+            return None
+        return cls(shm)
+
+    def _refresh_index(self):
+        """读取行情进程新登记的symbol"""
+        count = int(self.header["count"][0])
+        for slot in range(self.known, count):
+            self.index[self.names[slot].decode()] = slot
+        self.known = count
+
+    def slot_of(self, symbol):
+        """symbol对应的槽位, 未登记时返回None"""
+        slot = self.index.get(symbol, None)
+        if slot is None and self.known != int(self.header["count"][0]):
+            self._refresh_index()
+            slot = self.index.get(symbol, None)
+        return slot
+
+    def register(self, symbol):
+        """行情进程登记symbol, 先写名称再增加数量, 读取方看到数量时名称已完整"""
+        slot = self.slot_of(symbol)
+        if slot is not None:
+            return slot
+        count = int(self.header["count"][0])
+        if count >= self.capacity:
+            raise ValueError(f"BBO行情板已满({self.capacity})，无法登记 {symbol}")
+        encoded = symbol.encode()
+        if len(encoded) > self.SYMBOL_SIZE:
+            raise ValueError(f"symbol过长，无法登记 {symbol}")
+        self.names[count] = encoded
+        self.header["count"] = count + 1
+        self._refresh_index()
+        return count
+
+    def write(self, symbol, bbo):
+        """行情进程写入一个symbol的最新BBO"""
+        slot = self.register(symbol)
+        self.seq[slot] += 1
+        self.ask_price[slot] = bbo["ask_price"]
+        self.ask_qty[slot] = bbo.get("ask_qty", 0.0) or 0.0
+        self.bid_price[slot] = bbo["bid_price"]
+        self.bid_qty[slot] = bbo.get("bid_qty", 0.0) or 0.0
+        self.timestamp[slot] = bbo["timestamp"]
+        self.seq[slot] += 1
+
+    def read(self, slot, retries=100):
+        """读取槽位的一致快照, 返回(序号, bbo), 一直在写入时返回(None, None)"""
+        seq = self.seq
+        for _ in range(retries):
+            start = int(seq[slot])
+            if start & 1:
+                continue
+            bbo = {
+                "ask_price": float(self.ask_price[slot]),
+                "ask_qty": float(self.ask_qty[slot]),
+                "bid_price": float(self.bid_price[slot]),
+                "bid_qty": float(self.bid_qty[slot]),
+                "timestamp": int(self.timestamp[slot]),
+            }
+            if int(seq[slot]) == start:
+                return start, bbo
+        return None, None
+
+    def touch(self):
+        """行情进程更新心跳"""
+        self.header["heartbeat"] = time.time() * 1000
+
+    def heartbeat_age(self):
+        """距离行情进程最近一次心跳的时间，单位为秒"""
+        return time.time() - float(self.header["heartbeat"][0]) / 1000
+
+    def close(self):
+        """断开共享内存, 创建者同时释放共享内存"""
+        self.header = self.names = self.slots = None
+        self.seq = self.ask_price = self.ask_qty = None
+        self.bid_price = self.bid_qty = self.timestamp = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,376 @@
+"""
+benchmark.py
+
+热路径性能基准与回归门禁。在本地模拟交易所上用固定种子的行情驱动策略, 统计:
+- on_bbo_us: 每次on_bbo回调的耗时，单位为微秒
+- fill_to_hedge_us: 收到交割合约成交推送到发出现货对冲单的耗时，单位为微秒
+- rss_growth_mb: 运行memory_ticks次行情后进程常驻内存的增长，单位为MB
+
+每次运行的结果按提交保存在本地文件中。与基准比较时对耗时样本做Mann-Whitney U检验,
+中位数变慢超过阈值且检验显著时判定为回归, 退出码为1。只使用CPU, 固定种子并绑定到单个CPU核心,
+可以在任意Linux机器上运行, 但基准只在同一台机器上的结果之间可比。
+
+用法:
+    python benchmark.py --save                # 运行并保存为当前提交的基准
+    python benchmark.py                       # 运行并与最近一次保存的其它提交比较
+    python benchmark.py --baseline 1a2b3c4    # 与指定提交比较
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tomllib
+from pathlib import Path
+
+import numpy as np
+
+from exchangeSimulator import LatencyModel, SimTrader
+from faultInjection import DEFAULT_EXCHANGES, pair_symbols
+
+ROOT = Path(__file__).resolve().parent
+DEFAULT_STORE = ROOT / "benchmark_baselines.json"
+
+# 参与回归判定的热路径指标
+HOT_METRICS = ("on_bbo_us", "fill_to_hedge_us")
+MAX_STORED_SAMPLES = 2000  # 每个指标保存的样本数量
+BASIS_PERIOD = 1000  # 行情价差的波动周期, 单位为行情步数
+BASIS_AMPLITUDE = 0.002  # 行情价差的波动幅度
+
+
+def commit_id():
+    """当前提交, 工作区有未提交的修改时加上-dirty"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "diff", "--quiet", "HEAD", "--"], cwd=ROOT
+        ).returncode
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def rss_mb():
+    """进程当前的常驻内存，单位为MB"""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def market_ticks(symbols, ticks, seed, start_ms):
+    """固定种子的BBO行情, 价差围绕1%按正弦波动并叠加噪声, 反复穿过网格产生挂单、成交与对冲"""
+    rng = random.Random(seed)
+    spots = list(dict.fromkeys(spot for spot, _ in symbols))
+    futures = [future for _, future in symbols]
+    ts = start_ms
+    count = 0
+    step = 0
+    while count < ticks:
+        ts += 10
+        step += 1
+        spot_mid = 2500 + rng.gauss(0, 0.5)
+        basis = (
+            0.01
+            + BASIS_AMPLITUDE * math.sin(2 * math.pi * step / BASIS_PERIOD)
+            + rng.gauss(0, 0.0002)
+        )
+        for spot in spots:
+            yield _bbo(spot, spot_mid, 0.02, ts)
+        for future in futures:
+            yield _bbo(future, spot_mid * (1 + basis), 0.6, ts)
+        count += len(spots) + len(futures)
+
+
+def _bbo(symbol, mid, spread, ts):
+    return {
+        "type": "bbo",
+        "symbol": symbol,
+        "bid_price": round(mid - spread / 2, 2),
+        "bid_qty": 1.0,
+        "ask_price": round(mid + spread / 2, 2),
+        "ask_qty": 1.0,
+        "timestamp": ts,
+    }
+
+
+class Probe:
+    """用实例属性包装策略回调与Trader请求, 采集耗时样本"""
+
+    def __init__(self, strategy, sim, warmup):
+        self.on_bbo_ns = []
+        self.fill_to_hedge_ns = []
+        self.warmup = warmup  # 前warmup次on_bbo不计入样本
+        self.ticks = 0
+        self.fill_started = None  # 正在处理的成交推送开始时间
+        clock = time.perf_counter_ns
+
+        on_bbo = strategy.on_bbo
+
+        def timed_on_bbo(exchange, bbo):
+            start = clock()
+            on_bbo(exchange, bbo)
+            elapsed = clock() - start
+            self.ticks += 1
+            if self.ticks > self.warmup:
+                self.on_bbo_ns.append(elapsed)
+
+        on_order = strategy.on_order
+
+        def timed_on_order(exchange, order):
+            filled = order["status"].lower() == "filled" and exchange == sim.exchanges[1]
+            self.fill_started = clock() if filled else None
+            try:
+                on_order(exchange, order)
+            finally:
+                self.fill_started = None
+
+        place_order = sim.place_order
+
+        def timed_place_order(account_id, order, *args, **kwargs):
+            if account_id == 0 and self.fill_started is not None:
+                self.fill_to_hedge_ns.append(clock() - self.fill_started)
+                self.fill_started = None
+            return place_order(account_id, order, *args, **kwargs)
+
+        strategy.on_bbo = timed_on_bbo
+        strategy.on_order = timed_on_order
+        sim.place_order = timed_place_order
+
+
+def build(module, config, seed, start_ms):
+    """在模拟交易所上创建策略"""
+    symbols = pair_symbols(config, module.InstrumentCache.translate_to_exchange)
+    instruments = {
+        0: [
+            {"symbol": spot, "price_tick": 0.01, "amount_tick": 0.001}
+            for spot in dict.fromkeys(spot for spot, _ in symbols)
+        ],
+        1: [
+            {"symbol": future, "price_tick": 0.01, "amount_tick": 0.001}
+            for _, future in symbols
+        ],
+    }
+    sim = SimTrader(
+        instruments=instruments,
+        latency=LatencyModel(seed=seed),
+        start_ms=start_ms,
+        seed=seed,
+    )
+    sim.bind(module)  # 策略创建线程池之前替换为虚拟线程
+    strategy = module.Strategy(
+        [{"exchange": exchange} for exchange in DEFAULT_EXCHANGES], [], config, sim
+    )
+    return strategy, sim, symbols
+
+
+def run_once(module, config, ticks, seed, warmup):
+    """运行一次, 返回(on_bbo样本, 成交到对冲样本, 内存增长)"""
+    start_ms = 1_700_000_000_000
+    strategy, sim, symbols = build(module, config, seed, start_ms)
+    probe = Probe(strategy, sim, warmup)
+    sim.attach(strategy, modules=[module])
+    gc.collect()
+    rss_before = rss_mb()
+    sim.run(market_ticks(symbols, ticks, seed, start_ms))
+    rss_growth = rss_mb() - rss_before
+    strategy.on_stop()
+    return probe.on_bbo_ns, probe.fill_to_hedge_ns, rss_growth
+
+
+def summarize(samples_ns, rng):
+    """耗时样本的统计量(微秒), 保存部分样本供之后的检验使用"""
+    values = np.asarray(samples_ns, dtype=float) / 1000
+    if len(values) == 0:
+        return {"count": 0, "samples": []}
+    stored = (
+        values
+        if len(values) <= MAX_STORED_SAMPLES
+        else np.asarray(rng.sample(list(values), MAX_STORED_SAMPLES))
+    )
+    return {
+        "count": int(len(values)),
+        "median": float(np.median(values)),
+        "mean": float(values.mean()),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "samples": [round(float(v), 3) for v in stored],
+    }
+
+
+def mann_whitney_greater(new, old):
+    """单侧Mann-Whitney U检验(正态近似, 含相同值修正), 返回new整体大于old的p值"""
+    new = np.asarray(new, dtype=float)
+    old = np.asarray(old, dtype=float)
+    n1, n2 = len(new), len(old)
+    if n1 == 0 or n2 == 0:
+        return 1.0
+    values = np.concatenate([new, old])
+    order = values.argsort(kind="mergesort")
+    sorted_values = values[order]
+    # 相同值取平均秩
+    _, first, counts = np.unique(sorted_values, return_index=True, return_counts=True)
+    average_ranks = first + (counts + 1) / 2
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(average_ranks, counts)
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    tie_term = (counts**3 - counts).sum() / (n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term))
+    if sigma == 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / sigma
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def run_benchmark(args):
+    module = __import__(args.strategy)
+    with open(args.config, "rb") as f:
+        config = tomllib.load(f)
+    # 快照与日志会写文件, 不属于行情热路径
+    config["snapshot_config"] = {"enabled": False}
+    config["journal_config"] = {"enabled": False}
+
+    on_bbo, fill_to_hedge = [], []
+    for repeat in range(args.repeats):
+        bbo_ns, hedge_ns, _ = run_once(
+            module,
+            config,
+            args.ticks,
+            args.seed + repeat,
+            args.warmup,
+        )
+        on_bbo.extend(bbo_ns)
+        fill_to_hedge.extend(hedge_ns)
+    _, _, rss_growth = run_once(
+        module, config, args.memory_ticks, args.seed, args.warmup
+    )
+    rng = random.Random(args.seed)
+    return {
+        "commit": commit_id(),
+        "time": int(time.time()),
+        "ticks": args.ticks,
+        "repeats": args.repeats,
+        "metrics": {
+            "on_bbo_us": summarize(on_bbo, rng),
+            "fill_to_hedge_us": summarize(fill_to_hedge, rng),
+            "rss_growth_mb": {"value": round(rss_growth, 3)},
+        },
+    }
+
+
+def load_store(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def pick_baseline(store, commit, requested=None):
+    """指定的提交, 或最近一次保存的其它提交"""
+    if requested:
+        for key, result in store.items():
+            if key.startswith(requested):
+                return result
+        return None
+    others = [result for key, result in store.items() if key != commit]
+    return max(others, key=lambda result: result["time"], default=None)
+
+
+def compare(result, baseline, threshold, alpha):
+    """比较热路径指标, 返回(输出行, 是否回归)"""
+    lines = []
+    regressed = False
+    for name in HOT_METRICS:
+        new = result["metrics"][name]
+        old = baseline["metrics"].get(name, None)
+        if not old or not old.get("count", 0) or not new.get("count", 0):
+            lines.append(f"{name:<18} 没有可比较的样本")
+            continue
+        change = new["median"] / old["median"] - 1
+        p_value = mann_whitney_greater(new["samples"], old["samples"])
+        failed = change > threshold and p_value < alpha
+        regressed |= failed
+        lines.append(
+            f"{name:<18} 中位数 {old['median']:.2f} -> {new['median']:.2f} ({change:+.1%}), "
+            f"p99 {old['p99']:.2f} -> {new['p99']:.2f}, p={p_value:.4f} "
+            f"{'回归' if failed else 'OK'}"
+        )
+    old_rss = baseline["metrics"].get("rss_growth_mb", {}).get("value", None)
+    new_rss = result["metrics"]["rss_growth_mb"]["value"]
+    if old_rss is not None:
+        lines.append(f"{'rss_growth_mb':<18} {old_rss:.1f} -> {new_rss:.1f} (仅供参考)")
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="热路径性能基准与回归门禁")
+    parser.add_argument("--strategy", default="strategyV2", help="策略模块")
+    parser.add_argument("--config", default=str(ROOT / "strategy.toml"), help="策略配置")
+    parser.add_argument("--store", default=str(DEFAULT_STORE), help="保存基准结果的文件")
+    parser.add_argument("--baseline", default=None, help="比较的基准提交, 默认为最近一次保存的其它提交")
+    parser.add_argument("--save", action="store_true", help="保存为当前提交的基准")
+    parser.add_argument("--ticks", type=int, default=100_000, help="每次运行的行情数量")
+    parser.add_argument("--repeats", type=int, default=3, help="运行次数")
+    parser.add_argument("--warmup", type=int, default=2_000, help="每次运行不计入样本的行情数量")
+    parser.add_argument("--memory-ticks", type=int, default=1_000_000, help="统计内存增长的行情数量")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--threshold", type=float, default=0.10, help="中位数变慢的容忍比例")
+    parser.add_argument("--alpha", type=float, default=0.01, help="检验的显著性水平")
+    args = parser.parse_args(argv)
+    args.config = os.path.abspath(args.config)
+    args.store = os.path.abspath(args.store)
+
+    # 绑定到单个CPU核心, 减少调度带来的波动
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # 策略的统计文件写到临时目录
+        os.chdir(workdir)
+        try:
+            result = run_benchmark(args)
+        finally:
+            os.chdir(cwd)
+
+    print(f"提交 {result['commit']}:")
+    for name in HOT_METRICS:
+        metric = result["metrics"][name]
+        if metric["count"]:
+            print(
+                f"    {name:<18} n={metric['count']} 中位数 {metric['median']:.2f} "
+                f"p90 {metric['p90']:.2f} p99 {metric['p99']:.2f}"
+            )
+    print(f"    {'rss_growth_mb':<18} {result['metrics']['rss_growth_mb']['value']:.1f}")
+
+    store = load_store(args.store)
+    baseline = pick_baseline(store, result["commit"], args.baseline)
+    regressed = False
+    if baseline is None:
+        print("没有可比较的基准")
+    else:
+        print(f"与基准 {baseline['commit']} 比较:")
+        lines, regressed = compare(result, baseline, args.threshold, args.alpha)
+        for line in lines:
+            print(f"    {line}")
+    if args.save:
+        store[result["commit"]] = result
+        with open(args.store, "w", encoding="utf-8") as f:
+            json.dump(store, f)
+        print(f"已保存到 {args.store}")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
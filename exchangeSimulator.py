@@ -0,0 +1,993 @@
+"""
+exchangeSimulator.py
+
+本地模拟交易所, 实现interface.trader.Trader, 用于在本地复现撤单竞争、请求丢失等问题(problem.md 第2、3条)。
+
+- 撮合: 外部行情为BBO(以及可选的逐笔成交), 策略订单支持PostOnly/GTC/IOC限价单,
+  穿价部分按对手一档数量成交(部分成交), 挂单按价格时间优先排队, 同价位前方数量减少或有成交时排队位置前移
+- 延迟: 按请求类型的延迟分布(可从LatencyStats输出的csv中采样), 请求到达交易所与回报推送分别计算延迟
+- 丢包: 按请求类型设置请求丢失(交易所未收到)与回报丢失(交易所已处理但策略收不到)的概率
+- 时间: 使用虚拟时钟按事件时间顺序处理, 不等待真实时间, 比实时快得多
+
+同步请求立即返回结果, 交易所侧的处理仍按延迟发生, 策略据此认为撤单已完成而订单在撤单到达前成交的情况可以复现。
+
+策略模块中的线程也按虚拟时间执行, 保证同一场景的结果可以复现:
+- ThreadPoolExecutor替换为在调用线程中直接执行的InlineExecutor
+- threading.Thread替换为SimThread, 与事件循环轮流执行, 线程中的sleep等待事件循环推进到唤醒时间
+线程池在策略创建时生成, 需要在创建策略前调用sim.bind(module)。
+
+用法:
+    sim = SimTrader(instruments={0: [...], 1: [...]}, latency=LatencyModel.from_csv(paths))
+    sim.bind(strategy_module)  # 策略模块使用虚拟时钟与虚拟线程
+    strategy = Strategy(cex_configs, [], config, sim)
+    sim.attach(strategy)  # 策略模块使用虚拟时钟, 按subscribes()注册定时器并调用start()
+    sim.run(market_events)  # [{"type": "bbo", "symbol", "bid_price", "bid_qty", "ask_price", "ask_qty", "timestamp"}, ...]
+"""
+
+import abc
+import csv
+import heapq
+import itertools
+import random
+import sys
+import threading
+from concurrent.futures import Future
+
+from interface.trader import Trader
+
+
+class SimClock:
+    """虚拟时钟, 替换策略模块中的time模块, 提供time()/monotonic()/sleep()"""
+
+    def __init__(self, start_ms=0, lock=None):
+        self.now_ms = float(start_ms)
+        self.lock = lock or threading.RLock()  # 与模拟交易所共用, 保护now_ms
+
+    def time(self):
+        return self.now_ms / 1000
+
+    def monotonic(self):
+        return self.now_ms / 1000
+
+    def sleep(self, seconds):
+        """SimThread中的sleep等待事件循环推进到唤醒时间, 事件循环中的sleep只推进虚拟时间, 不阻塞"""
+        thread = SimThread.current()
+        if thread is not None:
+            thread.sleep(seconds * 1000)
+            return
+        with self.lock:
+            self.now_ms += seconds * 1000
+
+    def advance_to(self, ms):
+        with self.lock:
+            self.now_ms = max(self.now_ms, float(ms))
+
+    def bind(self, *modules):
+        """让模块中的time.time()等调用使用虚拟时钟"""
+        for module in modules:
+            module.time = self
+
+
+class InlineExecutor:
+    """替换ThreadPoolExecutor, 在调用线程中直接执行任务, 返回已完成的Future"""
+
+    def __init__(self, max_workers=None, thread_name_prefix="", **kwargs):
+        pass
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, **kwargs):
+        pass
+
+
+class SimThread:
+    """替换threading.Thread, 与模拟交易所的事件循环轮流执行
+
+    start()与每次sleep到期时事件循环把控制权交给线程, 等线程再次sleep或结束后才继续处理事件,
+    同一时刻只有一方在执行。线程阻塞在其它同步原语上(例如等待Condition)超过yield_timeout秒时,
+    事件循环不再等待它, 该线程之后的执行与事件循环并发。
+    """
+
+    _local = threading.local()
+
+    def __init__(
+        self, sim, group=None, target=None, name=None, args=(), kwargs=None, daemon=None
+    ):
+        self.sim = sim
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.name = name
+        self.daemon = True if daemon is None else daemon
+        self.condition = threading.Condition()
+        self.running = False  # 是否轮到线程执行
+        self.finished = False
+        self.thread = None
+
+    @classmethod
+    def current(cls):
+        return getattr(cls._local, "thread", None)
+
+    def _run(self):
+        SimThread._local.thread = self
+        try:
+            if self.target is not None:
+                self.target(*self.args, **self.kwargs)
+        finally:
+            with self.condition:
+                self.finished = True
+                self.running = False
+                self.condition.notify_all()
+
+    def _resume(self):
+        """事件循环中执行: 让线程继续, 等待它再次sleep或结束"""
+        with self.condition:
+            self.running = True
+            self.condition.notify_all()
+            self.condition.wait_for(
+                lambda: not self.running, timeout=self.sim.yield_timeout
+            )
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self._run, name=self.name, daemon=self.daemon
+        )
+        with self.condition:
+            self.running = True
+        self.thread.start()
+        with self.condition:
+            self.condition.wait_for(
+                lambda: not self.running, timeout=self.sim.yield_timeout
+            )
+
+    def sleep(self, delay_ms):
+        """交还控制权, 事件循环推进到唤醒时间后继续"""
+        with self.condition:
+            self.running = False
+            self.sim.schedule(delay_ms, self._resume)
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: self.running)
+
+    def join(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def is_alive(self):
+        return self.thread is not None and not self.finished
+
+
+class SimThreading:
+    """替换策略模块中的threading模块, Thread使用SimThread, 其它属性转发给threading"""
+
+    def __init__(self, sim):
+        self.sim = sim
+
+    def Thread(self, *args, **kwargs):
+        return SimThread(self.sim, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(threading, name)
+
+
+class LatencyModel:
+    """按请求类型的单程延迟分布，单位为毫秒"""
+
+    REQUEST_TYPES = {
+        "place_order": "place_order",
+        "batch_place_order": "place_order",
+        "amend_order": "amend_order",
+        "cancel_order": "cancel_order",
+        "batch_cancel_order": "cancel_order",
+        "batch_cancel_order_by_id": "cancel_order",
+    }
+
+    def __init__(self, samples=None, default_ms=20.0, jitter_ms=5.0, push_ms=5.0, seed=None):
+        self.samples = samples or {}  # <请求类型, [延迟样本]>
+        self.default_ms = default_ms  # 没有样本时的平均延迟
+        self.jitter_ms = jitter_ms  # 没有样本时的延迟标准差
+        self.push_ms = push_ms  # 交易所推送到策略的延迟
+        self.rng = random.Random(seed)
+
+    @classmethod
+    def from_csv(cls, paths, **kwargs):
+        """从LatencyStats输出的csv文件中读取延迟样本"""
+        samples = {}
+        for path in paths:
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        latency = float(row["latency_ms"])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    if latency >= 0:
+                        samples.setdefault(row["order_type"], []).append(latency)
+        return cls(samples=samples, **kwargs)
+
+    def sample(self, endpoint):
+        """请求到达交易所的延迟"""
+        samples = self.samples.get(self.REQUEST_TYPES.get(endpoint, endpoint), None)
+        if samples:
+            return self.rng.choice(samples)
+        return max(0.0, self.rng.gauss(self.default_ms, self.jitter_ms))
+
+    def push(self):
+        """交易所推送到策略的延迟"""
+        return self.push_ms
+
+
+class SimOrder:
+    """模拟交易所中的订单"""
+
+    __slots__ = (
+        "id",
+        "cid",
+        "account_id",
+        "symbol",
+        "side",
+        "order_type",
+        "price",
+        "amount",
+        "time_in_force",
+        "filled",
+        "filled_value",
+        "status",
+        "queue_ahead",
+        "timestamp",
+    )
+
+    def __init__(self, order_id, account_id, order):
+        self.id = order_id
+        self.cid = order.get("cid", None) or order_id
+        self.account_id = account_id
+        self.symbol = order["symbol"]
+        self.side = order["side"]  # 'Buy' 或 'Sell'
+        self.order_type = order.get("order_type", "Limit")
+        self.price = float(order["price"])
+        self.amount = float(order["amount"])
+        self.time_in_force = order.get("time_in_force", "GTC")
+        self.filled = 0.0
+        self.filled_value = 0.0
+        self.status = "New"
+        self.queue_ahead = None  # 同价位排在前面的数量, None表示价格不在一档、位置未知
+        self.timestamp = None
+
+    @property
+    def remaining(self):
+        return self.amount - self.filled
+
+    @property
+    def is_buy(self):
+        return self.side.lower() == "buy"
+
+    def fill(self, amount, price):
+        self.filled += amount
+        self.filled_value += amount * price
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "cid": self.cid,
+            "symbol": self.symbol,
+            "side": self.side,
+            "order_type": self.order_type,
+            "price": self.price,
+            "amount": self.amount,
+            "filled": self.filled,
+            "filled_avg_price": self.filled_value / self.filled if self.filled else 0.0,
+            "status": self.status,
+            "time_in_force": self.time_in_force,
+            "timestamp": self.timestamp,
+        }
+
+
+class SimBook:
+    """单个symbol的撮合, 外部行情只有一档, 策略订单按价格时间优先排队"""
+
+    EPS = 1e-12
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.bid_price = None
+        self.bid_qty = 0.0
+        self.ask_price = None
+        self.ask_qty = 0.0
+        self.resting = []  # 挂单, 按到达顺序
+
+    def crosses(self, order):
+        """订单是否会与对手一档成交"""
+        if order.is_buy:
+            return self.ask_price is not None and order.price >= self.ask_price
+        return self.bid_price is not None and order.price <= self.bid_price
+
+    def take(self, order):
+        """订单吃对手一档, 对手数量为0时视为数量充足, 返回成交列表[(数量, 价格)]"""
+        if not self.crosses(order):
+            return []
+        if order.is_buy:
+            price, available = self.ask_price, self.ask_qty
+        else:
+            price, available = self.bid_price, self.bid_qty
+        amount = order.remaining if available <= 0 else min(order.remaining, available)
+        if order.is_buy:
+            self.ask_qty = max(self.ask_qty - amount, 0.0)
+        else:
+            self.bid_qty = max(self.bid_qty - amount, 0.0)
+        return [(amount, price)]
+
+    def _level_qty(self, order):
+        """订单所在价位的外部数量, 价格不在一档时返回None"""
+        if order.is_buy:
+            if self.bid_price is None or order.price > self.bid_price:
+                return 0.0
+            return self.bid_qty if order.price == self.bid_price else None
+        if self.ask_price is None or order.price < self.ask_price:
+            return 0.0
+        return self.ask_qty if order.price == self.ask_price else None
+
+    def rest(self, order):
+        """订单挂在盘口, 排在同价位已有数量之后"""
+        order.queue_ahead = self._level_qty(order)
+        self.resting.append(order)
+
+    def remove(self, order):
+        if order in self.resting:
+            self.resting.remove(order)
+
+    def on_bbo(self, bid_price, bid_qty, ask_price, ask_qty):
+        """更新一档行情, 返回被穿价成交的挂单[(订单, 数量, 价格)]"""
+        self.bid_price, self.bid_qty = bid_price, bid_qty
+        self.ask_price, self.ask_qty = ask_price, ask_qty
+        fills = []
+        for order in list(self.resting):
+            if self.crosses(order):
+                # 对手价穿过挂单价格, 挂单按挂单价格全部成交
+                fills.append((order, order.remaining, order.price))
+                continue
+            level_qty = self._level_qty(order)
+            if level_qty is None:
+                continue
+            # 同价位数量减少时排队位置前移, 新增的数量排在后面
+            order.queue_ahead = (
+                level_qty
+                if order.queue_ahead is None
+                else min(order.queue_ahead, level_qty)
+            )
+        return fills
+
+    def on_trade(self, price, amount, side):
+        """外部逐笔成交, side为主动方方向, 先消耗排在前面的数量再成交挂单
+        返回[(订单, 数量, 价格)]
+        """
+        fills = []
+        remaining = amount
+        passive_buy = side.lower() == "sell"
+        for order in list(self.resting):
+            if order.is_buy != passive_buy or remaining <= self.EPS:
+                continue
+            if (passive_buy and price > order.price) or (
+                not passive_buy and price < order.price
+            ):
+                continue
+            if (passive_buy and price < order.price) or (
+                not passive_buy and price > order.price
+            ):
+                # 成交价格穿过挂单价格
+                filled = min(order.remaining, remaining)
+            else:
+                ahead = order.queue_ahead or 0.0
+                consumed = min(ahead, remaining)
+                order.queue_ahead = ahead - consumed
+                filled = min(order.remaining, remaining - consumed)
+            if filled > self.EPS:
+                fills.append((order, filled, order.price))
+                remaining -= filled
+        return fills
+
+
+class SimTrader(Trader):
+    """模拟交易所, 实现Trader接口并按虚拟时间驱动策略回调"""
+
+    def __init__(
+        self,
+        exchanges=("BinanceSwap", "BinanceDelivery"),
+        instruments=None,
+        latency=None,
+        loss=None,
+        balances=None,
+        max_positions=None,
+        timeout_ms=1000,
+        start_ms=0,
+        seed=None,
+        verbose=False,
+    ):
+        self.exchanges = list(exchanges)  # 账户对应的交易所名称
+        self.instruments = instruments or {}  # <账户, [交易对信息]>
+        self.latency = latency or LatencyModel(seed=seed)
+        self.loss = loss or {}  # <接口, {"request": 请求丢失概率, "response": 回报丢失概率}>
+        self.balances = balances or {}  # <账户, 可用USDT>
+        self.max_positions = max_positions or {}  # <交易所symbol, 最大可持仓数量>
+        self.timeout_ms = timeout_ms  # 异步请求丢失后回调超时错误的时间
+        self.verbose = verbose
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.clock = SimClock(start_ms, self.lock)
+        self.yield_timeout = 1.0  # 等待SimThread交还控制权的最长真实时间，单位为秒
+
+        self.strategy = None
+        self.events = []  # 事件堆 (时间, 序号, 函数, 参数)
+        self.seq = itertools.count()
+        self.order_ids = itertools.count(1)
+        self.cids = itertools.count(1)
+        self.books = {}  # <交易所symbol, SimBook>
+        self.orders = {}  # <(账户, cid), SimOrder>
+        self.positions = {}  # <(账户, 交易所symbol), 带方向的持仓>
+        self.fills = []  # 成交记录
+        self.logs = []  # 策略日志
+        self.tlog_times = {}  # <tag, 上次输出时间>
+        self.stats = {"requests": 0, "dropped_requests": 0, "dropped_responses": 0}
+        self.cache = None
+        self.web_flags = {
+            "soft_stopped": False,
+            "opening_stopped": False,
+            "force_closing": False,
+        }
+
+    # ========================事件调度=========================
+    def schedule(self, delay_ms, fn, *args):
+        with self.lock:
+            heapq.heappush(
+                self.events,
+                (self.clock.now_ms + delay_ms, next(self.seq), fn, args),
+            )
+
+    def run_pending(self, until_ms):
+        """按时间顺序处理until_ms之前的事件, 回调策略时不持有锁"""
+        while True:
+            with self.lock:
+                if not self.events or self.events[0][0] > until_ms:
+                    break
+                at, _, fn, args = heapq.heappop(self.events)
+                self.clock.advance_to(at)
+            fn(*args)
+        self.clock.advance_to(until_ms)
+
+    def bind(self, *modules):
+        """模块中的time、threading.Thread与ThreadPoolExecutor替换为虚拟时钟、SimThread与InlineExecutor"""
+        self.clock.bind(*modules)
+        for module in modules:
+            if hasattr(module, "threading"):
+                module.threading = SimThreading(self)
+            if hasattr(module, "ThreadPoolExecutor"):
+                module.ThreadPoolExecutor = InlineExecutor
+
+    def attach(self, strategy, start=True, modules=None):
+        """连接策略: 策略模块使用虚拟时钟, 注册定时器, 并调用start()
+        modules: 需要使用虚拟时钟的模块, 默认为策略类所在的模块
+        """
+        self.strategy = strategy
+        self.bind(*(modules or [sys.modules[type(strategy).__module__]]))
+        for sub in strategy.subscribes():
+            timer = sub.get("sub", {}).get("SubscribeTimer", None)
+            if timer is None:
+                continue
+            interval = timer["update_interval"]
+            interval_ms = interval["secs"] * 1000 + interval["nanos"] / 1e6
+            if interval_ms > 0:
+                self.schedule(interval_ms, self._fire_timer, timer["name"], interval_ms)
+        if start:
+            strategy.start()
+
+    def _fire_timer(self, name, interval_ms):
+        self.schedule(interval_ms, self._fire_timer, name, interval_ms)
+        self.strategy.on_timer_subscribe(name)
+
+    def run(self, market_events, until_ms=None):
+        """按时间顺序回放行情事件并处理期间的请求、成交与推送
+        market_events: 可迭代的行情事件, 按timestamp升序
+            {"type": "bbo", "symbol", "bid_price", "bid_qty", "ask_price", "ask_qty", "timestamp"}
+            {"type": "trade", "symbol", "price", "amount", "side", "timestamp"}
+        """
+        for event in market_events:
+            self.run_pending(event["timestamp"])
+            if event.get("type", "bbo") == "trade":
+                self._on_market_trade(event)
+            else:
+                self._on_market_bbo(event)
+        if until_ms is not None:
+            self.run_pending(until_ms)
+
+    def _on_market_bbo(self, event):
+        symbol = event["symbol"]
+        with self.lock:
+            book = self.books.setdefault(symbol, SimBook(symbol))
+            fills = book.on_bbo(
+                event["bid_price"],
+                event.get("bid_qty", 0.0) or 0.0,
+                event["ask_price"],
+                event.get("ask_qty", 0.0) or 0.0,
+            )
+            for order, amount, price in fills:
+                self._apply_fill(order, amount, price, "maker")
+        bbo = {
+            "symbol": symbol,
+            "bid_price": event["bid_price"],
+            "bid_qty": event.get("bid_qty", 0.0) or 0.0,
+            "ask_price": event["ask_price"],
+            "ask_qty": event.get("ask_qty", 0.0) or 0.0,
+            "timestamp": event["timestamp"],
+        }
+        self.schedule(self.latency.push(), self.strategy.on_bbo, self.exchanges[0], bbo)
+
+    def _on_market_trade(self, event):
+        with self.lock:
+            book = self.books.setdefault(event["symbol"], SimBook(event["symbol"]))
+            for order, amount, price in book.on_trade(
+                event["price"], event["amount"], event["side"]
+            ):
+                self._apply_fill(order, amount, price, "maker")
+
+    # ========================撮合与推送=========================
+    def _dropped(self, endpoint, kind):
+        rate = self.loss.get(endpoint, {}).get(kind, 0.0)
+        return rate > 0 and self.rng.random() < rate
+
+    def _apply_fill(self, order, amount, price, liquidity):
+        """记录成交, 更新持仓并推送订单与持仓"""
+        order.fill(amount, price)
+        order.timestamp = int(self.clock.now_ms)
+        finished = order.remaining <= SimBook.EPS
+        order.status = "Filled" if finished else "PartiallyFilled"
+        if finished:
+            self.books[order.symbol].remove(order)
+        key = (order.account_id, order.symbol)
+        self.positions[key] = self.positions.get(key, 0.0) + (
+            amount if order.is_buy else -amount
+        )
+        self.fills.append(
+            {
+                "timestamp": order.timestamp,
+                "account_id": order.account_id,
+                "symbol": order.symbol,
+                "cid": order.cid,
+                "side": order.side,
+                "amount": amount,
+                "price": price,
+                "liquidity": liquidity,
+            }
+        )
+        self._push_order(order)
+        self._push_position(order.account_id, order.symbol)
+
+    def _push_order(self, order):
+        self.schedule(
+            self.latency.push(),
+            self.strategy.on_order,
+            self.exchanges[order.account_id],
+            order.to_dict(),
+        )
+
+    def _position_dict(self, account_id, symbol):
+        amount = self.positions.get((account_id, symbol), 0.0)
+        return {
+            "symbol": symbol,
+            "side": "Long" if amount >= 0 else "Short",
+            "amount": abs(amount),
+            "unrealized_pnl": 0.0,
+        }
+
+    def _push_position(self, account_id, symbol):
+        self.schedule(
+            self.latency.push(),
+            self.strategy.on_position,
+            self.exchanges[account_id],
+            self._position_dict(account_id, symbol),
+        )
+
+    def _arrive_place(self, order):
+        """下单请求到达交易所"""
+        with self.lock:
+            order.timestamp = int(self.clock.now_ms)
+            book = self.books.setdefault(order.symbol, SimBook(order.symbol))
+            tif = order.time_in_force
+            if tif == "PostOnly" and book.crosses(order):
+                # PostOnly会成为taker时直接撤销
+                order.status = "Canceled"
+                self._push_order(order)
+                return
+            for amount, price in book.take(order):
+                self._apply_fill(order, amount, price, "taker")
+            if order.remaining <= SimBook.EPS:
+                return
+            if tif == "IOC":
+                order.status = "Canceled"
+                self._push_order(order)
+                return
+            order.status = "Open" if not order.filled else "PartiallyFilled"
+            book.rest(order)
+            self._push_order(order)
+
+    def _arrive_cancel(self, account_id, cid, symbol):
+        """撤单请求到达交易所, 返回撤单结果"""
+        with self.lock:
+            order = self.orders.get((account_id, cid), None)
+            if order is None or order.status not in ("Open", "PartiallyFilled"):
+                return {"Err": f"订单不存在或已结束: {cid}"}
+            self.books[order.symbol].remove(order)
+            order.status = "Canceled"
+            order.timestamp = int(self.clock.now_ms)
+            self._push_order(order)
+            return {"Ok": order.id}
+
+    def _arrive_amend(self, account_id, cid, price, amount):
+        """改单请求到达交易所, 改价后重新排队"""
+        with self.lock:
+            order = self.orders.get((account_id, cid), None)
+            if order is None or order.status not in ("Open", "PartiallyFilled"):
+                return {"Err": f"订单不存在或已结束: {cid}"}
+            book = self.books[order.symbol]
+            old_price = order.price
+            order.price = price
+            if order.time_in_force == "PostOnly" and book.crosses(order):
+                order.price = old_price
+                return {"Err": f"改单后会成为taker: {cid}"}
+            if amount is not None:
+                order.amount = max(amount, order.filled)
+            book.remove(order)
+            order.timestamp = int(self.clock.now_ms)
+            book.rest(order)
+            self._push_order(order)
+            return {"Ok": order.id}
+
+    def _request(self, endpoint, sync, arrive, callback, callback_args):
+        """按延迟与丢包模型发送一个请求
+        arrive: 到达交易所时执行的函数, 返回交易所的处理结果
+        callback: 异步请求完成后回调策略的方法名
+        """
+        self.stats["requests"] += 1
+        latency = self.latency.sample(endpoint)
+        request_dropped = self._dropped(endpoint, "request")
+        response_dropped = not request_dropped and self._dropped(endpoint, "response")
+        if request_dropped:
+            self.stats["dropped_requests"] += 1
+        elif response_dropped:
+            self.stats["dropped_responses"] += 1
+
+        def deliver():
+            result = arrive() if not request_dropped else None
+            if sync:
+                return
+            if request_dropped or response_dropped:
+                result = {"Err": f"请求超时: {endpoint}"}
+                self.schedule(
+                    self.timeout_ms - latency,
+                    getattr(self.strategy, callback),
+                    *callback_args(result),
+                )
+                return
+            self.schedule(
+                latency, getattr(self.strategy, callback), *callback_args(result)
+            )
+
+        self.schedule(latency, deliver)
+        if request_dropped or response_dropped:
+            return {"Err": f"请求超时: {endpoint}"} if sync else None
+        return None
+
+    # ========================交易接口=========================
+    def place_order(
+        self, account_id, order, params=None, extra=None, sync=True, generate=False
+    ):
+        with self.lock:
+            sim_order = SimOrder(f"sim-{next(self.order_ids)}", account_id, order)
+            self.orders[(account_id, sim_order.cid)] = sim_order
+            res = self._request(
+                "place_order",
+                sync,
+                lambda: self._arrive_place(sim_order) or {"Ok": sim_order.id},
+                "on_order_submitted",
+                lambda result: (account_id, result, dict(order)),
+            )
+            if res is not None:
+                return res
+            return {"Ok": sim_order.id} if sync else None
+
+    def batch_place_order(
+        self, account_id, orders, params=None, extra=None, sync=True, generate=False
+    ):
+        with self.lock:
+            sim_orders = []
+            for order in orders:
+                sim_order = SimOrder(f"sim-{next(self.order_ids)}", account_id, order)
+                self.orders[(account_id, sim_order.cid)] = sim_order
+                sim_orders.append(sim_order)
+
+            def arrive():
+                for sim_order in sim_orders:
+                    self._arrive_place(sim_order)
+                return {"Ok": [sim_order.id for sim_order in sim_orders]}
+
+            res = self._request(
+                "batch_place_order",
+                sync,
+                arrive,
+                "on_batch_order_submitted",
+                lambda result: (account_id, result),
+            )
+            if res is not None:
+                return res
+            return {"Ok": [o.id for o in sim_orders]} if sync else None
+
+    def amend_order(self, account_id, order, extra=None, sync=True, generate=False):
+        with self.lock:
+            cid = order.get("cid", None)
+            res = self._request(
+                "amend_order",
+                sync,
+                lambda: self._arrive_amend(
+                    account_id, cid, float(order["price"]), order.get("amount", None)
+                ),
+                "on_order_amended",
+                lambda result: (account_id, result, dict(order)),
+            )
+            if res is not None:
+                return res
+            return {"Ok": cid} if sync else None
+
+    def _find_cid(self, account_id, order_id):
+        for (account, cid), order in self.orders.items():
+            if account == account_id and order.id == order_id:
+                return cid
+        return None
+
+    def cancel_order(
+        self,
+        account_id,
+        symbol,
+        order_id=None,
+        cid=None,
+        extra=None,
+        sync=True,
+        generate=False,
+    ):
+        with self.lock:
+            cid = cid or self._find_cid(account_id, order_id)
+            res = self._request(
+                "cancel_order",
+                sync,
+                lambda: self._arrive_cancel(account_id, cid, symbol),
+                "on_order_canceled",
+                lambda result: (account_id, result, order_id or cid, symbol),
+            )
+            if res is not None:
+                return res
+            return {"Ok": cid} if sync else None
+
+    def batch_cancel_order(
+        self, account_id, symbol, extra=None, sync=True, generate=False
+    ):
+        with self.lock:
+
+            def arrive():
+                cids = [
+                    cid
+                    for (account, cid), order in list(self.orders.items())
+                    if account == account_id
+                    and order.symbol == symbol
+                    and order.status in ("Open", "PartiallyFilled")
+                ]
+                return {
+                    "Ok": [self._arrive_cancel(account_id, cid, symbol) for cid in cids]
+                }
+
+            res = self._request(
+                "batch_cancel_order",
+                sync,
+                arrive,
+                "on_batch_order_canceled",
+                lambda result: (account_id, result),
+            )
+            if res is not None:
+                return res
+            return {"Ok": []} if sync else None
+
+    def batch_cancel_order_by_id(
+        self,
+        account_id,
+        symbol=None,
+        order_ids=None,
+        client_order_ids=None,
+        extra=None,
+        sync=True,
+        generate=False,
+    ):
+        with self.lock:
+            cids = list(client_order_ids or []) + [
+                self._find_cid(account_id, order_id) for order_id in order_ids or []
+            ]
+            res = self._request(
+                "batch_cancel_order_by_id",
+                sync,
+                lambda: {
+                    "Ok": [
+                        self._arrive_cancel(account_id, cid, symbol) for cid in cids
+                    ]
+                },
+                "on_batch_order_canceled_by_ids",
+                lambda result: (account_id, result),
+            )
+            if res is not None:
+                return res
+            return {"Ok": cids} if sync else None
+
+    # ========================查询接口=========================
+    def get_open_orders(self, account_id, symbol, extra=None, generate=False):
+        with self.lock:
+            return {
+                "Ok": [
+                    order.to_dict()
+                    for (account, _), order in self.orders.items()
+                    if account == account_id
+                    and order.symbol == symbol
+                    and order.status in ("Open", "PartiallyFilled")
+                ]
+            }
+
+    def get_all_open_orders(self, account_id, extra=None, generate=False):
+        with self.lock:
+            return {
+                "Ok": [
+                    order.to_dict()
+                    for (account, _), order in self.orders.items()
+                    if account == account_id
+                    and order.status in ("Open", "PartiallyFilled")
+                ]
+            }
+
+    def get_order_by_id(
+        self, account_id, symbol, order_id=None, cid=None, extra=None, generate=False
+    ):
+        with self.lock:
+            cid = cid or self._find_cid(account_id, order_id)
+            order = self.orders.get((account_id, cid), None)
+            if order is None:
+                return {"Err": f"订单不存在: {order_id or cid}"}
+            return {"Ok": order.to_dict()}
+
+    def get_orders(self, account_id, symbol, start, end, extra=None, generate=False):
+        with self.lock:
+            return {
+                "Ok": [
+                    order.to_dict()
+                    for (account, _), order in self.orders.items()
+                    if account == account_id
+                    and order.symbol == symbol
+                    and order.timestamp is not None
+                    and start <= order.timestamp <= end
+                ]
+            }
+
+    def get_position(self, account_id, symbol, extra=None, generate=False):
+        with self.lock:
+            return {"Ok": self._position_dict(account_id, symbol)}
+
+    def get_positions(self, account_id, extra=None, generate=False):
+        with self.lock:
+            return {
+                "Ok": [
+                    self._position_dict(account, symbol)
+                    for account, symbol in self.positions
+                    if account == account_id
+                ]
+            }
+
+    def get_instruments(self, account_id, extra=None, generate=False):
+        return {"Ok": self.instruments.get(account_id, [])}
+
+    def get_instrument(self, account_id, symbol, extra=None, generate=False):
+        for instrument in self.instruments.get(account_id, []):
+            if instrument.get("symbol", None) == symbol:
+                return {"Ok": instrument}
+        return {"Err": f"交易对不存在: {symbol}"}
+
+    def get_bbo(self, account_id, symbol, extra=None, generate=False):
+        book = self.books.get(symbol, None)
+        if book is None or book.bid_price is None:
+            return {"Err": f"没有行情: {symbol}"}
+        return {
+            "Ok": {
+                "symbol": symbol,
+                "bid_price": book.bid_price,
+                "bid_qty": book.bid_qty,
+                "ask_price": book.ask_price,
+                "ask_qty": book.ask_qty,
+                "timestamp": int(self.clock.now_ms),
+            }
+        }
+
+    def get_usdt_balance(self, account_id, extra=None, generate=False):
+        if account_id not in self.balances:
+            return {"Err": "未设置余额"}
+        return {
+            "Ok": {"asset": "USDT", "available_balance": self.balances[account_id]}
+        }
+
+    def get_max_position(
+        self, account_id, symbol, level=None, extra=None, generate=False
+    ):
+        if symbol not in self.max_positions:
+            return {"Err": "未设置最大可持仓"}
+        limit = self.max_positions[symbol]
+        return {"Ok": {"long": limit, "short": limit}}
+
+    def get_kline(
+        self,
+        account_id,
+        symbol,
+        interval,
+        start_time=None,
+        end_time=None,
+        limit=None,
+        extra=None,
+        generate=False,
+    ):
+        return {"Ok": []}
+
+    # ========================其它接口=========================
+    def create_cid(self, exchange):
+        return f"sim-cid-{next(self.cids)}"
+
+    def log(self, msg, level=None, color=None, web=True):
+        self.logs.append((int(self.clock.now_ms), level, msg))
+        if self.verbose:
+            print(f"[{int(self.clock.now_ms)}][{level}] {msg}")
+
+    def tlog(self, tag, msg, color=None, interval=0, level=None, query=False):
+        last = self.tlog_times.get(tag, None)
+        if last is not None and self.clock.now_ms - last < interval * 1000:
+            return
+        self.tlog_times[tag] = self.clock.now_ms
+        self.log(msg, level=level)
+
+    def logt(self, message, time, color=None, level=None):
+        self.log(message, level=level)
+
+    def cache_save(self, data):
+        self.cache = data
+        return {"Ok": None}
+
+    def cache_load(self):
+        return self.cache
+
+    def is_web_soft_stopped(self):
+        return self.web_flags["soft_stopped"]
+
+    def is_web_opening_stopped(self):
+        return self.web_flags["opening_stopped"]
+
+    def is_web_force_closing(self):
+        return self.web_flags["force_closing"]
+
+    def set_web_flag(self, name, value=True):
+        """设置平台控制指令, name: soft_stopped / opening_stopped / force_closing"""
+        if name not in self.web_flags:
+            raise ValueError(f"未知的平台控制指令: {name}")
+        self.web_flags[name] = value
+
+    def graceful_shutdown(self):
+        self.strategy.on_stop()
+
+    def _unsupported(self, *args, **kwargs):
+        return {"Err": "模拟交易所不支持该接口"}
+
+
+# 模拟交易所用不到的接口统一返回错误
+for _name in SimTrader.__abstractmethods__:
+    if _name not in SimTrader.__dict__:
+        setattr(SimTrader, _name, SimTrader._unsupported)
+abc.update_abstractmethods(SimTrader)
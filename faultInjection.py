@@ -0,0 +1,526 @@
+"""
+faultInjection.py
+
+网络故障与延迟注入, 用于验证撤单延迟、改单丢失、对冲单被拒绝、websocket断开时策略的表现(problem.md 第2、3条)。
+
+- FaultyTrader: 包装任意Trader, 按规则对请求注入延迟、丢失与前N次拒绝
+- FaultyCallbacks: 包装策略, 对交易所推送注入丢失、重复、延迟与乱序, 并模拟websocket断开
+- 场景文件(scenarios/*.toml)描述行情、故障与断言, 在本地模拟交易所(exchangeSimulator.py)上运行,
+  按交易所侧的真实成交统计最大裸头寸与对冲耗时
+
+用法:
+    python faultInjection.py scenarios/*.toml
+任一场景断言失败时退出码为1, CI(.github/workflows/scenarios.yml)在每次提交时运行所有场景。
+"""
+
+import abc
+import argparse
+import copy
+import functools
+import inspect
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tomllib
+from collections import Counter
+from pathlib import Path
+
+from interface.trader import Trader
+from exchangeSimulator import LatencyModel, SimTrader
+
+
+class CallFault:
+    """一条请求故障规则, 只作用于时间窗口内匹配接口与账户的请求"""
+
+    def __init__(self, spec):
+        self.endpoint = spec["endpoint"]  # Trader的方法名
+        self.account_id = spec.get("account_id", None)  # 未指定时匹配所有账户
+        self.start_ms = spec.get("start_ms", 0)  # 相对开始时间的生效窗口
+        self.end_ms = spec.get("end_ms", None)
+        self.reject_count = spec.get("reject_count", 0)  # 前N次请求直接返回错误
+        self.drop_rate = spec.get("drop_rate", 0.0)  # 请求丢失的概率
+        self.delay_ms = spec.get("delay_ms", 0.0)  # 请求发出前的额外延迟
+        self.rejected = 0
+
+    def matches(self, endpoint, account_id, elapsed_ms):
+        if endpoint != self.endpoint:
+            return False
+        if self.account_id is not None and account_id != self.account_id:
+            return False
+        if elapsed_ms < self.start_ms:
+            return False
+        return self.end_ms is None or elapsed_ms <= self.end_ms
+
+
+class CallbackFault:
+    """一条推送故障规则"""
+
+    def __init__(self, spec):
+        self.callback = spec["callback"]  # 策略回调名, 如on_order
+        self.account_id = spec.get("account_id", None)  # 未指定时匹配所有账户
+        self.start_ms = spec.get("start_ms", 0)
+        self.end_ms = spec.get("end_ms", None)
+        self.drop_rate = spec.get("drop_rate", 0.0)  # 推送丢失的概率
+        self.duplicate_rate = spec.get("duplicate_rate", 0.0)  # 推送重复的概率
+        self.delay_ms = spec.get("delay_ms", 0.0)  # 推送的额外延迟
+        self.reorder_rate = spec.get("reorder_rate", 0.0)  # 推送被下一条同类推送超过的概率
+
+    def matches(self, callback, account_id, elapsed_ms):
+        if callback != self.callback:
+            return False
+        if self.account_id is not None and account_id != self.account_id:
+            return False
+        if elapsed_ms < self.start_ms:
+            return False
+        return self.end_ms is None or elapsed_ms <= self.end_ms
+
+
+def _thread_schedule(delay_ms, fn, *args):
+    """没有模拟交易所时使用线程定时器延迟执行"""
+    timer = threading.Timer(delay_ms / 1000, fn, args)
+    timer.daemon = True
+    timer.start()
+
+
+class FaultyTrader(Trader):
+    """在请求发往交易所前注入故障的Trader包装"""
+
+    def __init__(
+        self, trader, faults=(), clock=None, schedule=None, sleep=None, seed=None
+    ):
+        self.trader = trader  # 被包装的交易执行器
+        self.faults = [f if isinstance(f, CallFault) else CallFault(f) for f in faults]
+        self.clock = clock or (lambda: time.time() * 1000)  # 当前时间，单位为毫秒
+        self.schedule = schedule or _thread_schedule  # schedule(延迟毫秒, 函数, *参数)
+        self.sleep = sleep or time.sleep  # 同步请求的延迟
+        self.rng = random.Random(seed)
+        self.start_ms = self.clock()
+        self.stats = Counter()  # <(接口, 故障类型), 次数>
+
+    def __getattr__(self, name):
+        return getattr(self.trader, name)
+
+    def _call(self, endpoint, *args, **kwargs):
+        call = getattr(self.trader, endpoint)
+        if not self.faults:
+            return call(*args, **kwargs)
+        bound = _SIGNATURES[endpoint].bind_partial(None, *args, **kwargs).arguments
+        account_id = bound.get("account_id", None)
+        sync = bound.get("sync", True)
+        elapsed_ms = self.clock() - self.start_ms
+        for fault in self.faults:
+            if fault.matches(endpoint, account_id, elapsed_ms):
+                break
+        else:
+            return call(*args, **kwargs)
+
+        if fault.rejected < fault.reject_count:
+            fault.rejected += 1
+            self.stats[(endpoint, "reject")] += 1
+            return {"Err": f"注入错误: {endpoint} 被拒绝({fault.rejected}/{fault.reject_count})"}
+        if fault.drop_rate > 0 and self.rng.random() < fault.drop_rate:
+            # 请求没有到达交易所, 异步请求也不会有回调
+            self.stats[(endpoint, "drop")] += 1
+            return {"Err": f"注入错误: {endpoint} 请求超时"} if sync else None
+        if fault.delay_ms > 0:
+            self.stats[(endpoint, "delay")] += 1
+            if not sync:
+                self.schedule(fault.delay_ms, functools.partial(call, *args, **kwargs))
+                return None
+            self.sleep(fault.delay_ms / 1000)
+        return call(*args, **kwargs)
+
+
+# Trader各方法的签名, 用于取出account_id与sync参数
+_SIGNATURES = {}
+for _name in sorted(Trader.__abstractmethods__):
+    _SIGNATURES[_name] = inspect.signature(getattr(Trader, _name))
+
+    def _forward(self, *args, _endpoint=_name, **kwargs):
+        return self._call(_endpoint, *args, **kwargs)
+
+    _forward.__name__ = _name
+    setattr(FaultyTrader, _name, _forward)
+abc.update_abstractmethods(FaultyTrader)
+
+
+class FaultyCallbacks:
+    """策略的包装, 交易所推送经过这里注入故障后再到达策略, 其它属性直接转发到策略"""
+
+    # websocket推送, 断开期间丢失; 请求结果回调(on_order_submitted等)走REST, 不受断开影响
+    WS_CALLBACKS = (
+        "on_bbo",
+        "on_depth",
+        "on_ticker",
+        "on_trade",
+        "on_order",
+        "on_order_and_fill",
+        "on_position",
+        "on_balance",
+        "on_funding",
+        "on_mark_price",
+        "on_kline",
+    )
+    RESULT_CALLBACKS = (
+        "on_order_submitted",
+        "on_batch_order_submitted",
+        "on_order_amended",
+        "on_order_canceled",
+        "on_batch_order_canceled",
+        "on_batch_order_canceled_by_ids",
+    )
+
+    def __init__(
+        self, strategy, exchanges, faults=(), clock=None, schedule=None, seed=None
+    ):
+        self.strategy = strategy  # 被包装的策略
+        self.exchanges = list(exchanges)  # 账户对应的交易所名称
+        self.faults = [
+            f if isinstance(f, CallbackFault) else CallbackFault(f) for f in faults
+        ]
+        self.clock = clock or (lambda: time.time() * 1000)
+        self.schedule = schedule or _thread_schedule
+        self.rng = random.Random(seed)
+        self.start_ms = self.clock()
+        self.disconnected = set()  # 已断开websocket的账户
+        self.held = {}  # <回调名, 等待被下一条推送超过的推送参数>
+        self.stats = Counter()  # <(回调名, 故障类型), 次数>
+
+    def __getattr__(self, name):
+        if name in self.WS_CALLBACKS or name in self.RESULT_CALLBACKS:
+            return functools.partial(self._deliver, name)
+        return getattr(self.strategy, name)
+
+    def _account_of(self, name, args):
+        """推送所属的账户, ws推送的第一个参数是交易所名称, 请求结果回调的第一个参数是账户"""
+        if name in self.RESULT_CALLBACKS:
+            return args[0]
+        if args and args[0] in self.exchanges:
+            return self.exchanges.index(args[0])
+        return None
+
+    def _deliver(self, name, *args):
+        account_id = self._account_of(name, args)
+        if name in self.WS_CALLBACKS and account_id in self.disconnected:
+            self.stats[(name, "disconnected")] += 1
+            return
+        elapsed_ms = self.clock() - self.start_ms
+        for fault in self.faults:
+            if fault.matches(name, account_id, elapsed_ms):
+                break
+        else:
+            fault = None
+        if fault is None:
+            self._invoke(name, args, fault)
+            return
+
+        if fault.drop_rate > 0 and self.rng.random() < fault.drop_rate:
+            self.stats[(name, "drop")] += 1
+            return
+        if fault.reorder_rate > 0 and self.rng.random() < fault.reorder_rate:
+            if name not in self.held:
+                # 暂存这条推送, 下一条同类推送先到达
+                self.stats[(name, "reorder")] += 1
+                self.held[name] = args
+                return
+        if fault.delay_ms > 0:
+            self.stats[(name, "delay")] += 1
+            self.schedule(fault.delay_ms, self._invoke, name, args, fault)
+            return
+        self._invoke(name, args, fault)
+
+    def _invoke(self, name, args, fault):
+        callback = getattr(self.strategy, name)
+        callback(*args)
+        if fault is not None and fault.duplicate_rate > 0 and self.rng.random() < fault.duplicate_rate:
+            self.stats[(name, "duplicate")] += 1
+            callback(*args)
+        held = self.held.pop(name, None)
+        if held is not None:
+            callback(*held)
+
+    def disconnect(self, account_id):
+        """模拟账户的websocket断开, 断开期间的推送全部丢失"""
+        self.disconnected.add(account_id)
+        self.strategy.on_ws_disconnected(self.exchanges[account_id], account_id)
+
+    def reconnect(self, account_id):
+        self.disconnected.discard(account_id)
+        self.strategy.on_ws_connected(self.exchanges[account_id], account_id)
+
+
+# ========================场景=========================
+DEFAULT_CONFIG = Path(__file__).with_name("strategy.toml")
+DEFAULT_EXCHANGES = ("BinanceSwap", "BinanceDelivery")
+
+
+def merge_config(base, overrides):
+    """把场景中的策略配置合并到基础配置, 表按键递归合并, 其它值直接覆盖"""
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key, None), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def pair_symbols(config, translate):
+    """配置中的(现货, 交割合约)交易所symbol"""
+    pairs = config.get("pairs", [])
+    if isinstance(pairs, dict):
+        pairs = [pairs]
+    result = []
+    for pair in pairs:
+        futures = pair.get("futures", None) or [pair.get("future", None)]
+        for future in futures:
+            if future:
+                result.append((pair["spot"], translate(future)))
+    return result
+
+
+def generate_market(market, symbols, start_ms):
+    """按场景参数生成BBO行情: 现货价格围绕spot_price波动, 交割合约按basis加噪声
+    price_drift与basis_drift为每秒的线性漂移, 用于让均线偏离网格基准价格、触发网格调整
+    """
+    rng = random.Random(market.get("seed", 1))
+    interval_ms = market.get("interval_ms", 10)
+    steps = int(market.get("duration_s", 60) * 1000 / interval_ms)
+    spot_price = market.get("spot_price", 2500.0)
+    price_std = market.get("price_std", 0.5)
+    price_drift = market.get("price_drift", 0.0)  # 现货价格每秒的变化
+    basis = market.get("basis", 0.01)
+    basis_std = market.get("basis_std", 0.0012)
+    basis_drift = market.get("basis_drift", 0.0)  # 基差每秒的变化
+    spread = market.get("spread", 0.02)
+    future_spread = market.get("future_spread", 0.6)
+    qty = market.get("qty", 1.0)
+    spots = list(dict.fromkeys(spot for spot, _ in symbols))
+    events = []
+    ts = start_ms
+    for step in range(steps):
+        ts += interval_ms
+        elapsed_s = step * interval_ms / 1000
+        spot_mid = spot_price + price_drift * elapsed_s + rng.gauss(0, price_std)
+        for spot in spots:
+            events.append(_bbo(spot, spot_mid, spread, qty, ts))
+        for _, future in symbols:
+            future_mid = spot_mid * (
+                1 + basis + basis_drift * elapsed_s + rng.gauss(0, basis_std)
+            )
+            events.append(_bbo(future, future_mid, future_spread, qty, ts))
+    return events
+
+
+def _bbo(symbol, mid, spread, qty, ts):
+    return {
+        "type": "bbo",
+        "symbol": symbol,
+        "bid_price": round(mid - spread / 2, 2),
+        "bid_qty": qty,
+        "ask_price": round(mid + spread / 2, 2),
+        "ask_qty": qty,
+        "timestamp": ts,
+    }
+
+
+def _instrument(symbol):
+    """场景未指定交易对信息时使用的默认精度"""
+    return {"symbol": symbol, "price_tick": 0.01, "amount_tick": 0.001}
+
+
+def measure_exposure(fills, end_ms, eps=1e-9):
+    """按交易所侧的成交统计每个币种的裸头寸(现货与合约持仓之和)与对冲耗时"""
+    net = {}  # <币种, 净头寸>
+    naked_since = {}  # <币种, 开始出现裸头寸的时间>
+    max_naked = 0.0
+    max_time_to_hedge = 0.0
+    unhedged_episodes = 0
+    for fill in sorted(fills, key=lambda f: f["timestamp"]):
+        asset = fill["symbol"].split("_")[0]
+        signed = fill["amount"] if fill["side"].lower() == "buy" else -fill["amount"]
+        before = net.get(asset, 0.0)
+        after = before + signed
+        net[asset] = after
+        max_naked = max(max_naked, abs(after))
+        if abs(before) <= eps < abs(after):
+            naked_since[asset] = fill["timestamp"]
+            unhedged_episodes += 1
+        elif abs(after) <= eps and asset in naked_since:
+            max_time_to_hedge = max(
+                max_time_to_hedge, fill["timestamp"] - naked_since.pop(asset)
+            )
+    for since in naked_since.values():
+        # 结束时仍未对冲的按到结束时间计算
+        max_time_to_hedge = max(max_time_to_hedge, end_ms - since)
+    positions = {}  # <(账户, symbol), 持仓>
+    for fill in fills:
+        key = (fill["account_id"], fill["symbol"])
+        signed = fill["amount"] if fill["side"].lower() == "buy" else -fill["amount"]
+        positions[key] = positions.get(key, 0.0) + signed
+    return {
+        "fills": len(fills),
+        "final_position": max((abs(v) for v in positions.values()), default=0.0),
+        "max_naked_exposure": max_naked,
+        "final_naked_exposure": max((abs(v) for v in net.values()), default=0.0),
+        "max_time_to_hedge_ms": max_time_to_hedge,
+        "unhedged_episodes": unhedged_episodes,
+    }
+
+
+# <断言名, (指标名, 比较方式)>
+ASSERTIONS = {
+    "max_naked_exposure": ("max_naked_exposure", "le"),
+    "max_final_naked_exposure": ("final_naked_exposure", "le"),
+    "max_time_to_hedge_ms": ("max_time_to_hedge_ms", "le"),
+    "min_fills": ("fills", "ge"),
+    "max_final_position": ("final_position", "le"),
+    "min_flattens": ("flattens", "ge"),
+    "min_flatten_resting_orders": ("flatten_resting_orders", "ge"),
+}
+
+
+def check_assertions(metrics, assertions):
+    failures = []
+    for name, limit in assertions.items():
+        if name not in ASSERTIONS:
+            failures.append(f"未知的断言: {name}")
+            continue
+        metric, op = ASSERTIONS[name]
+        value = metrics.get(metric, 0)
+        if (op == "le" and value > limit) or (op == "ge" and value < limit):
+            failures.append(f"{metric}={value} 不满足 {name}={limit}")
+    return failures
+
+
+def _count_flatten(flatten, stats):
+    """统计平仓次数与平仓时的挂单数量"""
+
+    @functools.wraps(flatten)
+    def wrapper(grid_pairs, *args, **kwargs):
+        stats["calls"] += 1
+        stats["resting_orders"] += sum(
+            len(grid_pair.pending_orders) for grid_pair in grid_pairs
+        )
+        return flatten(grid_pairs, *args, **kwargs)
+
+    return wrapper
+
+
+def run_scenario(path, strategy_module="strategyV2"):
+    """运行一个场景文件, 返回(指标, 失败的断言)"""
+    with open(path, "rb") as f:
+        scenario = tomllib.load(f)
+    module = __import__(strategy_module)
+    with open(scenario.get("base_config", DEFAULT_CONFIG), "rb") as f:
+        config = merge_config(tomllib.load(f), scenario.get("strategy", {}))
+    exchanges = scenario.get("exchanges", list(DEFAULT_EXCHANGES))
+    seed = scenario.get("seed", 1)
+    start_ms = scenario.get("start_ms", 1_700_000_000_000)
+
+    symbols = pair_symbols(config, module.InstrumentCache.translate_to_exchange)
+    instruments = scenario.get("instruments", None) or {
+        0: [_instrument(spot) for spot in dict.fromkeys(spot for spot, _ in symbols)],
+        1: [_instrument(future) for _, future in symbols],
+    }
+    instruments = {int(k): v for k, v in instruments.items()}
+    latency_config = dict(scenario.get("latency", {}))
+    csv_paths = latency_config.pop("csv", None)
+    latency = (
+        LatencyModel.from_csv(csv_paths, seed=seed, **latency_config)
+        if csv_paths
+        else LatencyModel(seed=seed, **latency_config)
+    )
+    sim = SimTrader(
+        exchanges=exchanges,
+        instruments=instruments,
+        latency=latency,
+        loss=scenario.get("loss", {}),
+        start_ms=start_ms,
+        seed=seed,
+    )
+    clock = lambda: sim.clock.now_ms  # noqa: E731
+    trader = FaultyTrader(
+        sim,
+        scenario.get("call_faults", []),
+        clock=clock,
+        schedule=sim.schedule,
+        sleep=sim.clock.sleep,
+        seed=seed,
+    )
+    market = scenario.get("market", {})
+    events = generate_market(market, symbols, start_ms)
+    end_ms = (events[-1]["timestamp"] if events else start_ms) + market.get(
+        "settle_ms", 5000
+    )
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        # 策略的统计文件写到临时目录, 不留在仓库中
+        os.chdir(workdir)
+        try:
+            cex_configs = [{"exchange": exchange} for exchange in exchanges]
+            sim.bind(module)  # 策略创建线程池之前替换为虚拟线程
+            strategy = module.Strategy(cex_configs, [], config, trader)
+            flatten_stats = Counter()
+            if hasattr(strategy, "flatten"):
+                strategy.flatten = _count_flatten(strategy.flatten, flatten_stats)
+            callbacks = FaultyCallbacks(
+                strategy,
+                exchanges,
+                scenario.get("callback_faults", []),
+                clock=clock,
+                schedule=sim.schedule,
+                seed=seed,
+            )
+            sim.attach(callbacks, modules=[module])
+            for event in scenario.get("events", []):
+                if event["action"] == "set_web_flag":
+                    # 平台控制指令: soft_stopped / opening_stopped / force_closing
+                    sim.schedule(
+                        event["at_ms"],
+                        sim.set_web_flag,
+                        event["flag"],
+                        event.get("value", True),
+                    )
+                    continue
+                action = getattr(callbacks, event["action"])  # disconnect / reconnect
+                sim.schedule(event["at_ms"], action, event["account_id"])
+
+            sim.run(events, until_ms=end_ms)
+            strategy.on_stop()
+        finally:
+            os.chdir(cwd)
+
+    metrics = measure_exposure(sim.fills, end_ms)
+    metrics["flattens"] = flatten_stats["calls"]
+    metrics["flatten_resting_orders"] = flatten_stats["resting_orders"]
+    metrics["call_faults"] = dict(trader.stats)
+    metrics["callback_faults"] = dict(callbacks.stats)
+    metrics["sim"] = dict(sim.stats)
+    return metrics, check_assertions(metrics, scenario.get("assertions", {}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="运行故障注入场景")
+    parser.add_argument("scenarios", nargs="+", help="场景文件")
+    parser.add_argument("--strategy", default="strategyV2", help="策略模块")
+    args = parser.parse_args(argv)
+    failed = 0
+    for path in args.scenarios:
+        metrics, failures = run_scenario(path, args.strategy)
+        status = "FAIL" if failures else "PASS"
+        print(f"[{status}] {path}")
+        for key, value in metrics.items():
+            print(f"    {key}: {value}")
+        for failure in failures:
+            print(f"    断言失败: {failure}")
+        failed += bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
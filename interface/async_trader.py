@@ -0,0 +1,331 @@
+"""
+async_trader.py
+
+Trader的asyncio适配层。下单、改单、撤单及其批量版本以sync=False提交, 返回一个awaitable,
+在框架回调(on_order_submitted、on_order_canceled、on_order_amended、on_batch_*)到达时完成。
+批量回报不带订单标识, 同一账户同类批量请求逐个提交, 回报交给当前等待中的请求。
+AsyncStrategy在独立线程中运行事件循环, 把框架回调转发到循环上执行, 策略逻辑都在同一个线程中
+交替执行, 不需要自旋锁。
+"""
+
+import asyncio
+import inspect
+import itertools
+import threading
+from collections import deque
+
+from interface.base_strategy import BaseStrategy
+
+
+class AsyncTrader:
+    """Trader的awaitable包装, 未包装的方法直接转发到原Trader"""
+
+    def __init__(self, trader, loop, timeout=10):
+        self.trader = trader  # 原交易执行器
+        self.loop = loop  # 回报在此事件循环上完成
+        self.timeout = timeout  # 等待回报的超时时间，单位为秒
+        self.waiters = {}  # <(类型, 账户, 订单标识), 等待回报的future队列>
+        self.batch_locks = {}  # <(类型, 账户), asyncio.Lock>, 同类批量请求逐个提交
+        self.batch_tokens = {}  # <(类型, 账户), 等待回报的批量请求标识>
+        self.tokens = itertools.count(1)
+
+    def __getattr__(self, name):
+        return getattr(self.trader, name)
+
+    @staticmethod
+    def _order_key(order):
+        """订单的标识, 优先使用cid"""
+        return order.get("cid", None) or order.get("id", None)
+
+    async def _submit(self, key, call):
+        """登记等待回报后提交请求, 等待回调完成"""
+        future = self.loop.create_future()
+        self.waiters.setdefault(key, deque()).append(future)
+        try:
+            res = call()
+        except Exception as e:
+            self._discard(key, future)
+            return {"Err": f"提交失败: {e}"}
+        if isinstance(res, dict) and "Err" in res:
+            # 提交时已经失败，不会再有回调
+            self._discard(key, future)
+            return res
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._discard(key, future)
+            return {"Err": f"等待回报超时: {key}"}
+
+    async def _submit_batch(self, kind, account_id, call):
+        """提交批量请求, 同一账户同类批量请求逐个提交, 每个请求使用独立的标识等待回报"""
+        lock = self.batch_locks.setdefault((kind, account_id), asyncio.Lock())
+        async with lock:
+            token = next(self.tokens)
+            self.batch_tokens[(kind, account_id)] = token
+            try:
+                return await self._submit((kind, account_id, token), call)
+            finally:
+                self.batch_tokens.pop((kind, account_id), None)
+
+    def _discard(self, key, future):
+        waiters = self.waiters.get(key, None)
+        if waiters is None:
+            return
+        if future in waiters:
+            waiters.remove(future)
+        if not waiters:
+            del self.waiters[key]
+
+    def _resolve(self, key, result):
+        """在事件循环线程中完成最早提交的future"""
+        waiters = self.waiters.get(key, None)
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(result)
+                break
+        if not waiters:
+            self.waiters.pop(key, None)
+
+    def resolve(self, key, result):
+        """框架回调线程调用, 转到事件循环线程完成future"""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._resolve, key, result)
+
+    def _resolve_batch(self, kind, account_id, result):
+        """在事件循环线程中完成当前等待回报的批量请求, 没有等待中的请求(已超时)时丢弃"""
+        token = self.batch_tokens.get((kind, account_id), None)
+        if token is not None:
+            self._resolve((kind, account_id, token), result)
+
+    def resolve_batch(self, kind, account_id, result):
+        """框架回调线程调用, 转到事件循环线程完成批量请求的future"""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._resolve_batch, kind, account_id, result)
+
+    # ========================awaitable交易接口=========================
+    async def place_order(self, account_id, order, params=None, extra=None):
+        """下单, 返回on_order_submitted中的Result"""
+        return await self._submit(
+            ("place", account_id, self._order_key(order)),
+            lambda: self.trader.place_order(
+                account_id, order, params=params, extra=extra, sync=False
+            ),
+        )
+
+    async def batch_place_order(self, account_id, orders, params=None, extra=None):
+        """批量下单, 返回on_batch_order_submitted中的Result"""
+        return await self._submit_batch(
+            "batch_place",
+            account_id,
+            lambda: self.trader.batch_place_order(
+                account_id, orders, params=params, extra=extra, sync=False
+            ),
+        )
+
+    async def amend_order(self, account_id, order, extra=None):
+        """改单, 返回on_order_amended中的Result"""
+        return await self._submit(
+            ("amend", account_id, self._order_key(order)),
+            lambda: self.trader.amend_order(account_id, order, extra=extra, sync=False),
+        )
+
+    async def cancel_order(self, account_id, symbol, order_id=None, cid=None, extra=None):
+        """撤单, 返回on_order_canceled中的Result"""
+        return await self._submit(
+            ("cancel", account_id, order_id or cid),
+            lambda: self.trader.cancel_order(
+                account_id,
+                symbol,
+                order_id=order_id,
+                cid=cid,
+                extra=extra,
+                sync=False,
+            ),
+        )
+
+    async def batch_cancel_order(self, account_id, symbol, extra=None):
+        """撤销交易对的所有挂单, 返回on_batch_order_canceled中的Result"""
+        return await self._submit_batch(
+            "batch_cancel",
+            account_id,
+            lambda: self.trader.batch_cancel_order(
+                account_id, symbol, extra=extra, sync=False
+            ),
+        )
+
+    async def batch_cancel_order_by_id(
+        self, account_id, symbol=None, order_ids=None, client_order_ids=None, extra=None
+    ):
+        """按ID批量撤单, 返回on_batch_order_canceled_by_ids中的Result"""
+        return await self._submit_batch(
+            "batch_cancel_by_ids",
+            account_id,
+            lambda: self.trader.batch_cancel_order_by_id(
+                account_id,
+                symbol=symbol,
+                order_ids=order_ids,
+                client_order_ids=client_order_ids,
+                extra=extra,
+                sync=False,
+            ),
+        )
+
+    # ========================框架回调=========================
+    def on_order_submitted(self, account_id, order_id_result, order):
+        self.resolve(("place", account_id, self._order_key(order)), order_id_result)
+
+    def on_batch_order_submitted(self, account_id, order_ids_result):
+        self.resolve_batch("batch_place", account_id, order_ids_result)
+
+    def on_order_amended(self, account_id, result, order):
+        self.resolve(("amend", account_id, self._order_key(order)), result)
+
+    def on_order_canceled(self, account_id, result, id, symbol):
+        self.resolve(("cancel", account_id, id), result)
+
+    def on_batch_order_canceled(self, account_id, order_ids_result):
+        self.resolve_batch("batch_cancel", account_id, order_ids_result)
+
+    def on_batch_order_canceled_by_ids(self, account_id, order_ids_result):
+        self.resolve_batch("batch_cancel_by_ids", account_id, order_ids_result)
+
+
+class AsyncStrategy(BaseStrategy):
+    """asyncio策略基类
+
+    子类可以把任意回调写成 async def, 框架线程调用时转到事件循环上执行并立即返回;
+    start和on_stop会等待执行完成。普通def回调保持原来的同步调用方式。
+    下单等操作通过 self.async_trader 发起并 await 回报, 多个协程可以在同一个线程中交替执行。
+
+    子类的 __init__ 需要调用 super().__init__(trader)。重写提交回报回调时不需要调用super(),
+    等待中的future会先被完成。
+    """
+
+    # 提交回报回调, 先完成AsyncTrader中等待的future再执行子类的回调
+    RESULT_CALLBACKS = (
+        "on_order_submitted",
+        "on_batch_order_submitted",
+        "on_order_amended",
+        "on_order_canceled",
+        "on_batch_order_canceled",
+        "on_batch_order_canceled_by_ids",
+    )
+    # 需要等待执行完成的回调
+    BLOCKING_CALLBACKS = ("start", "on_stop")
+    # 返回值会被框架使用的方法, 不能写成协程
+    SYNC_METHODS = ("name", "subscribes")
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in dir(BaseStrategy):
+            if not (name == "start" or name.startswith("on_")):
+                continue
+            func = cls.__dict__.get(name, None)
+            if func is None:
+                continue
+            if name in cls.RESULT_CALLBACKS:
+                setattr(cls, name, cls._wrap_result_callback(name, func))
+            elif inspect.iscoroutinefunction(func):
+                setattr(cls, name, cls._wrap_coroutine(name, func))
+        for name in cls.SYNC_METHODS:
+            if inspect.iscoroutinefunction(cls.__dict__.get(name, None)):
+                raise TypeError(f"{cls.__name__}.{name} 不能定义为协程")
+
+    @staticmethod
+    def _wrap_coroutine(name, func):
+        blocking = name in AsyncStrategy.BLOCKING_CALLBACKS
+
+        def wrapper(self, *args, **kwargs):
+            if name == "on_stop":
+                try:
+                    return self.run(func(self, *args, **kwargs))
+                finally:
+                    self.stop_loop()
+            if blocking:
+                return self.run(func(self, *args, **kwargs))
+            return self.spawn(func(self, *args, **kwargs), name)
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = func.__doc__
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    @staticmethod
+    def _wrap_result_callback(name, func):
+        is_coroutine = inspect.iscoroutinefunction(func)
+
+        def wrapper(self, *args, **kwargs):
+            getattr(self.async_trader, name)(*args, **kwargs)
+            if is_coroutine:
+                return self.spawn(func(self, *args, **kwargs), name)
+            return func(self, *args, **kwargs)
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = func.__doc__
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    def __init__(self, trader, timeout=10):
+        self.trader = trader  # 交易执行器
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(
+            target=self._run_loop, name="async-strategy", daemon=True
+        )
+        self.loop_thread.start()
+        self.async_trader = AsyncTrader(trader, self.loop, timeout=timeout)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def spawn(self, coro, name=None):
+        """在事件循环上执行协程, 不等待结果, 异常记录到日志"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(lambda f: self._log_exception(f, name))
+        return future
+
+    def run(self, coro):
+        """在事件循环上执行协程并等待结果, 不能在事件循环线程中调用"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def _log_exception(self, future, name):
+        if future.cancelled():
+            return
+        e = future.exception()
+        if e is not None:
+            self.trader.log(f"异步回调 {name} 执行出错: {e!r}", level="ERROR")
+
+    def stop_loop(self):
+        """停止事件循环"""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join(timeout=5)
+        if not self.loop.is_running():
+            self.loop.close()
+
+    # 未被子类重写时也需要完成等待中的future
+    def on_order_submitted(self, account_id, order_id_result, order):
+        self.async_trader.on_order_submitted(account_id, order_id_result, order)
+
+    def on_batch_order_submitted(self, account_id, order_ids_result):
+        self.async_trader.on_batch_order_submitted(account_id, order_ids_result)
+
+    def on_order_amended(self, account_id, result, order):
+        self.async_trader.on_order_amended(account_id, result, order)
+
+    def on_order_canceled(self, account_id, result, id, symbol):
+        self.async_trader.on_order_canceled(account_id, result, id, symbol)
+
+    def on_batch_order_canceled(self, account_id, order_ids_result):
+        self.async_trader.on_batch_order_canceled(account_id, order_ids_result)
+
+    def on_batch_order_canceled_by_ids(self, account_id, order_ids_result):
+        self.async_trader.on_batch_order_canceled_by_ids(account_id, order_ids_result)
+
+    def on_stop(self):
+        """停止策略时停止事件循环, 子类用普通def重写时需要调用 self.stop_loop()"""
+        self.stop_loop()
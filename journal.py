@@ -0,0 +1,270 @@
+"""
+journal.py
+
+策略回调与交易请求的二进制日志。实盘出问题时只有trader.log的文本, 无法还原当时的输入与决策,
+Journal记录每一个进入策略的回调与每一个发往交易所的请求(包括结果), 供事后分析与回放(journalReplay.py)。
+
+文件格式(只追加, 小端):
+    文件开头: MAGIC
+    记录: 参数长度(u4) + 结果长度(u4) + 类型(u1) + 开始单调时钟(ns, i8) + 结束单调时钟(ns, i8)
+          + marshal((名称, 位置参数, 关键字参数)) + marshal(结果)
+每次打开日志先写一条SESSION记录, 参数为(墙上时间ns, 单调时钟ns, 版本), 用于把单调时钟换算为墙上时间;
+策略创建时写一条CONFIG记录, 参数为策略的初始化参数(cex_configs, dex_configs, config)。
+
+热路径上只做marshal序列化与deque追加, 写文件由后台线程完成, 每次回调的额外开销为几微秒。
+"""
+
+import abc
+import marshal
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+from interface.base_strategy import BaseStrategy
+from interface.trader import Trader
+
+MAGIC = b"GJNL"
+VERSION = 1
+
+SESSION = 0  # 日志会话开始
+CALLBACK = 1  # 框架调用策略的回调
+CALL = 2  # 策略调用Trader的请求
+CONFIG = 3  # 策略的初始化参数, 回放时用于创建策略
+
+HEADER = struct.Struct("<IIBqq")
+NONE_BLOB = marshal.dumps(None)
+
+
+def _plain(obj):
+    """把marshal不支持的对象转换为基础类型"""
+    if isinstance(obj, dict):
+        return {_plain(k): _plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_plain(v) for v in obj]
+    if obj is None or isinstance(obj, (bool, int, float, str, bytes)):
+        return obj
+    to_dict = getattr(obj, "to_dict", None)
+    if callable(to_dict):
+        return _plain(to_dict())
+    return repr(obj)
+
+
+def dumps(obj):
+    try:
+        return marshal.dumps(obj)
+    except ValueError:
+        return marshal.dumps(_plain(obj))
+
+
+class JournalRecord:
+    """日志中的一条记录"""
+
+    __slots__ = (
+        "kind",
+        "name",
+        "args",
+        "kwargs",
+        "result",
+        "start_ns",
+        "end_ns",
+        "wall_ns",
+    )
+
+    def __init__(self, kind, name, args, kwargs, result, start_ns, end_ns, wall_ns):
+        self.kind = kind
+        self.name = name  # 回调名或Trader方法名
+        self.args = args
+        self.kwargs = kwargs
+        self.result = result
+        self.start_ns = start_ns  # 单调时钟
+        self.end_ns = end_ns
+        self.wall_ns = wall_ns  # 开始时刻对应的墙上时间
+
+
+class Journal:
+    """只追加的二进制日志, 后台线程批量写入"""
+
+    # 不记录的Trader方法, 文本日志已经单独输出
+    SKIP_CALLS = ("log", "tlog", "logt")
+    # 不记录的策略回调, on_stop中会关闭日志
+    SKIP_CALLBACKS = ("on_stop",)
+
+    def __init__(self, path, flush_interval=0.2, max_pending=1_000_000):
+        self.path = path
+        self.flush_interval = flush_interval  # 后台线程写入间隔，单位为秒
+        self.max_pending = max_pending  # 最多缓存的未写入记录数, 超过时丢弃新记录
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.pending = deque()
+        self.dropped = 0  # 因缓存已满丢弃的记录数
+        self.written = 0  # 已写入的记录数
+        self.closed = False
+        self.wakeup = threading.Event()
+        now = time.monotonic_ns()
+        self.record(
+            SESSION,
+            now,
+            now,
+            dumps(("session", (time.time_ns(), now, VERSION), {})),
+            NONE_BLOB,
+        )
+        self.worker = threading.Thread(target=self._run, name="journal", daemon=True)
+        self.worker.start()
+
+    def record(self, kind, start_ns, end_ns, head, result):
+        """追加一条已序列化的记录, head为marshal((名称, 参数, 关键字参数)), result为marshal(结果)"""
+        if self.closed:
+            return
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append(
+            HEADER.pack(len(head), len(result), kind, start_ns, end_ns) + head + result
+        )
+
+    def record_config(self, cex_configs, dex_configs, config):
+        """记录策略的初始化参数"""
+        now = time.monotonic_ns()
+        self.record(
+            CONFIG,
+            now,
+            now,
+            dumps(("config", (cex_configs, dex_configs, config), {})),
+            NONE_BLOB,
+        )
+
+    def _drain(self):
+        pending = self.pending
+        chunks = []
+        while pending:
+            chunks.append(pending.popleft())
+        if chunks:
+            self.file.write(b"".join(chunks))
+            self.file.flush()
+            self.written += len(chunks)
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self._drain()
+        self._drain()
+
+    def close(self):
+        """写入剩余记录并关闭文件"""
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.worker.join(timeout=5)
+        self.file.close()
+
+    def wrap_callback(self, name, fn):
+        """包装策略回调, 调用前序列化参数(回调可能修改参数), 返回后记录耗时"""
+        record = self.record
+        now = time.monotonic_ns
+
+        def wrapper(*args, **kwargs):
+            start = now()
+            head = dumps((name, args, kwargs))
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                record(CALLBACK, start, now(), head, dumps({"Err": repr(e)}))
+                raise
+            record(CALLBACK, start, now(), head, NONE_BLOB)
+            return result
+
+        wrapper.__name__ = name
+        wrapper.__wrapped__ = fn
+        return wrapper
+
+    def attach(self, strategy):
+        """用实例属性覆盖策略的start与on_*回调, 框架调用时先经过日志"""
+        for name in ["start"] + [n for n in dir(BaseStrategy) if n.startswith("on_")]:
+            if name in self.SKIP_CALLBACKS:
+                continue
+            setattr(strategy, name, self.wrap_callback(name, getattr(strategy, name)))
+
+
+class JournalTrader(Trader):
+    """记录每个请求与结果的Trader包装"""
+
+    def __init__(self, trader, journal):
+        self.trader = trader  # 被包装的交易执行器
+        self.journal = journal
+
+    def __getattr__(self, name):
+        return getattr(self.trader, name)
+
+    def _call(self, endpoint, *args, **kwargs):
+        call = getattr(self.trader, endpoint)
+        if endpoint in Journal.SKIP_CALLS:
+            return call(*args, **kwargs)
+        start = time.monotonic_ns()
+        try:
+            result = call(*args, **kwargs)
+        except Exception as e:
+            self.journal.record(
+                CALL,
+                start,
+                time.monotonic_ns(),
+                dumps((endpoint, args, kwargs)),
+                dumps({"Err": repr(e)}),
+            )
+            raise
+        self.journal.record(
+            CALL,
+            start,
+            time.monotonic_ns(),
+            dumps((endpoint, args, kwargs)),
+            dumps(result),
+        )
+        return result
+
+
+for _name in Trader.__abstractmethods__:
+
+    def _forward(self, *args, _endpoint=_name, **kwargs):
+        return self._call(_endpoint, *args, **kwargs)
+
+    _forward.__name__ = _name
+    setattr(JournalTrader, _name, _forward)
+abc.update_abstractmethods(JournalTrader)
+
+
+def read_journal(path):
+    """按写入顺序读取日志记录, 末尾不完整的记录(写入中途退出)被忽略"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"不是策略日志文件: {path}")
+    offset = len(MAGIC)
+    wall_offset = 0  # 墙上时间 - 单调时钟
+    size = HEADER.size
+    while offset + size <= len(data):
+        head_len, result_len, kind, start_ns, end_ns = HEADER.unpack_from(data, offset)
+        offset += size
+        if offset + head_len + result_len > len(data):
+            break
+        name, args, kwargs = marshal.loads(data[offset : offset + head_len])
+        offset += head_len
+        result = marshal.loads(data[offset : offset + result_len])
+        offset += result_len
+        if kind == SESSION:
+            wall_offset = args[0] - args[1]
+        yield JournalRecord(
+            kind,
+            name,
+            tuple(args),
+            kwargs,
+            result,
+            start_ns,
+            end_ns,
+            start_ns + wall_offset,
+        )
@@ -0,0 +1,389 @@
+"""
+journalReplay.py
+
+按journal.py记录的回调顺序回放策略, Trader请求的结果从日志中读取, 比较不同策略版本发出的交易决策
+(下单、改单、撤单、对冲)。修改on_bbo等热路径代码后, 上线前先用实盘日志确认行为没有变化。
+
+- 回调按记录的顺序与时间执行, 策略模块中的time使用回放时钟, 取值为回调记录的墙上时间;
+  threading.Thread替换为与回放轮流执行的SimThread, 到期的sleep在下一个回调之前唤醒,
+  ThreadPoolExecutor替换为在调用线程中直接执行的InlineExecutor
+- 请求结果优先匹配参数完全相同的记录, 其次按同一接口的记录顺序取用, 都没有时返回默认结果
+- 决策按触发它的回调分组比较, 同一回调内不区分顺序(对冲腿可能在线程池中并发发出);
+  cid等由create_cid生成的标识不参与比较
+
+用法:
+    python journalReplay.py journal/strategy_0.bin                         # 回放并与日志中的决策比较
+    python journalReplay.py journal/strategy_0.bin --against strategy_new.py  # 比较两个策略版本
+任一比较存在差异时退出码为1。
+"""
+
+import abc
+import argparse
+import bisect
+import heapq
+import importlib
+import importlib.util
+import itertools
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from interface.trader import Trader
+from exchangeSimulator import InlineExecutor, SimThread, SimThreading
+from journal import CALL, CALLBACK, CONFIG, dumps, read_journal
+
+# 交易决策接口
+DECISION_CALLS = (
+    "place_order",
+    "batch_place_order",
+    "amend_order",
+    "cancel_order",
+    "batch_cancel_order",
+    "batch_cancel_order_by_id",
+)
+# 比较决策时忽略的字段, 这些标识由create_cid或交易所生成
+IGNORED_KEYS = ("cid", "client_order_ids", "order_id", "order_ids", "id")
+
+
+def _copy(value):
+    """复制日志中的数据, 策略可能原地修改回调参数与请求结果"""
+    return marshal.loads(dumps(value))
+
+
+class ReplayClock:
+    """回放时钟, 替换策略模块中的time模块, 同时为SimThread调度唤醒事件"""
+
+    def __init__(self):
+        self.now_ns = 0
+        self.events = []  # SimThread的唤醒事件堆 (时间, 序号, 函数, 参数)
+        self.seq = itertools.count()
+        self.lock = threading.RLock()
+        self.yield_timeout = 1.0  # 等待SimThread交还控制权的最长真实时间，单位为秒
+
+    def time(self):
+        return self.now_ns / 1e9
+
+    def monotonic(self):
+        return self.now_ns / 1e9
+
+    def sleep(self, seconds):
+        """SimThread中的sleep等到回放推进到唤醒时间, 回调中的sleep只推进回放时间"""
+        thread = SimThread.current()
+        if thread is not None:
+            thread.sleep(seconds * 1000)
+            return
+        with self.lock:
+            self.now_ns += int(seconds * 1e9)
+
+    def schedule(self, delay_ms, fn, *args):
+        with self.lock:
+            heapq.heappush(
+                self.events,
+                (self.now_ns + int(delay_ms * 1e6), next(self.seq), fn, args),
+            )
+
+    def set(self, wall_ns):
+        """推进到wall_ns, 依次唤醒在此之前到期的SimThread"""
+        while True:
+            with self.lock:
+                if not self.events or self.events[0][0] > wall_ns:
+                    break
+                at, _, fn, args = heapq.heappop(self.events)
+                self.now_ns = max(self.now_ns, at)
+            fn(*args)
+        with self.lock:
+            self.now_ns = max(self.now_ns, wall_ns)
+
+    def bind(self, *modules):
+        """模块中的time、threading.Thread与ThreadPoolExecutor替换为回放时钟、SimThread与InlineExecutor"""
+        for module in modules:
+            module.time = self
+            if hasattr(module, "threading"):
+                module.threading = SimThreading(self)
+            if hasattr(module, "ThreadPoolExecutor"):
+                module.ThreadPoolExecutor = InlineExecutor
+
+
+def normalize(value):
+    """去掉不参与比较的标识字段, 转换为可哈希的形式"""
+    if isinstance(value, dict):
+        return tuple(
+            sorted(
+                (key, normalize(item))
+                for key, item in value.items()
+                if key not in IGNORED_KEYS
+            )
+        )
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(item) for item in value)
+    if isinstance(value, float):
+        return round(value, 10)
+    return value
+
+
+class Decision:
+    """一个交易决策"""
+
+    __slots__ = ("callback_index", "endpoint", "args", "kwargs", "time_ms")
+
+    def __init__(self, callback_index, endpoint, args, kwargs, time_ms):
+        self.callback_index = callback_index  # 触发决策的回调序号
+        self.endpoint = endpoint
+        self.args = args
+        self.kwargs = kwargs
+        self.time_ms = time_ms
+
+    def key(self):
+        kwargs = {k: v for k, v in self.kwargs.items() if k not in ("sync", "generate")}
+        return (self.endpoint, normalize(self.args), normalize(kwargs))
+
+    def describe(self):
+        kwargs = {k: v for k, v in self.kwargs.items() if k not in ("sync", "generate")}
+        return f"{self.endpoint}{self.args} {kwargs if kwargs else ''}".rstrip()
+
+
+class ReplayTrader(Trader):
+    """从日志中读取请求结果的Trader, 记录策略发出的决策"""
+
+    def __init__(self, call_records, clock):
+        self.clock = clock
+        self.exact = {}  # <(接口, 参数), 结果队列>
+        self.by_endpoint = {}  # <接口, 结果队列>
+        self.last = {}  # <接口, 最近一次的结果>
+        for record in call_records:
+            self.exact.setdefault(
+                (record.name, dumps((record.args, record.kwargs))), deque()
+            ).append(record.result)
+            self.by_endpoint.setdefault(record.name, deque()).append(record.result)
+        self.callback_index = -1  # 当前执行的回调序号
+        self.decisions = []
+        self.unmatched = Counter()  # <接口, 没有匹配到记录的次数>
+        self.cids = 0
+        self.cache = None
+
+    def _call(self, endpoint, *args, **kwargs):
+        if endpoint in ("log", "tlog", "logt"):
+            return None
+        if endpoint in DECISION_CALLS:
+            self.decisions.append(
+                Decision(
+                    self.callback_index,
+                    endpoint,
+                    args,
+                    kwargs,
+                    self.clock.now_ns // 1_000_000,
+                )
+            )
+        if endpoint == "create_cid":
+            # cid按记录顺序取用, 保证后续回调中的cid能对应上
+            return self._take(self.by_endpoint.get(endpoint, None), endpoint)
+        results = self.exact.get((endpoint, dumps((args, kwargs))), None)
+        if results:
+            result = results.popleft()
+            self._discard(self.by_endpoint.get(endpoint, None), result)
+            self.last[endpoint] = result
+            return _copy(result)
+        return self._take(self.by_endpoint.get(endpoint, None), endpoint)
+
+    @staticmethod
+    def _discard(results, result):
+        if results is None:
+            return
+        for index, item in enumerate(results):
+            if item is result:
+                del results[index]
+                return
+
+    def _take(self, results, endpoint):
+        if results:
+            result = results.popleft()
+            self.last[endpoint] = result
+            return _copy(result)
+        self.unmatched[endpoint] += 1
+        if endpoint in self.last:
+            return _copy(self.last[endpoint])
+        return self._default(endpoint)
+
+    def _default(self, endpoint):
+        """日志中没有该接口的记录时的默认结果"""
+        if endpoint == "create_cid":
+            self.cids += 1
+            return f"replay-{self.cids}"
+        if endpoint == "cache_load":
+            return None
+        if endpoint.startswith("is_web_"):
+            return False
+        return {"Err": f"回放日志中没有 {endpoint} 的记录"}
+
+
+for _name in Trader.__abstractmethods__:
+
+    def _forward(self, *args, _endpoint=_name, **kwargs):
+        return self._call(_endpoint, *args, **kwargs)
+
+    _forward.__name__ = _name
+    setattr(ReplayTrader, _name, _forward)
+abc.update_abstractmethods(ReplayTrader)
+
+
+class Recording:
+    """读取到内存中的日志"""
+
+    def __init__(self, path):
+        records = list(read_journal(path))
+        configs = [record for record in records if record.kind == CONFIG]
+        self.init_args = configs[-1].args if configs else None  # 最近一次创建策略的参数
+        self.callbacks = sorted(
+            (record for record in records if record.kind == CALLBACK),
+            key=lambda record: record.start_ns,
+        )
+        self.calls = [record for record in records if record.kind == CALL]
+
+    def decisions(self):
+        """日志中记录的决策, 按请求开始时间归到当时正在执行的回调"""
+        starts = [record.start_ns for record in self.callbacks]
+        decisions = []
+        for record in self.calls:
+            if record.name not in DECISION_CALLS:
+                continue
+            decisions.append(
+                Decision(
+                    bisect.bisect_right(starts, record.start_ns) - 1,
+                    record.name,
+                    record.args,
+                    record.kwargs,
+                    record.wall_ns // 1_000_000,
+                )
+            )
+        return decisions
+
+
+def load_strategy_module(spec):
+    """按模块名或文件路径加载策略模块, 文件路径使用独立的模块名, 两个版本可以同时加载"""
+    if not spec.endswith(".py"):
+        return importlib.import_module(spec)
+    name = "replay_" + os.path.splitext(os.path.basename(spec))[0]
+    module_spec = importlib.util.spec_from_file_location(name, spec)
+    module = importlib.util.module_from_spec(module_spec)
+    sys.modules[name] = module
+    module_spec.loader.exec_module(module)
+    return module
+
+
+def replay(recording, module, init_args=None):
+    """用日志驱动一个策略版本, 返回(决策列表, ReplayTrader)"""
+    cex_configs, dex_configs, config = init_args or recording.init_args
+    config = dict(config)
+    config["journal_config"] = {"enabled": False}  # 回放时不再写日志
+    clock = ReplayClock()
+    clock.bind(module)  # 在创建策略之前替换, 策略创建的线程池与线程都使用回放版本
+    trader = ReplayTrader(recording.calls, clock)
+    if recording.callbacks:
+        clock.set(recording.callbacks[0].wall_ns)
+    strategy = module.Strategy(cex_configs, dex_configs, config, trader)
+    for index, record in enumerate(recording.callbacks):
+        clock.set(record.wall_ns)
+        trader.callback_index = index
+        args, kwargs = _copy((record.args, record.kwargs))
+        try:
+            getattr(strategy, record.name)(*args, **kwargs)
+        except Exception as e:
+            trader.decisions.append(
+                Decision(
+                    index,
+                    "exception",
+                    (record.name, repr(e)),
+                    {},
+                    clock.now_ns // 1_000_000,
+                )
+            )
+    trader.callback_index = len(recording.callbacks)
+    strategy.on_stop()
+    return trader.decisions, trader
+
+
+def diff_decisions(recording, baseline, candidate):
+    """按回调分组比较两组决策, 返回[(回调序号, 回调名, 时间, 只在baseline中, 只在candidate中)]"""
+    grouped = {}
+    for side, decisions in ((0, baseline), (1, candidate)):
+        for decision in decisions:
+            grouped.setdefault(decision.callback_index, ([], []))[side].append(decision)
+    differences = []
+    for index in sorted(grouped):
+        left, right = grouped[index]
+        left_keys = Counter(decision.key() for decision in left)
+        right_keys = Counter(decision.key() for decision in right)
+        if left_keys == right_keys:
+            continue
+        only_left = [d for d in left if _take_key(left_keys, right_keys, d)]
+        only_right = [d for d in right if _take_key(right_keys, left_keys, d)]
+        callback = (
+            recording.callbacks[index] if 0 <= index < len(recording.callbacks) else None
+        )
+        differences.append(
+            (
+                index,
+                callback.name if callback else "-",
+                callback.wall_ns // 1_000_000 if callback else None,
+                only_left,
+                only_right,
+            )
+        )
+    return differences
+
+
+def _take_key(own, other, decision):
+    """decision在own中多于other时返回True, 并消耗一次计数"""
+    key = decision.key()
+    if other.get(key, 0) > 0:
+        other[key] -= 1
+        own[key] -= 1
+        return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="回放策略日志并比较交易决策")
+    parser.add_argument("journal", help="日志文件")
+    parser.add_argument(
+        "--strategy", default="strategyV2", help="策略模块名或文件路径"
+    )
+    parser.add_argument(
+        "--against", default=None, help="对比的策略版本, 未指定时与日志中记录的决策比较"
+    )
+    parser.add_argument("--limit", type=int, default=20, help="最多输出的差异数量")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    recording = Recording(args.journal)
+    if recording.init_args is None:
+        print("日志中没有策略的初始化参数, 无法回放")
+        return 2
+    baseline, trader = replay(recording, load_strategy_module(args.strategy))
+    print(
+        f"回放 {len(recording.callbacks)} 个回调, {len(baseline)} 个决策, "
+        f"未匹配的请求: {dict(trader.unmatched)}"
+    )
+    if args.against:
+        candidate, trader = replay(recording, load_strategy_module(args.against))
+        names = (args.strategy, args.against)
+        print(f"{args.against}: {len(candidate)} 个决策, 未匹配的请求: {dict(trader.unmatched)}")
+    else:
+        baseline, candidate = recording.decisions(), baseline
+        names = ("日志", args.strategy)
+    differences = diff_decisions(recording, baseline, candidate)
+    print(f"耗时 {time.perf_counter() - started:.2f}s, 存在差异的回调: {len(differences)}")
+    for index, name, time_ms, only_left, only_right in differences[: args.limit]:
+        print(f"回调 #{index} {name} @ {time_ms}")
+        for decision in only_left:
+            print(f"    - [{names[0]}] {decision.describe()}")
+        for decision in only_right:
+            print(f"    + [{names[1]}] {decision.describe()}")
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
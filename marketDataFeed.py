@@ -0,0 +1,96 @@
+from interface.trader import Trader
+from interface.base_strategy import BaseStrategy
+from bboBoard import BboBoard
+from strategyV2 import InstrumentCache
+
+
+# 类名必须为Strategy
+class Strategy(BaseStrategy):
+    """行情进程: 订阅一次交易所BBO并写入共享内存BboBoard, 供同一台机器上的策略进程读取
+
+    配置:
+        [bbo_board]
+        name = "grid_bbo_board"  # 共享内存名称
+        capacity = 256  # 最多登记的symbol数量
+        symbols = ["ETH_USDT", "ETH_USDT_250926"]  # 订阅的symbol, 未指定时使用[[pairs]]中的symbol
+    """
+
+    def __init__(self, cex_configs, dex_configs, config, trader: Trader):
+        self.cex_configs = cex_configs  # 中心化交易所配置
+        self.dex_configs = dex_configs  # 去中心化交易所配置
+        self.config = config  # 策略配置
+        self.trader = trader  # 交易执行器
+        self.has_account = False  # 只订阅行情
+
+        self.board_config = self.config.get("bbo_board", {})
+        self.symbols = self.board_config.get("symbols", None) or self._pair_symbols()
+        if not self.symbols:
+            raise ValueError("未指定需要发布的symbol，请检查配置文件。")
+        self.board = BboBoard.create(
+            self.board_config.get("name", "grid_bbo_board"),
+            self.board_config.get("capacity", 256),
+        )
+        for symbol in self.symbols:
+            self.board.register(symbol)
+
+    def _pair_symbols(self):
+        """[[pairs]]中使用到的所有symbol"""
+        pair_configs = self.config.get("pairs", [])
+        if isinstance(pair_configs, dict):
+            pair_configs = [pair_configs]
+        symbols = []
+        for pair_config in pair_configs:
+            symbols.append(pair_config.get("spot", ""))
+            futures = pair_config.get("futures", None)
+            if isinstance(futures, list):
+                symbols.extend(futures)
+            elif pair_config.get("future", None):
+                symbols.append(pair_config["future"])
+        return list(dict.fromkeys(symbol for symbol in symbols if symbol))
+
+    def name(self):
+        """返回策略名称"""
+        return "BBO行情发布"
+
+    def subscribes(self):
+        return [
+            {
+                "account_id": 0,
+                "sub": {
+                    "SubscribeWs": [
+                        {"Bbo": self.symbols},  # 订阅最优买卖价
+                    ]
+                },
+            },
+            {
+                "sub": {
+                    "SubscribeTimer": {
+                        "name": "bbo_board_heartbeat",
+                        "update_interval": {"secs": 1, "nanos": 0},
+                    }
+                },
+            },
+        ]
+
+    def start(self):
+        """策略启动函数"""
+        self.board.touch()
+        self.trader.log(
+            f"BBO行情板已创建: {self.board_config.get('name', 'grid_bbo_board')}, symbols: {self.symbols}",
+            level="INFO",
+        )
+
+    def on_bbo(self, exchange, bbo):
+        """写入最新的BBO, 统一使用内部symbol"""
+        self.board.write(InstrumentCache.translate_to_internal(bbo["symbol"]), bbo)
+
+    def on_timer_subscribe(self, timer_name):
+        """定时更新心跳, 策略进程据此判断行情进程是否存活"""
+        if timer_name == "bbo_board_heartbeat":
+            self.board.touch()
+
+    def on_stop(self):
+        """停止时释放共享内存"""
+        if self.board is not None:
+            self.board.close()
+            self.board = None
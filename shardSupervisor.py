@@ -0,0 +1,372 @@
+"""
+shardSupervisor.py
+
+多进程分片部署: 把[[pairs]]按现货分组后分配到多个工作进程, 每个工作进程运行一个完整的
+strategyV2.Strategy, 只处理分到自己的交易对。各工作进程把持仓价值、净敞口与浮动盈亏写入
+共享内存中的RiskBoard, 由监督进程汇总并检查全局风控限制, 超限时在RiskBoard中设置停止开仓标志。
+全局持仓价值只由report_slot对应的工作进程上报一次, 避免每个工作进程重复上报。
+
+用法:
+    python shardSupervisor.py strategy.toml
+
+工作进程通过[shard_config]中的launch_command启动, 命令中的{slot}和{config}会被替换,
+同时通过环境变量GRID_SHARD_SLOT告知工作进程自己的分片编号。
+"""
+
+import os
+import sys
+import time
+import shlex
+import signal
+import subprocess
+import numpy as np
+from multiprocessing import shared_memory
+
+SHARD_SLOT_ENV = "GRID_SHARD_SLOT"  # 工作进程分片编号的环境变量
+
+
+def partition_pairs(pair_configs, shards):
+    """把交易对按现货分组后分配到各分片, 同一现货的交易对必须在同一进程中
+    每个分组的负载按交割合约数量估算, 按负载从大到小依次分给当前负载最小的分片,
+    结果只依赖配置, 所有工作进程独立计算得到相同的划分
+    """
+    if isinstance(pair_configs, dict):
+        pair_configs = [pair_configs]
+    groups = {}  # <现货symbol, [pair_config]>
+    for pair_config in pair_configs:
+        groups.setdefault(pair_config.get("spot", ""), []).append(pair_config)
+
+    def weight(configs):
+        total = 0
+        for pair_config in configs:
+            futures = pair_config.get("futures", None)
+            if futures is None:
+                total += 1
+            elif futures == "auto":
+                total += 2  # 交割合约数量启动时才知道, 按常见的当季与次季估算
+            else:
+                total += len(futures)
+        return total
+
+    shard_pairs = [[] for _ in range(shards)]
+    loads = [0] * shards
+    for spot, configs in sorted(groups.items(), key=lambda item: (-weight(item[1]), item[0])):
+        slot = loads.index(min(loads))
+        shard_pairs[slot].extend(configs)
+        loads[slot] += weight(configs)
+    return shard_pairs
+
+
+class RiskBoard:
+    """共享内存风控汇总表
+
+    头部由监督进程写入汇总结果与停止开仓标志, 每个工作进程只写自己的一行。
+    每行带有写入序号, 写入前后各加一, 读取时序号为奇数或前后不一致则重读, 保证读到完整的一行。
+    重读多次仍失败(例如工作进程在写入中途退出, 序号停在奇数)时使用上次读到的完整副本并标记为过期。
+    """
+
+    VERSION = 1
+    HEADER_SIZE = 16
+    ROW_SIZE = 8
+
+    # 头部字段
+    H_VERSION = 0
+    H_SLOTS = 1
+    H_HALT = 2  # 停止开仓标志
+    H_TOTAL_VALUE = 3  # 全局持仓价值
+    H_LONG_VALUE = 4  # 全局多头持仓价值
+    H_SHORT_VALUE = 5  # 全局空头持仓价值
+    H_EXPOSURE = 6  # 全局净敞口
+    H_PNL = 7  # 全局浮动盈亏
+    H_UPDATED = 8  # 汇总时间，单位为毫秒
+
+    # 每行字段
+    R_SEQ = 0
+    R_HEARTBEAT = 1  # 工作进程最近一次写入时间，单位为毫秒
+    R_LONG_VALUE = 2
+    R_SHORT_VALUE = 3
+    R_EXPOSURE = 4
+    R_PNL = 5
+    R_PAIRS = 6  # 工作进程负责的交易对数量
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner  # 创建者负责释放共享内存
+        header = np.ndarray((self.HEADER_SIZE,), dtype=np.float64, buffer=shm.buf)
+        self.slots = int(header[self.H_SLOTS])
+        self.header = header
+        self.rows = np.ndarray(
+            (self.slots, self.ROW_SIZE),
+            dtype=np.float64,
+            buffer=shm.buf,
+            offset=self.HEADER_SIZE * 8,
+        )
+        self.last_rows = np.zeros((self.slots, self.ROW_SIZE))  # 每行上次读到的完整副本
+        self.stale_slots = []  # 最近一次读取失败、使用旧副本的分片
+
+    @classmethod
+    def create(cls, name, slots):
+        """创建共享内存, 已存在同名的残留共享内存时先释放"""
+        size = (cls.HEADER_SIZE + slots * cls.ROW_SIZE) * 8
+        try:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((cls.HEADER_SIZE,), dtype=np.float64, buffer=shm.buf)
+        header[:] = 0
+        header[cls.H_SLOTS] = slots
+        header[cls.H_VERSION] = cls.VERSION
+        board = cls(shm, owner=True)
+        board.rows[:] = 0
+        return board
+
+    @classmethod
+    def attach(cls, name):
+        """连接监督进程创建的共享内存, 不存在或版本不一致时返回None"""
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return None
+        board = cls(shm)
+        if int(board.header[cls.H_VERSION]) != cls.VERSION:
+            board.close()
+            return None
+        return board
+
+    def publish(self, slot, long_value, short_value, exposure, pnl, pairs):
+        """工作进程写入自己的一行"""
+        row = self.rows[slot]
+        row[self.R_SEQ] += 1
+        row[self.R_HEARTBEAT] = time.time() * 1000
+        row[self.R_LONG_VALUE] = long_value
+        row[self.R_SHORT_VALUE] = short_value
+        row[self.R_EXPOSURE] = exposure
+        row[self.R_PNL] = pnl
+        row[self.R_PAIRS] = pairs
+        row[self.R_SEQ] += 1
+
+    def read_rows(self, retries=100):
+        """读取所有行的一致副本, 读取失败的行使用上次的副本, 分片编号记录在stale_slots中"""
+        rows = np.empty_like(self.rows)
+        stale_slots = []
+        for slot in range(self.slots):
+            row = self.rows[slot]
+            for _ in range(retries):
+                seq = row[self.R_SEQ]
+                if seq % 2:
+                    continue
+                rows[slot] = row
+                if row[self.R_SEQ] == seq:
+                    self.last_rows[slot] = rows[slot]
+                    break
+            else:
+                rows[slot] = self.last_rows[slot]
+                stale_slots.append(slot)
+        self.stale_slots = stale_slots
+        return rows
+
+    def reset_row(self, slot):
+        """监督进程在启动工作进程前把该分片的一行恢复为上次读到的完整副本并清零写入序号
+
+        保留上一个工作进程最后写入的持仓与心跳, 新进程第一次写入前汇总仍然计入这些持仓,
+        旧心跳超时后停止开仓, 直到新进程写入。
+        """
+        self.rows[slot] = self.last_rows[slot]
+        self.rows[slot, self.R_SEQ] = 0
+
+    def set_totals(self, long_value, short_value, exposure, pnl, halt):
+        """监督进程写入汇总结果与停止开仓标志"""
+        header = self.header
+        header[self.H_LONG_VALUE] = long_value
+        header[self.H_SHORT_VALUE] = short_value
+        header[self.H_TOTAL_VALUE] = long_value + short_value
+        header[self.H_EXPOSURE] = exposure
+        header[self.H_PNL] = pnl
+        header[self.H_HALT] = 1.0 if halt else 0.0
+        header[self.H_UPDATED] = time.time() * 1000
+
+    def totals(self):
+        """读取汇总结果"""
+        header = self.header.copy()
+        return {
+            "total_value": float(header[self.H_TOTAL_VALUE]),
+            "long_value": float(header[self.H_LONG_VALUE]),
+            "short_value": float(header[self.H_SHORT_VALUE]),
+            "exposure": float(header[self.H_EXPOSURE]),
+            "pnl": float(header[self.H_PNL]),
+            "updated": float(header[self.H_UPDATED]),
+        }
+
+    def halted(self):
+        """是否已停止开仓"""
+        return self.header[self.H_HALT] != 0
+
+    def close(self):
+        """断开共享内存, 创建者同时释放共享内存"""
+        self.header = None
+        self.rows = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class RiskAggregator:
+    """汇总各工作进程的风控数据并检查全局限制"""
+
+    def __init__(self, board, config, log=print):
+        self.board = board
+        self.log = log
+        self.max_total_position_value = config.get(
+            "max_total_position_value", 0
+        )  # 全局最大持仓价值，0表示不限制
+        self.max_net_exposure = config.get(
+            "max_net_exposure", 0
+        )  # 全局最大净敞口，0表示不限制
+        self.max_loss = config.get("max_loss", 0)  # 全局最大浮动亏损，0表示不限制
+        self.heartbeat_timeout = config.get(
+            "heartbeat_timeout", 10
+        )  # 工作进程心跳超时，单位为秒
+        self.halt_reasons = []
+
+    def check(self):
+        """汇总一次并更新停止开仓标志, 返回停止开仓的原因列表"""
+        rows = self.board.read_rows()
+        now = time.time() * 1000
+        long_value = float(rows[:, RiskBoard.R_LONG_VALUE].sum())
+        short_value = float(rows[:, RiskBoard.R_SHORT_VALUE].sum())
+        exposure = float(rows[:, RiskBoard.R_EXPOSURE].sum())
+        pnl = float(rows[:, RiskBoard.R_PNL].sum())
+
+        reasons = []
+        if self.max_total_position_value and (
+            long_value + short_value > self.max_total_position_value
+        ):
+            reasons.append(
+                f"全局持仓价值 {long_value + short_value:.2f} 超过 {self.max_total_position_value}"
+            )
+        if self.max_net_exposure and abs(exposure) > self.max_net_exposure:
+            reasons.append(f"全局净敞口 {exposure:.2f} 超过 {self.max_net_exposure}")
+        if self.max_loss and pnl < -self.max_loss:
+            reasons.append(f"全局浮动亏损 {pnl:.2f} 超过 {self.max_loss}")
+        heartbeats = rows[:, RiskBoard.R_HEARTBEAT]
+        missing = np.flatnonzero(heartbeats == 0)
+        if len(missing):
+            # 工作进程还没有写入过, 持仓未知
+            reasons.append(f"分片 {missing.tolist()} 尚未上报")
+        stale = np.flatnonzero(
+            (heartbeats > 0) & (now - heartbeats > self.heartbeat_timeout * 1000)
+        )
+        if len(stale):
+            # 工作进程没有按时更新, 汇总结果不可信
+            reasons.append(f"分片 {stale.tolist()} 心跳超时")
+        if self.board.stale_slots:
+            # 序号一直为奇数, 使用的是上次读到的数据
+            reasons.append(f"分片 {self.board.stale_slots} 读取失败")
+
+        self.board.set_totals(long_value, short_value, exposure, pnl, bool(reasons))
+        if reasons != self.halt_reasons:
+            if reasons:
+                self.log(f"停止开仓: {reasons}")
+            else:
+                self.log("风控恢复正常, 允许开仓")
+            self.halt_reasons = reasons
+        return reasons
+
+
+class ShardSupervisor:
+    """启动并守护各分片的工作进程, 同时运行风控汇总"""
+
+    def __init__(self, config_path, config):
+        self.config_path = config_path
+        self.shard_config = config.get("shard_config", {})
+        self.shards = self.shard_config.get("shards", 1)
+        self.launch_command = self.shard_config.get("launch_command", "")
+        self.check_interval = self.shard_config.get(
+            "check_interval", 1
+        )  # 风控汇总间隔，单位为秒
+        self.restart_delay = self.shard_config.get(
+            "restart_delay", 5
+        )  # 工作进程退出后重启的等待时间，单位为秒
+        self.board = RiskBoard.create(
+            self.shard_config.get("shm_name", "grid_risk_board"), self.shards
+        )
+        self.aggregator = RiskAggregator(self.board, self.shard_config, log=self.log)
+        self.workers = [None] * self.shards  # <分片编号, subprocess.Popen>
+        self.exited_at = [0.0] * self.shards  # 工作进程退出时间
+        self.stop_flag = False
+
+        partitions = partition_pairs(config.get("pairs", []), self.shards)
+        for slot, pair_configs in enumerate(partitions):
+            self.log(f"分片 {slot}: {[c.get('spot', '') for c in pair_configs]}")
+
+    def log(self, msg):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {msg}", flush=True)
+
+    def _launch(self, slot):
+        """启动一个分片的工作进程"""
+        command = self.launch_command.format(slot=slot, config=self.config_path)
+        env = dict(os.environ)
+        env[SHARD_SLOT_ENV] = str(slot)
+        # 上一个工作进程可能在写入中途退出, 序号停在奇数, 新进程写入前先清零序号
+        self.board.reset_row(slot)
+        self.workers[slot] = subprocess.Popen(shlex.split(command), env=env)
+        self.log(f"启动分片 {slot}: pid {self.workers[slot].pid}")
+
+    def run(self):
+        """守护工作进程, 定时汇总风控数据, 收到退出信号后停止所有工作进程"""
+        if not self.launch_command:
+            raise ValueError("shard_config中未指定launch_command，无法启动工作进程。")
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+        try:
+            for slot in range(self.shards):
+                self._launch(slot)
+            while not self.stop_flag:
+                now = time.time()
+                for slot, worker in enumerate(self.workers):
+                    if worker is None or worker.poll() is None:
+                        continue
+                    if not self.exited_at[slot]:
+                        self.exited_at[slot] = now
+                        self.log(f"分片 {slot} 退出: {worker.returncode}")
+                    elif now - self.exited_at[slot] >= self.restart_delay:
+                        self.exited_at[slot] = 0.0
+                        self._launch(slot)
+                self.aggregator.check()
+                time.sleep(self.check_interval)
+        finally:
+            self.shutdown()
+
+    def _on_signal(self, signum, frame):
+        self.stop_flag = True
+
+    def shutdown(self):
+        """停止所有工作进程并释放共享内存"""
+        for worker in self.workers:
+            if worker is not None and worker.poll() is None:
+                worker.terminate()
+        for worker in self.workers:
+            if worker is None:
+                continue
+            try:
+                worker.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+        if self.board is not None:
+            self.board.close()
+            self.board = None
+
+
+if __name__ == "__main__":
+    import tomllib
+
+    config_path = sys.argv[1] if len(sys.argv) > 1 else "strategy.toml"
+    with open(config_path, "rb") as f:
+        config = tomllib.load(f)
+    ShardSupervisor(config_path, config).run()
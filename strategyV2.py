@@ -5,7 +5,13 @@ import time
 import json
 import csv
 import os
-from collections import OrderedDict
+import bisect
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from shardSupervisor import RiskBoard, partition_pairs, SHARD_SLOT_ENV
+from bboBoard import BboBoard
+from journal import Journal, JournalTrader
 
 # class Order:
 # class GridOrder:
@@ -14,7 +20,9 @@ from collections import OrderedDict
 class LatencyStats:
     """延迟统计类"""
 
-    def __init__(self, max_capacity=1000, output_file=None, batch_size=10):
+    def __init__(
+        self, max_capacity=1000, output_file=None, batch_size=10, window_size=200
+    ):
         self.max_capacity = max_capacity  # 每个orderType的最大容量
         self.output_file = output_file  # CSV输出文件路径
         self.batch_size = batch_size  # 批量保存的数据量
@@ -23,6 +31,12 @@ class LatencyStats:
             "cancel_order": OrderedDict(),
             "amend_order": OrderedDict(),
         }
+        # 最近的延迟样本, 用于计算实时分位数
+        self.recent_latency = {
+            order_type: deque(maxlen=window_size)
+            for order_type in self.order_delay_stats
+        }
+        self.percentile_cache = {}  # <(orderType, 分位数), 延迟>, 有新样本时失效
 
         # 批量保存相关
         self.pending_data = []  # 待保存的数据缓存
@@ -124,6 +138,12 @@ class LatencyStats:
             ]
 
             latency = server_receive_time - local_place_time
+            self.recent_latency[order_type].append(max(latency, 0))
+            self.percentile_cache = {
+                key: value
+                for key, value in self.percentile_cache.items()
+                if key[0] != order_type
+            }
 
             # 保存数据到批量缓存
             self._add_to_batch(
@@ -133,6 +153,16 @@ class LatencyStats:
             return latency
         return None
 
+    def percentile(self, order_type, q, min_samples=10):
+        """最近延迟的q分位数，单位为毫秒，样本不足时返回None"""
+        key = (order_type, q)
+        if key not in self.percentile_cache:
+            samples = self.recent_latency[order_type]
+            self.percentile_cache[key] = (
+                float(np.percentile(samples, q)) if len(samples) >= min_samples else None
+            )
+        return self.percentile_cache[key]
+
     def flush_pending_data(self):
         """强制保存所有待保存的数据"""
         if self.pending_data:
@@ -448,59 +478,1034 @@ class dealPriceStats:
             self._save_batch_data()
 
 
-# 类名必须为Strategy
-class Strategy(BaseStrategy):
-    def __init__(self, cex_configs, dex_configs, config, trader: Trader):
-        self.cex_configs = cex_configs  # 中心化交易所配置
-        self.dex_configs = dex_configs  # 去中心化交易所配置
-        self.config = config  # 策略配置
-        self.trader = trader  # 交易执行器
-        self.stop_flag = False  # 停止标志
+class Record:
+    """使用__slots__的记录类型基类
 
-        # has_account: bool = False  # 是否有账户信息
-        self.has_account = True  # 是否有账户信息
+    策略内部按属性访问, 同时保留record["key"]与record.get(key)的读取方式, 统计类无需区分dict与记录;
+    只在与Trader交互(下单、回调、快照)时与dict互相转换
+    """
 
-        # 交易币种
-        self.pairs = self.config.get("pairs", {})
-        if not self.pairs:
-            raise ValueError("策略配置中未指定交易对，请检查配置文件。")
-        self.spot = self.pairs.get("spot", "")
-        self.future = self.pairs.get("future", "")
-        self.placeFutureSymbol = self.future.replace("_25", "-2025")  # 交割合约符号
-        self.symbols = [symbol for symbol in self.pairs.values()]
+    __slots__ = ()
 
-        # 记录最新的市场数据
-        self.bbo = {symbol: None for symbol in self.symbols}
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        for key in cls.__slots__:
+            setattr(record, key, data.get(key, None))
+        return record
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class Bbo(Record):
+    """最优买卖价"""
+
+    __slots__ = ("symbol", "ask_price", "ask_qty", "bid_price", "bid_qty", "timestamp")
+
+    def __init__(
+        self, symbol, ask_price, bid_price, timestamp=None, ask_qty=0.0, bid_qty=0.0
+    ):
+        self.symbol = symbol
+        self.ask_price = ask_price
+        self.ask_qty = ask_qty
+        self.bid_price = bid_price
+        self.bid_qty = bid_qty
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_trader(cls, bbo, symbol):
+        """BBO回调数据转换为Bbo, symbol为已转换的内部symbol"""
+        return cls(
+            symbol,
+            bbo["ask_price"],
+            bbo["bid_price"],
+            bbo.get("timestamp", None),
+            bbo.get("ask_qty", 0.0),
+            bbo.get("bid_qty", 0.0),
+        )
+
+
+class GridOrder(Record):
+    """网格挂单, maker_price/taker_price在开仓时确定"""
+
+    __slots__ = ("grid_index", "price", "amount", "side", "maker_price", "taker_price")
+
+    def __init__(self, grid_index, price, amount, side):
+        self.grid_index = grid_index  # 网格索引
+        self.price = price  # 网格价格(价差)
+        self.amount = amount
+        self.side = side  # 'buy' 或 'sell'
+        self.maker_price = None  # 交割合约挂单价格
+        self.taker_price = None  # 现货对冲价格
+
+    def clear_quotes(self):
+        """撤单后放回网格挂单列表时清除挂单价格"""
+        self.maker_price = None
+        self.taker_price = None
+
+
+class Order(Record):
+    """策略发出的订单, 下单与改单时转换为dict交给Trader"""
+
+    __slots__ = ("cid", "symbol", "order_type", "side", "amount", "price", "time_in_force")
+
+    def __init__(self, cid, symbol, order_type, side, amount, price, time_in_force):
+        self.cid = cid
+        self.symbol = symbol
+        self.order_type = order_type
+        self.side = side
+        self.amount = amount
+        self.price = price
+        self.time_in_force = time_in_force
+
+
+class Position(Record):
+    """持仓"""
+
+    __slots__ = ("symbol", "side", "amount", "unrealized_pnl")
+
+    def __init__(self, symbol, side, amount, unrealized_pnl=0.0):
+        self.symbol = symbol
+        self.side = side  # 'Long' 或 'Short'
+        self.amount = amount
+        self.unrealized_pnl = unrealized_pnl
+
+    @classmethod
+    def from_trader(cls, position, symbol):
+        """持仓回调数据转换为Position, symbol为已转换的内部symbol"""
+        return cls(
+            symbol,
+            position["side"],
+            position["amount"],
+            position.get("unrealized_pnl", 0.0) or 0.0,
+        )
+
+    @property
+    def signed_amount(self):
+        """带方向的持仓数量, 多为正"""
+        return self.amount if self.side.lower() == "long" else -self.amount
+
+
+class LegPair(Record):
+    """同时发送的交割合约与现货两条腿, 作为一个整体跟踪单腿风险"""
+
+    __slots__ = (
+        "future_cid",
+        "spot_cid",
+        "grid_order",
+        "future_side",
+        "spot_side",
+        "amount",
+        "spot_price",
+        "sent_at",
+    )
+
+    def __init__(
+        self, future_cid, spot_cid, grid_order, future_side, spot_side, amount, spot_price
+    ):
+        self.future_cid = future_cid
+        self.spot_cid = spot_cid
+        self.grid_order = grid_order  # 对应的网格挂单
+        self.future_side = future_side  # 'Buy' 或 'Sell'
+        self.spot_side = spot_side
+        self.amount = amount
+        self.spot_price = spot_price  # 现货腿的期望价格
+        self.sent_at = {}  # <账户, 发送时间(毫秒)>
+
+
+class LocalOrderBook:
+    """本地订单簿, 由Depth推送增量维护
+
+    买卖两侧各自使用有序的价格数组与对应的数量数组保存档位, 最优价位于数组末尾,
+    因此靠近一档的插入/删除只需要移动很少的元素, 查找档位使用二分O(log n),
+    按数量计算成交均价只需要从一档向外遍历k档O(k)。
+    卖盘价格取负数保存, 使两侧都是升序且最优价在末尾。
+    """
+
+    def __init__(self, symbol, max_levels=200):
+        self.symbol = symbol
+        self.max_levels = max_levels  # 每一侧最多保留的档位数量
+        self.bid_keys = []  # 买盘价格, 升序, 末尾为买一
+        self.bid_amounts = []
+        self.ask_keys = []  # 卖盘价格取负, 升序, 末尾为卖一
+        self.ask_amounts = []
+        self.timestamp = None  # 最近一次更新的时间戳
+
+    def _update_level(self, keys, amounts, key, amount):
+        """更新单个档位, 数量为0时删除该档位"""
+        idx = bisect.bisect_left(keys, key)
+        if idx < len(keys) and keys[idx] == key:
+            if amount > 0:
+                amounts[idx] = amount
+            else:
+                del keys[idx]
+                del amounts[idx]
+        elif amount > 0:
+            keys.insert(idx, key)
+            amounts.insert(idx, amount)
+
+    def _trim(self, keys, amounts):
+        """超过最大档位数量时删除最远的档位"""
+        extra = len(keys) - self.max_levels
+        if extra > 0:
+            del keys[:extra]
+            del amounts[:extra]
+
+    def _remove_range(self, keys, amounts, low, high, kept):
+        """删除[low, high]范围内且不在本次快照中的档位"""
+        start = bisect.bisect_left(keys, low)
+        end = bisect.bisect_right(keys, high)
+        for idx in range(end - 1, start - 1, -1):
+            if keys[idx] not in kept:
+                del keys[idx]
+                del amounts[idx]
+
+    @staticmethod
+    def _parse_level(level):
+        """解析档位数据, 兼容[price, amount]与{"price", "amount"}两种格式"""
+        if isinstance(level, dict):
+            return float(level["price"]), float(level["amount"])
+        return float(level[0]), float(level[1])
+
+    def apply(self, bids, asks, timestamp=None, incremental=True):
+        """应用一次深度推送
+        bids/asks: list - 档位列表
+        incremental: bool - True表示增量推送, False表示前N档快照,
+            快照覆盖的价格范围内未出现的档位会被删除
+        """
+        bid_levels = [self._parse_level(level) for level in bids or []]
+        ask_levels = [self._parse_level(level) for level in asks or []]
+
+        if not incremental:
+            if bid_levels:
+                kept = {price for price, _ in bid_levels}
+                self._remove_range(
+                    self.bid_keys, self.bid_amounts, min(kept), float("inf"), kept
+                )
+            if ask_levels:
+                kept = {-price for price, _ in ask_levels}
+                self._remove_range(
+                    self.ask_keys, self.ask_amounts, min(kept), float("inf"), kept
+                )
+
+        for price, amount in bid_levels:
+            self._update_level(self.bid_keys, self.bid_amounts, price, amount)
+        for price, amount in ask_levels:
+            self._update_level(self.ask_keys, self.ask_amounts, -price, amount)
+
+        # 删除交叉的过期档位, 以本次推送中的一档为准
+        if bid_levels and self.ask_keys and self.bid_keys:
+            best_bid = self.bid_keys[-1]
+            while self.ask_keys and -self.ask_keys[-1] <= best_bid:
+                self.ask_keys.pop()
+                self.ask_amounts.pop()
+        if ask_levels and self.bid_keys and self.ask_keys:
+            best_ask = -self.ask_keys[-1]
+            while self.bid_keys and self.bid_keys[-1] >= best_ask:
+                self.bid_keys.pop()
+                self.bid_amounts.pop()
+
+        self._trim(self.bid_keys, self.bid_amounts)
+        self._trim(self.ask_keys, self.ask_amounts)
+        self.timestamp = timestamp
+
+    def best_bid(self):
+        """买一价"""
+        return self.bid_keys[-1] if self.bid_keys else None
+
+    def best_ask(self):
+        """卖一价"""
+        return -self.ask_keys[-1] if self.ask_keys else None
+
+    def sweep(self, side, amount):
+        """计算吃掉指定数量时的成交均价与最差成交价
+        side: str - 'buy' 吃卖盘, 'sell' 吃买盘
+        amount: float - 数量
+        返回 (vwap, worst_price), 深度不足时返回 (None, None)
+        """
+        if side.lower() == "buy":
+            keys, amounts, sign = self.ask_keys, self.ask_amounts, -1
+        else:
+            keys, amounts, sign = self.bid_keys, self.bid_amounts, 1
+        remaining = amount
+        notional = 0.0
+        idx = len(keys) - 1
+        while idx >= 0 and remaining > 1e-12:
+            price = sign * keys[idx]
+            take = amounts[idx] if amounts[idx] < remaining else remaining
+            notional += take * price
+            remaining -= take
+            idx -= 1
+        if remaining > 1e-12 or amount <= 0:
+            return None, None
+        return notional / amount, sign * keys[idx + 1]
+
+
+class PriceIndex:
+    """按价格排序的触发索引
+
+    保存(价格, key)并按价格升序排列, 给定阈值时用二分查找取出价格在阈值一侧的key,
+    查找O(log n), 取出k个元素O(k)。用于每个tick只处理越过阈值的网格或挂单。
+    """
+
+    def __init__(self):
+        self.prices = []  # 升序价格
+        self.keys = []  # 与价格一一对应的key
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rebuild(self, items):
+        """使用(价格, key)列表重建索引"""
+        items = sorted(items, key=lambda item: item[0])
+        self.prices = [price for price, _ in items]
+        self.keys = [key for _, key in items]
+
+    def add(self, price, key):
+        idx = bisect.bisect_right(self.prices, price)
+        self.prices.insert(idx, price)
+        self.keys.insert(idx, key)
+
+    def remove(self, price, key):
+        """删除指定的key, 不存在时返回False"""
+        idx = bisect.bisect_left(self.prices, price)
+        while idx < len(self.prices) and self.prices[idx] == price:
+            if self.keys[idx] == key:
+                del self.prices[idx]
+                del self.keys[idx]
+                return True
+            idx += 1
+        return False
+
+    def discard(self, key):
+        """价格未知时按key删除, O(n)"""
+        if key in self.keys:
+            idx = self.keys.index(key)
+            del self.prices[idx]
+            del self.keys[idx]
+
+    def below(self, price):
+        """价格 < price 的key"""
+        return self.keys[: bisect.bisect_left(self.prices, price)]
+
+    def at_or_below(self, price):
+        """价格 <= price 的key"""
+        return self.keys[: bisect.bisect_right(self.prices, price)]
+
+    def above(self, price):
+        """价格 > price 的key"""
+        return self.keys[bisect.bisect_right(self.prices, price) :]
+
+    def at_or_above(self, price):
+        """价格 >= price 的key"""
+        return self.keys[bisect.bisect_left(self.prices, price) :]
+
+
+class RequestBudget:
+    """交易所请求预算, 按账户与接口分组的令牌桶限流
+
+    每个请求按接口权重消耗令牌, 令牌按固定速率恢复。请求分为四个优先级:
+    对冲 > 撤单 > 改单 > 新挂单。对冲与撤单总是立即发送, 令牌不足时允许透支;
+    改单与新挂单只有在发送后剩余令牌仍高于为关键请求保留的比例时才发送, 否则直接拒绝,
+    不会排队占用关键请求的预算。
+    令牌桶会被回调线程、双腿下单线程池等多个线程同时使用, 恢复与扣减令牌在同一把锁内完成。
+    """
+
+    HEDGE = 0
+    CANCEL = 1
+    AMEND = 2
+    PLACE = 3
+    PRIORITY_NAMES = {HEDGE: "hedge", CANCEL: "cancel", AMEND: "amend", PLACE: "place"}
+
+    def __init__(self, trader, config):
+        self.trader = trader
+        self.enabled = config.get("enabled", False)
+        self.rate = config.get("rate", 10)  # 每秒恢复的权重
+        self.capacity = config.get("capacity", 50)  # 令牌桶容量
+        reserve = config.get("reserve", {})
+        self.reserve = {
+            self.AMEND: reserve.get("amend", 0.2),
+            self.PLACE: reserve.get("place", 0.4),
+        }  # 可选请求发送后需要保留的令牌比例
+        self.weights = config.get("weights", {})  # <接口, 权重>, 默认权重为1
+        self.groups = config.get(
+            "groups",
+            {
+                "place_order": "order",
+                "batch_place_order": "order",
+                "amend_order": "order",
+                "cancel_order": "order",
+                "batch_cancel_order": "order",
+                "batch_cancel_order_by_id": "order",
+            },
+        )  # <接口, 共用令牌桶的分组>, 未配置的接口单独使用一个令牌桶
+        self.limits = config.get("limits", {})  # <分组, {rate, capacity}>
+        self.buckets = {}  # <(账户, 分组), [令牌, 上次更新时间]>
+        self.lock = threading.Lock()  # 保护buckets与rejected
+        self.rejected = {name: 0 for name in self.PRIORITY_NAMES.values()}  # 拒绝次数
+
+    def _limit(self, group):
+        limit = self.limits.get(group, {})
+        return limit.get("rate", self.rate), limit.get("capacity", self.capacity)
+
+    def _bucket(self, account_id, group):
+        """恢复令牌后返回令牌桶, 调用方需持有self.lock"""
+        rate, capacity = self._limit(group)
+        now = time.monotonic()
+        bucket = self.buckets.get((account_id, group), None)
+        if bucket is None:
+            bucket = self.buckets[(account_id, group)] = [capacity, now]
+        else:
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def acquire(self, priority, account_id, endpoint):
+        """申请发送一次请求, 返回是否允许发送"""
+        if not self.enabled:
+            return True
+        group = self.groups.get(endpoint, endpoint)
+        weight = self.weights.get(endpoint, 1)
+        with self.lock:
+            bucket = self._bucket(account_id, group)
+            if priority in self.reserve:
+                _, capacity = self._limit(group)
+                if bucket[0] - weight < capacity * self.reserve[priority]:
+                    self.rejected[self.PRIORITY_NAMES[priority]] += 1
+                    return False
+            bucket[0] -= weight
+        return True
+
+    def request(self, priority, account_id, endpoint, *args, **kwargs):
+        """按预算发送交易所请求, 预算不足时不发送并返回Err"""
+        if not self.acquire(priority, account_id, endpoint):
+            return {"Err": f"请求预算不足, 跳过{endpoint}"}
+        return getattr(self.trader, endpoint)(account_id, *args, **kwargs)
+
+    def remaining(self):
+        """各令牌桶的剩余令牌, <"账户/分组", 剩余令牌>"""
+        with self.lock:
+            return {
+                f"{account_id}/{group}": round(self._bucket(account_id, group)[0], 2)
+                for account_id, group in list(self.buckets.keys())
+            }
+
+
+class AmendPolicy:
+    """改单策略, 减少快速行情中每个tick都改单造成的订单抖动
+
+    规则:
+        1. 目标价格与挂单价格相差不足min_ticks个价格精度时不改单
+        2. 挂单或上次改单后停留不足min_dwell_ms时不改单
+        3. queue_only开启时只在排队位置落后(目标价格比挂单价格更激进)时改单
+        4. 改单回报未返回前不再发送改单, 回报返回后只按最新的目标价格改单
+    同时统计改单次数与成交率, 比较改过价和未改过价的挂单的成交率。
+    """
+
+    SKIP_REASONS = ("ticks", "dwell", "queue", "inflight")
+
+    def __init__(self, config):
+        self.min_ticks = config.get("min_ticks", 2)  # 最小改单价格档数
+        self.min_dwell_ms = config.get("min_dwell_ms", 300)  # 最短停留时间，单位为毫秒
+        self.queue_only = config.get("queue_only", False)  # 只在排队位置落后时改单
+        self.inflight_timeout_ms = config.get(
+            "inflight_timeout_ms", 1000
+        )  # 改单回报超时，超时后允许再次改单，单位为毫秒
+        self.last_change = {}  # <cid, 挂单或上次改单的时间>
+        self.inflight = {}  # <cid, (发送时间, 改单前价格)>
+        self.amend_counts = {}  # <cid, 改单次数>
+        self.stats = self._empty_stats()
+        self.stats_since = time.time()
+
+    def _empty_stats(self):
+        stats = {
+            "placed": 0,
+            "amended": 0,
+            "filled": 0,
+            "filled_amended": 0,  # 改过价的挂单成交数
+            "done_amended": 0,  # 改过价的挂单结束(成交或撤销)数
+            "done_unamended": 0,
+        }
+        stats.update({f"skip_{reason}": 0 for reason in self.SKIP_REASONS})
+        return stats
+
+    def on_placed(self, cid, now):
+        """挂单成功"""
+        self.last_change[cid] = now
+        self.amend_counts[cid] = 0
+        self.stats["placed"] += 1
+
+    def skip_reason(self, cid, side, order_price, target_price, tick, now):
+        """判断是否需要改单, 不需要时返回原因
+        side: str - 交割合约订单方向, 'Buy' 或 'Sell'
+        """
+        reason = None
+        inflight = self.inflight.get(cid, None)
+        if inflight is not None and now - inflight[0] < self.inflight_timeout_ms:
+            reason = "inflight"
+        elif abs(order_price - target_price) < self.min_ticks * tick - tick / 2:
+            reason = "ticks"
+        elif self.queue_only and (
+            target_price > order_price if side == "Sell" else target_price < order_price
+        ):
+            # 卖单目标价格更高/买单目标价格更低, 当前挂单仍在最前面
+            reason = "queue"
+        elif now - self.last_change.get(cid, 0) < self.min_dwell_ms:
+            reason = "dwell"
+        if reason is not None:
+            self.stats[f"skip_{reason}"] += 1
+        return reason
+
+    def on_sent(self, cid, last_price, now):
+        """已发送改单, 等待回报"""
+        self.last_change[cid] = now
+        self.amend_counts[cid] = self.amend_counts.get(cid, 0) + 1
+        self.stats["amended"] += 1
+        self.inflight[cid] = (now, last_price)
+
+    def on_ack(self, cid):
+        """收到改单回报, 返回改单前价格, 没有等待中的改单时返回None"""
+        inflight = self.inflight.pop(cid, None)
+        return inflight[1] if inflight is not None else None
+
+    def on_done(self, cid, filled):
+        """挂单结束(成交或撤销)"""
+        self.inflight.pop(cid, None)
+        self.last_change.pop(cid, None)
+        amended = self.amend_counts.pop(cid, 0) > 0
+        self.stats["done_amended" if amended else "done_unamended"] += 1
+        if filled:
+            self.stats["filled"] += 1
+            if amended:
+                self.stats["filled_amended"] += 1
+
+    def report(self):
+        """改单频率与成交率统计, 返回后重新开始统计"""
+        stats = self.stats
+        elapsed = max(time.time() - self.stats_since, 1e-9)
+        filled_unamended = stats["filled"] - stats["filled_amended"]
+        report = {
+            "amend_per_sec": round(stats["amended"] / elapsed, 3),
+            "fill_rate": (
+                round(stats["filled"] / stats["placed"], 4) if stats["placed"] else None
+            ),
+            "fill_rate_amended": (
+                round(stats["filled_amended"] / stats["done_amended"], 4)
+                if stats["done_amended"]
+                else None
+            ),
+            "fill_rate_unamended": (
+                round(filled_unamended / stats["done_unamended"], 4)
+                if stats["done_unamended"]
+                else None
+            ),
+            **stats,
+        }
+        self.stats = self._empty_stats()
+        self.stats_since = time.time()
+        return report
+
+
+class LegDispatcher:
+    """双账户并行下单, 每个账户一个小线程池, 两条腿同时发出而不是依次等待回报"""
+
+    def __init__(self, workers_per_account=1):
+        self.executors = {
+            account_id: ThreadPoolExecutor(
+                max_workers=workers_per_account,
+                thread_name_prefix=f"leg-dispatch-{account_id}",
+            )
+            for account_id in (0, 1)
+        }
+
+    def submit(self, account_id, fn, *args, **kwargs):
+        return self.executors[account_id].submit(fn, *args, **kwargs)
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False)
+
+
+class PreTradeGuard:
+    """下单前的本地检查, 避免因保证金不足或超过最大持仓被交易所拒单
+
+    缓存各账户的可用USDT、杠杆以及各交易对的最大可持仓数量, 由Balance推送、REST轮询和定时器刷新,
+    下单前只做字典查找与几次乘除。减少持仓的订单不检查。
+    """
+
+    BALANCE_KEYS = ("available_balance", "available", "free", "balance")
+
+    def __init__(self, trader, config, positions, leverage):
+        self.trader = trader
+        self.positions = positions  # 策略的持仓信息, <内部symbol, Position>
+        self.enabled = config.get("enabled", False)
+        self.margin_buffer = config.get(
+            "margin_buffer", 0.05
+        )  # 保证金检查保留的可用余额比例
+        self.leverage = {
+            account_id: config.get("leverage", {}).get(str(account_id), leverage)
+            for account_id in (0, 1)
+        }  # <账户, 杠杆倍数>
+        self.available = {}  # <账户, 可用USDT>, 未知时不检查保证金
+        self.reserved = {}  # <账户, 刷新后已占用的保证金>
+        self.max_positions = {}  # <内部symbol, (最大多仓数量, 最大空仓数量)>
+        self.rejected = 0  # 本地拒绝的订单数
+
+    @classmethod
+    def _usdt_available(cls, balances):
+        """从余额数据中取出可用USDT, 无法识别时返回None"""
+        if isinstance(balances, dict):
+            if "asset" not in balances and "coin" not in balances:
+                for key in cls.BALANCE_KEYS:
+                    if isinstance(balances.get(key, None), (int, float)):
+                        return float(balances[key])
+                return None
+            balances = [balances]
+        elif isinstance(balances, (int, float)):
+            return float(balances)
+        for balance in balances or []:
+            if not isinstance(balance, dict):
+                continue
+            if (balance.get("asset", None) or balance.get("coin", None)) != "USDT":
+                continue
+            for key in cls.BALANCE_KEYS:
+                if balance.get(key, None) is not None:
+                    return float(balance[key])
+        return None
+
+    @staticmethod
+    def _parse_max_position(value):
+        """最大可持仓数据转换为(最大多仓, 最大空仓), 无法识别的方向为None"""
+        if isinstance(value, (int, float)):
+            return float(value), float(value)
+        if not isinstance(value, dict):
+            return None, None
+        limits = []
+        for keys in (("long", "max_long", "long_amount"), ("short", "max_short", "short_amount")):
+            limit = None
+            for key in keys + ("max", "amount"):
+                if isinstance(value.get(key, None), (int, float)):
+                    limit = float(value[key])
+                    break
+            limits.append(limit)
+        return tuple(limits)
+
+    def on_balance(self, account_id, balances):
+        """Balance推送更新可用余额"""
+        available = self._usdt_available(balances)
+        if available is not None:
+            self.available[account_id] = available
+            self.reserved[account_id] = 0.0
+
+    def refresh(self, account_id, symbols):
+        """使用REST接口刷新可用余额与最大可持仓
+        symbols: dict - <内部symbol, 交易所symbol>
+        """
+        result = self.trader.get_usdt_balance(account_id)
+        if isinstance(result, dict) and "Ok" in result:
+            self.on_balance(account_id, result["Ok"])
+        else:
+            self.trader.log(
+                f"账户{account_id}查询USDT余额失败: {result}", level="WARN"
+            )
+        for symbol, exchange_symbol in symbols.items():
+            result = self.trader.get_max_position(account_id, exchange_symbol)
+            if isinstance(result, dict) and "Ok" in result:
+                self.max_positions[symbol] = self._parse_max_position(result["Ok"])
+
+    def check(self, account_id, symbol, side, amount, price):
+        """检查订单, 通过时返回None并占用保证金, 否则返回拒绝原因
+        side: str - 'buy' 或 'sell'
+        """
+        if not self.enabled:
+            return None
+        after, increase = self._position_change(symbol, side, amount)
+        if increase <= 0:
+            # 减少持仓的订单不检查
+            return None
+        max_long, max_short = self.max_positions.get(symbol, (None, None))
+        limit = max_long if after > 0 else max_short
+        if limit is not None and abs(after) > limit:
+            self.rejected += 1
+            return f"{symbol} 下单后持仓 {after} 超过最大可持仓 {limit}"
+        available = self.available.get(account_id, None)
+        if available is not None:
+            margin = increase * price / self.leverage[account_id]
+            free = available * (1 - self.margin_buffer) - self.reserved.get(
+                account_id, 0.0
+            )
+            if margin > free:
+                self.rejected += 1
+                return f"账户{account_id}可用保证金不足: 需要 {margin:.4f}, 可用 {free:.4f}"
+            self.reserved[account_id] = self.reserved.get(account_id, 0.0) + margin
+        return None
+
+    def release(self, account_id, symbol, side, amount, price):
+        """check通过后订单没有发出或下单失败时, 释放check占用的保证金"""
+        if not self.enabled or account_id not in self.reserved:
+            return
+        _, increase = self._position_change(symbol, side, amount)
+        margin = increase * price / self.leverage[account_id]
+        self.reserved[account_id] = max(self.reserved[account_id] - margin, 0.0)
+
+    def _position_change(self, symbol, side, amount):
+        """返回(下单后持仓, 占用保证金的持仓数量), 减少持仓时占用数量为0
+        同方向加仓只占用增加部分的保证金, 反手时占用新方向全部持仓的保证金
+        """
+        position = self.positions.get(symbol, None)
+        current = position.signed_amount if position is not None else 0.0
+        after = current + amount if side.lower() == "buy" else current - amount
+        if abs(after) <= abs(current):
+            return after, 0.0
+        increase = abs(after) - abs(current) if current * after >= 0 else abs(after)
+        return after, increase
+
+
+class StateSnapshotter:
+    """策略状态快照, 通过trader.cache_save/cache_load持久化
+
+    快照在定时器回调中采集, 序列化与写入在后台线程中执行, 不占用行情回调。
+    后台线程只保留最新的一份待写快照, 内容与上次写入相同时跳过写入。
+    """
+
+    VERSION = 2  # 快照格式版本, 格式变化时递增
+
+    def __init__(self, trader):
+        self.trader = trader
+        self.last_payload = None  # 上次写入的快照内容(不含时间戳)
+        self.pending_state = None  # 等待写入的最新快照
+        self.condition = threading.Condition()
+        self.worker = None
+
+    def _ensure_worker(self):
+        """启动后台写入线程"""
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self._run, daemon=True)
+            self.worker.start()
+
+    def _run(self):
+        """后台线程, 循环写入最新的快照"""
+        while True:
+            with self.condition:
+                while self.pending_state is None:
+                    self.condition.wait()
+                state = self.pending_state
+                self.pending_state = None
+            self.write(state)
+
+    def submit(self, state):
+        """提交快照到后台线程写入, 未写入的旧快照会被覆盖"""
+        self._ensure_worker()
+        with self.condition:
+            self.pending_state = state
+            self.condition.notify()
+
+    def write(self, state):
+        """序列化并写入快照, 返回是否写入"""
+        payload = json.dumps(state, separators=(",", ":"), default=float)
+        if payload == self.last_payload:
+            return False
+        self.last_payload = payload
+        data = json.dumps(
+            {"v": self.VERSION, "ts": int(time.time() * 1000), "state": payload},
+            separators=(",", ":"),
+        )
+        result = self.trader.cache_save(data)
+        if isinstance(result, dict) and "Err" in result:
+            self.trader.log(f"保存状态快照失败: {result['Err']}", level="ERROR")
+            self.last_payload = None
+            return False
+        return True
+
+    def load(self):
+        """加载快照, 返回 (state, 快照时间戳), 没有可用快照时返回 (None, None)"""
+        data = self.trader.cache_load()
+        if isinstance(data, dict) and ("Ok" in data or "Err" in data):
+            if "Err" in data:
+                self.trader.log(f"加载状态快照失败: {data['Err']}", level="ERROR")
+                return None, None
+            data = data["Ok"]
+        if not data:
+            return None, None
+        try:
+            if isinstance(data, (str, bytes)):
+                data = json.loads(data)
+            if data.get("v") != self.VERSION:
+                self.trader.log(
+                    f"状态快照版本 {data.get('v')} 与当前版本 {self.VERSION} 不一致, 忽略快照",
+                    level="WARN",
+                )
+                return None, None
+            return json.loads(data["state"]), data["ts"]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.trader.log(f"解析状态快照失败: {e}", level="ERROR")
+            return None, None
+
+
+class InstrumentCache:
+    """交易对信息缓存
+
+    启动时通过get_instruments加载一次, 之后由on_instrument*回调增量更新。
+    维护每个账户上交易所symbol与策略内部symbol的双向映射, 以及每个交易对的
+    价格精度、数量精度与最小下单金额, 回调中的symbol转换只需要一次dict查找。
+    """
+
+    # 不同交易所返回的字段名不完全一致, 按顺序取第一个存在的字段
+    PRICE_TICK_KEYS = ("price_tick", "tick_size", "price_precision")
+    AMOUNT_TICK_KEYS = ("amount_tick", "lot_size", "step_size", "amount_precision")
+    MIN_AMOUNT_KEYS = ("min_amount", "min_qty", "min_size")
+    MIN_NOTIONAL_KEYS = ("min_notional", "min_cost", "min_value")
+
+    def __init__(self, default_price_tick=0.01):
+        self.default_price_tick = default_price_tick  # 未加载到交易对信息时的价格精度
+        self.to_internal = {}  # <交易所symbol, 内部symbol>
+        self.to_exchange = {}  # <account_id, <内部symbol, 交易所symbol>>
+        # <(account_id, 内部symbol), {"price_tick", "amount_tick", "min_amount", "min_notional"}>
+        # 按账户区分, 期货账户上同名的永续合约不会覆盖现货的下单规则
+        self.rules = {}
+
+    @staticmethod
+    def translate_to_internal(symbol):
+        """交易所symbol转内部symbol, 交割合约 ETH_USDT-20250926 -> ETH_USDT_250926"""
+        if "-" in symbol:
+            return symbol.replace("-20", "_")
+        return symbol
+
+    @staticmethod
+    def translate_to_exchange(symbol):
+        """内部symbol转交易所symbol, 交割合约 ETH_USDT_250926 -> ETH_USDT-20250926"""
+        head, _, tail = symbol.rpartition("_")
+        if head and len(tail) == 6 and tail.isdigit():
+            return f"{head}-20{tail}"
+        return symbol
+
+    @staticmethod
+    def _pick(instrument, keys, default=None):
+        """按顺序取第一个存在的字段"""
+        for key in keys:
+            value = instrument.get(key, None)
+            if value is not None:
+                return float(value)
+        return default
+
+    def register(self, account_id, internal_symbol, exchange_symbol=None):
+        """注册symbol映射, 没有提供交易所symbol时按默认规则转换"""
+        if exchange_symbol is None:
+            exchange_symbol = self.translate_to_exchange(internal_symbol)
+        self.to_internal[exchange_symbol] = internal_symbol
+        self.to_internal[internal_symbol] = internal_symbol
+        self.to_exchange.setdefault(account_id, {})[internal_symbol] = exchange_symbol
+
+    def update(self, account_id, instruments):
+        """新增或更新交易对信息, 只处理该账户上已注册(策略配置)的交易对, 返回更新的内部symbol列表"""
+        updated = []
+        registered = self.to_exchange.get(account_id, {})
+        for instrument in instruments or []:
+            exchange_symbol = instrument.get("symbol", None)
+            if not exchange_symbol:
+                continue
+            internal_symbol = self.translate_to_internal(exchange_symbol)
+            if internal_symbol not in registered:
+                continue
+            self.register(account_id, internal_symbol, exchange_symbol)
+            self.rules[(account_id, internal_symbol)] = {
+                "price_tick": self._pick(instrument, self.PRICE_TICK_KEYS),
+                "amount_tick": self._pick(instrument, self.AMOUNT_TICK_KEYS),
+                "min_amount": self._pick(instrument, self.MIN_AMOUNT_KEYS, 0.0),
+                "min_notional": self._pick(instrument, self.MIN_NOTIONAL_KEYS, 0.0),
+            }
+            updated.append(internal_symbol)
+        return updated
+
+    def remove(self, account_id, instruments):
+        """删除交易对信息, 返回删除的内部symbol列表"""
+        removed = []
+        registered = self.to_exchange.get(account_id, {})
+        for instrument in instruments or []:
+            exchange_symbol = instrument.get("symbol", None)
+            internal_symbol = self.to_internal.get(exchange_symbol, None)
+            if internal_symbol is None or internal_symbol not in registered:
+                continue
+            self.to_internal.pop(exchange_symbol, None)
+            registered.pop(internal_symbol, None)
+            self.rules.pop((account_id, internal_symbol), None)
+            removed.append(internal_symbol)
+        return removed
+
+    def internal_symbol(self, symbol):
+        """交易所symbol转内部symbol"""
+        internal_symbol = self.to_internal.get(symbol, None)
+        if internal_symbol is None:
+            internal_symbol = self.translate_to_internal(symbol)
+            self.to_internal[symbol] = internal_symbol
+        return internal_symbol
+
+    def exchange_symbol(self, account_id, symbol):
+        """内部symbol转指定账户上的交易所symbol"""
+        exchange_symbol = self.to_exchange.get(account_id, {}).get(symbol, None)
+        if exchange_symbol is None:
+            exchange_symbol = self.translate_to_exchange(symbol)
+        return exchange_symbol
+
+    def rule(self, account_id, symbol):
+        """账户上交易对的下单规则, 未加载时返回None"""
+        return self.rules.get((account_id, symbol), None)
+
+    def price_tick(self, account_id, symbol):
+        """价格精度"""
+        rule = self.rule(account_id, symbol)
+        if rule is None or not rule["price_tick"]:
+            return self.default_price_tick
+        return rule["price_tick"]
+
+    def round_price(self, account_id, symbol, price):
+        """价格按精度取整"""
+        tick = self.price_tick(account_id, symbol)
+        return round(round(price / tick) * tick, 12)
+
+    def round_amount(self, account_id, symbol, amount):
+        """数量按精度向下取整"""
+        rule = self.rule(account_id, symbol)
+        if rule is None or not rule["amount_tick"]:
+            return amount
+        tick = rule["amount_tick"]
+        return round(int(amount / tick + 1e-9) * tick, 12)
+
+    def check_order(self, account_id, symbol, price, amount):
+        """检查订单是否满足最小数量与最小下单金额, 返回不满足的原因, 满足时返回None"""
+        rule = self.rule(account_id, symbol)
+        if rule is None:
+            return None
+        if amount < rule["min_amount"]:
+            return f"数量 {amount} 小于最小数量 {rule['min_amount']}"
+        if price * amount < rule["min_notional"]:
+            return f"下单金额 {price * amount} 小于最小下单金额 {rule['min_notional']}"
+        return None
+
+
+class GridPair:
+    """单个现货/交割合约对的网格状态与交易逻辑
+
+    Strategy负责订阅、回调路由以及各交易对共享的对象(trader、bbo、持仓、交易对信息、
+    订单簿与统计对象), GridPair只维护该交易对自己的均线、网格、挂单与连续开仓信号,
+    交易逻辑与单交易对时完全一致。
+    """
+
+    # 网格挂单数组的字段, 每个网格级别一行
+    GRID_DTYPE = np.dtype(
+        [
+            ("price", "f8"),  # 网格挂单价格(价差)
+            ("amount", "f8"),  # 网格挂单数量
+            ("side", "i1"),  # 网格方向, SIDE_BUY 或 SIDE_SELL
+            ("active", "?"),  # 是否在网格挂单列表中等待开仓
+            ("signal", "i8"),  # 连续开仓信号计数
+        ]
+    )
+    SIDE_BUY = 1
+    SIDE_SELL = -1
+
+    def __init__(self, strategy, pair_config):
+        config = strategy.config
+        # 一个现货对多个交割合约时, 均线与基准价格保存在ExpiryGroup的数组中
+        self.group = None  # 所属的ExpiryGroup
+        self.group_index = None  # 在ExpiryGroup数组中的位置
+        self._short_ewm = None
+        self._long_ewm = None
+        self._base_price = None
+
+        # 共享对象
+        self.strategy = strategy
+        self.cex_configs = strategy.cex_configs  # 中心化交易所配置
+        self.trader = strategy.trader  # 交易执行器
+        self.bbo = strategy.bbo  # 最新的市场数据
+        self.positions = strategy.positions  # 当前持仓信息
+        self.instruments = strategy.instruments  # 交易对信息缓存
+        self.order_books = strategy.order_books  # 本地订单簿
+        self.order_delay_stats = strategy.order_delay_stats  # 延迟统计对象
+        self.slippage_stats = strategy.slippage_stats  # 滑点统计对象
+        self.deal_price_stats = strategy.deal_price_stats  # 成交价格统计对象
+        self.request_budget = strategy.request_budget  # 交易所请求预算
+        self.pre_trade_guard = strategy.pre_trade_guard  # 下单前本地检查
+
+        # 交易币种
+        self.spot = pair_config.get("spot", "")
+        self.future = pair_config.get("future", "")
+        if not self.spot or not self.future:
+            raise ValueError(f"交易对配置不完整: {pair_config}")
+        self.key = f"{self.spot}/{self.future}"  # 交易对标识
+        self.symbols = [self.spot, self.future]
+        self.placeFutureSymbol = self.instruments.exchange_symbol(
+            1, self.future
+        )  # 交割合约符号
 
         # 时间参数
-        self.time_tolerance = self.config.get(
-            "time_tolerance", 5
-        )  # 时间容忍度，单位为秒
+        self.time_tolerance = config.get("time_tolerance", 5)  # 时间容忍度，单位为秒
 
-        # 辅助变量
-        self.short_span = self.config.get("ewm_config", {}).get(
-            "short_span", 3 * 60 * 60 * 100
+        # 辅助变量, 交易对配置中的参数优先
+        ewm_config = config.get("ewm_config", {})
+        self.short_span = pair_config.get(
+            "short_span", ewm_config.get("short_span", 3 * 60 * 60 * 100)
         )
-        self.long_span = self.config.get("ewm_config", {}).get(
-            "long_span", 36 * 60 * 60 * 100
+        self.long_span = pair_config.get(
+            "long_span", ewm_config.get("long_span", 36 * 60 * 60 * 100)
         )
         self.short_ewm = None
         self.long_ewm = None
 
+        # 使用历史K线预热均线
+        warmup_config = config.get("warmup_config", {})
+        self.warmup_interval = warmup_config.get("interval", "1m")  # K线周期
+        self.warmup_interval_seconds = warmup_config.get(
+            "interval_seconds", 60
+        )  # 每根K线的秒数
+        self.warmup_limit = warmup_config.get("limit", 1500)  # K线数量
+        self.ticks_per_second = warmup_config.get(
+            "ticks_per_second", 100
+        )  # 均线span按每秒100次更新换算
+        self.warm_started = False  # 均线是否由历史K线预热
+        self.warm_started_grid = False  # 网格是否由预热后的均线初始化
+
         # 异常阈值
-        self.abnormal_threshold = self.config.get("abnormal_threshold", 0.003)
+        self.abnormal_threshold = config.get("abnormal_threshold", 0.003)
 
         # 网格
-        self.grid_interval = self.config.get("grid_config", {}).get(
-            "grid_interval", 0.0007
+        grid_config = config.get("grid_config", {})
+        self.grid_interval = pair_config.get(
+            "grid_interval", grid_config.get("grid_interval", 0.0007)
         )
-        self.grid_num = self.config.get("grid_config", {}).get("grid_num", 4)
+        self.grid_num = pair_config.get("grid_num", grid_config.get("grid_num", 4))
         self.base_price = None
         self.grid_levels = None
         self.last_grid_index = None
-        # 网格挂单
-        self.grid_orders = {}  # 挂单列表，<grid_index, grid_order>
-        self.reorder_threshold = self.config.get(
+        # 网格挂单, 网格价格、方向、数量、是否等待开仓以及连续开仓信号保存在同一个结构化数组中
+        self.grid = np.zeros(2 * self.grid_num + 1, dtype=self.GRID_DTYPE)
+        self.grid_price = self.grid["price"]
+        self.grid_amount = self.grid["amount"]
+        self.grid_side = self.grid["side"]
+        self.grid_active = self.grid["active"]
+        self.grid_signal = self.grid["signal"]
+        # 网格触发索引: 等待开仓的卖/买网格按价格排序, 每个tick只取出越过开仓条件的网格
+        self.sell_trigger_index = PriceIndex()
+        self.buy_trigger_index = PriceIndex()
+        self.warm_levels = set()  # 等待开仓且连续开仓信号大于0的网格
+        self.grid_index_dirty = True  # 网格挂单变化后需要重建触发索引
+        self.reorder_threshold = config.get(
             "reorder_threshold", 0.5
         )  # 网格重新挂单的阈值, 需要更新网格是base_price在网格中部50%以内
         self.cid_to_grid_pending_order = (
@@ -508,69 +1513,89 @@ class Strategy(BaseStrategy):
         )  # cid到网格挂单的映射, 用于跟踪网格挂单{"cid": grid_order}
 
         # trade
-        self.trade_amount = 0.008  # 每次交易的数量
-
-        # 设置杠杆
-        self.leverage = self.config.get("leverage", 3)  # 杠杆倍数
+        self.trade_amount = pair_config.get("trade_amount", 0.008)  # 每次交易的数量
 
         # sync
-        self.sync = self.config.get("sync", False)  # 是否同步执行
+        self.sync = config.get("sync", False)  # 是否同步执行
 
         # 订单管理
         self.pending_orders = {}  # 等待执行的订单列表
-
-        # 仓位管理
-        self.positions = {}  # 当前持仓信息
-
-        #
-        self.total_trade_num = 0  # 总交易次数
+        # 挂单触发索引: 按网格价格排序, 每个tick只取出不再满足条件的挂单
+        self.pending_index = {"buy": PriceIndex(), "sell": PriceIndex()}
+        # 各方向挂单最近一次的<maker价格, taker价格>, 价格不变时不需要逐个检查挂单
+        self.pending_quotes = {"buy": None, "sell": None}
+        self.amend_deferred = set()  # 因请求预算不足或改单策略推迟改单的方向
+        self.amend_policy = AmendPolicy(config.get("amend_config", {}))  # 改单策略
 
         # Lock
         self.pending_orders_lock = False  # 锁，防止多线程冲突
         self.grid_orders_lock = False  # 锁，防止多线程冲突
         self.continuous_open_signal_lock = False  # 锁，防止多线程冲突
 
-        # 最小的下单price的精度
-        self.min_price_precision = self.config.get("min_price_precision", 0.01)
-        self.price_round_num = int(1 / self.min_price_precision)  # 精度转换因子
+        # 最小的下单price的精度, 加载到交易对信息后使用交割合约的价格精度
+        self.min_price_precision = self.instruments.price_tick(1, self.future)
 
         # 挂在一档前多少个价格
-        self.maker_price_offset = self.config.get("maker_price_offset", 0.1)
+        self.maker_price_offset = config.get("maker_price_offset", 0.1)
+
+        # 对冲限价的滑点容忍度
+        self.hedge_slippage_tolerance = config.get("hedge_slippage_tolerance", 0.002)
+        # 按下单精度取整后剩余或不满足最小下单量的现货对冲数量(买为正), 累计到下一次对冲
+        self.hedge_residual = 0.0
+        self.hedge_residual_lock = False  # 锁，防止多线程冲突
+        self.replayed_hedges = None  # 恢复快照重放订单期间发出的对冲[(cid, 数量)]
+
+        # 使用本地订单簿计算对冲数量的实际可成交价格
+        self.use_depth = strategy.use_depth
+        self.hedge_buffer_ticks = config.get("depth_config", {}).get(
+            "hedge_buffer_ticks", 2
+        )  # 对冲限价在最差成交档位外再放宽的价格档数
+
+        # 价差足够大时两条腿同时以taker成交, 不再先挂交割合约再对冲
+        taker_config = config.get("taker_config", {})
+        self.taker_enabled = taker_config.get("enabled", False)
+        self.taker_min_edge = taker_config.get(
+            "min_edge", 0.0005
+        )  # 按两条腿taker价格计算的价差超过网格价格的最小幅度
+        self.taker_buffer_ticks = taker_config.get(
+            "buffer_ticks", 2
+        )  # 交割合约taker限价在一档外放宽的价格档数
+        self.leg_dispatcher = strategy.leg_dispatcher  # 双账户并行下单
+        self.leg_pairs = {}  # <交割合约cid, LegPair>, 等待交割合约腿结束的taker开仓
+        self.flatten_cids = set()  # 平仓订单的cid, 成交后不需要对冲
+        self.flattening = False  # 平仓确认期间不开仓
+
+        # 提前撤单: 按撤单延迟与价差变化速度预测撤单到达前价差是否会越过挂单价格
+        early_cancel_config = config.get("early_cancel_config", {})
+        self.early_cancel_enabled = early_cancel_config.get("enabled", False)
+        self.early_cancel_percentile = early_cancel_config.get(
+            "latency_percentile", 95
+        )  # 使用的撤单延迟分位数
+        self.early_cancel_default_latency = early_cancel_config.get(
+            "default_latency_ms", 50
+        )  # 撤单延迟样本不足时使用的延迟，单位为毫秒
+        self.early_cancel_safety_factor = early_cancel_config.get(
+            "safety_factor", 1.0
+        )  # 预测时间为撤单延迟的倍数
+        self.basis_velocity_alpha = 2 / (
+            early_cancel_config.get("velocity_span", 20) + 1
+        )  # 价差变化速度的指数平滑系数
+        self.basis_velocity = {"buy": 0.0, "sell": 0.0}  # 调整后买卖价差每秒的变化速度
+        self.last_basis = None  # <时间, 调整后买价差, 调整后卖价差>
 
         # 持续开仓信号，表明是稳定区间而不是大波动
-        # self.continuous_open_signal_min_num = 30  # 连续开仓信号最小数量
-        # self.continuous_open_signal_adjust_num = 3  # 调整时-3
-        # self.continuous_open_signal_open_adjust_num = 10  # 开仓时-10
-        self.continuous_open_signal_config = self.config.get(
-            "continuous_open_signal_config", {}
-        )
-        self.continuous_open_signal_min_num = self.continuous_open_signal_config.get(
+        continuous_open_signal_config = config.get("continuous_open_signal_config", {})
+        self.continuous_open_signal_min_num = continuous_open_signal_config.get(
             "continuous_open_signal_min_num", 30
         )
-        self.continuous_open_signal_adjust_num = self.continuous_open_signal_config.get(
+        self.continuous_open_signal_adjust_num = continuous_open_signal_config.get(
             "continuous_open_signal_adjust_num", 3
         )
         self.continuous_open_signal_open_adjust_num = (
-            self.continuous_open_signal_config.get(
+            continuous_open_signal_config.get(
                 "continuous_open_signal_open_adjust_num", 10
             )
         )
-        self.continuous_open_signal = {}  # <grid_index, count>
-
-        # 对延迟进行统计，下单，撤单，取消订单延迟
-        self.order_delay_stats = LatencyStats(
-            output_file=f"./stats/{int(time.time()*1000)}_order_delay.csv"
-        )  # 延迟统计对象
-
-        # 对滑点进行统计
-        self.slippage_stats = SlippageStats(
-            output_file=f"./stats/{int(time.time()*1000)}_slippage.csv"
-        )  # 滑点统计对象
-
-        # 对网格成交价格进行统计
-        self.deal_price_stats = dealPriceStats(
-            output_file=f"./stats/{int(time.time()*1000)}_deal_price.csv"
-        )  # 成交价格统计对象
 
     def wait_lock_release(self, lock_name, msg=None, timeout=5):
         """等待锁释放"""
@@ -591,59 +1616,286 @@ class Strategy(BaseStrategy):
                 level="INFO",
             )
 
-    def name(self):
-        """返回策略名称"""
-        return "期限价差套利策略"
+    @property
+    def short_ewm(self):
+        """短期均线, 未初始化时为None"""
+        if self.group is None:
+            return self._short_ewm
+        value = self.group.short_ewm[self.group_index]
+        return None if np.isnan(value) else float(value)
+
+    @short_ewm.setter
+    def short_ewm(self, value):
+        if self.group is None:
+            self._short_ewm = value
+        else:
+            self.group.short_ewm[self.group_index] = np.nan if value is None else value
+
+    @property
+    def long_ewm(self):
+        """长期均线, 未初始化时为None"""
+        if self.group is None:
+            return self._long_ewm
+        value = self.group.long_ewm[self.group_index]
+        return None if np.isnan(value) else float(value)
+
+    @long_ewm.setter
+    def long_ewm(self, value):
+        if self.group is None:
+            self._long_ewm = value
+        else:
+            self.group.long_ewm[self.group_index] = np.nan if value is None else value
+
+    @property
+    def base_price(self):
+        """网格基准价格, 未初始化时为None"""
+        if self.group is None:
+            return self._base_price
+        value = self.group.base_price[self.group_index]
+        return None if np.isnan(value) else float(value)
+
+    @base_price.setter
+    def base_price(self, value):
+        if self.group is None:
+            self._base_price = value
+        else:
+            self.group.base_price[self.group_index] = np.nan if value is None else value
+
+    def apply_instrument_rules(self):
+        """交易对信息变化后更新交割合约符号与价格精度"""
+        self.placeFutureSymbol = self.instruments.exchange_symbol(1, self.future)
+        self.min_price_precision = self.instruments.price_tick(1, self.future)
+
+    def _account_of(self, symbol):
+        """symbol所在的账户, 交割合约在账户1, 现货在账户0"""
+        return 1 if symbol == self.future else 0
+
+    def _round_price(self, symbol, price):
+        """价格按交易对的价格精度取整"""
+        return self.instruments.round_price(self._account_of(symbol), symbol, price)
+
+    def _capture_state(self):
+        """采集需要持久化的策略状态, 只做浅拷贝, 序列化在后台线程中完成"""
+        return {
+            "short_ewm": self.short_ewm,
+            "long_ewm": self.long_ewm,
+            "base_price": self.base_price,
+            "grid_levels": self.grid_levels,
+            "last_grid_index": self.last_grid_index,
+            "grid_orders": [
+                grid_order.to_dict() for grid_order in self._active_grid_orders()
+            ],
+            "continuous_open_signal": list(enumerate(self.grid_signal.tolist())),
+            "pending_orders": {
+                cid: order.to_dict() for cid, order in self.pending_orders.copy().items()
+            },
+            "cid_to_grid_pending_order": {
+                cid: self._pending_grid_order(cid).to_dict()
+                for cid in list(self.cid_to_grid_pending_order.keys())
+            },
+        }
 
-    def subscribes(self):
-        subs = [
-            {
-                "account_id": 0,
-                "sub": {
-                    "SubscribeWs": [
-                        {"Bbo": self.symbols},  # 订阅最优买卖价
-                    ]
-                },
-            }
-        ]
-        if self.has_account:
-            subs.append(
-                {
-                    "account_id": 0,
-                    "sub": {
-                        "SubscribeWs": [
-                            {"Order": [self.spot]},  # 订阅订单信息
-                            {"Position": [self.spot]},  # 订阅持仓信息
-                        ]
-                    },
-                }
+    def _restore_state(self, state, timestamp, max_age):
+        """从状态快照恢复, 返回均线是否已恢复
+        state: dict - 该交易对的快照
+        timestamp: int - 快照时间戳，单位为毫秒
+        max_age: float - 快照中的均线在多少秒内有效
+        """
+        # 网格与订单状态对应交易所上的真实挂单, 总是恢复
+        self.base_price = state["base_price"]
+        self.grid_levels = state["grid_levels"]
+        self.last_grid_index = state["last_grid_index"]
+        self._clear_grid_orders()
+        for order in state["grid_orders"]:
+            self._set_grid_order(GridOrder.from_dict(order))
+        self.grid_signal[:] = 0
+        for idx, count in state["continuous_open_signal"]:
+            if 0 <= int(idx) < len(self.grid):
+                self.grid_signal[int(idx)] = count
+        self.pending_orders = {
+            cid: Order.from_dict(order) for cid, order in state["pending_orders"].items()
+        }
+        self.cid_to_grid_pending_order = {
+            cid: GridOrder.from_dict(grid_order)
+            for cid, grid_order in state["cid_to_grid_pending_order"].items()
+        }
+        self._rebuild_pending_index()
+
+        # 均线只在快照足够新时恢复
+        age = time.time() - timestamp / 1000
+        ewm_restored = (
+            age <= max_age
+            and state["short_ewm"] is not None
+            and state["long_ewm"] is not None
+        )
+        if ewm_restored:
+            self.short_ewm = state["short_ewm"]
+            self.long_ewm = state["long_ewm"]
+        self.trader.log(
+            f"{self.key} 从{age:.1f}秒前的状态快照恢复, 恢复均线: {ewm_restored}\
+                \n网格级别: {self.grid_levels}, 挂单: {list(self.pending_orders.keys())}",
+            level="INFO",
+        )
+        return ewm_restored
+
+    def _reconcile_orders(self):
+        """恢复快照后与交易所核对挂单
+        1. 交易所上有但快照中没有的挂单视为孤儿订单, 全部撤销
+        2. 快照中有但交易所上已不存在的挂单, 查询最终状态并按订单回调处理(成交则对冲, 撤销则重新挂网格)
+        返回重放成交订单时发出的现货对冲[(cid, 数量)], 数量买为正, 查询挂单失败时返回None
+        """
+        result = self.trader.get_open_orders(1, self.placeFutureSymbol)
+        if result is None or "Err" in result:
+            self.trader.log(
+                f"恢复快照后查询挂单失败: {result}, 跳过核对",
+                level="ERROR",
             )
-            subs.append(
-                {
-                    "account_id": 1,
-                    "sub": {
-                        "SubscribeWs": [
-                            {"Order": [self.placeFutureSymbol]},  # 订阅订单信息
-                            {"Position": [self.placeFutureSymbol]},  # 订阅持仓信息
-                        ]
-                    },
-                }
+            return None
+        open_cids = {order["cid"] for order in result.get("Ok", None) or []}
+
+        # 撤销孤儿订单
+        orphan_cids = list(open_cids - set(self.pending_orders.keys()))
+        if orphan_cids:
+            self.trader.log(f"撤销孤儿订单: {orphan_cids}", level="WARN")
+            self.request_budget.request(
+                RequestBudget.CANCEL,
+                1,
+                "batch_cancel_order_by_id",
+                symbol=self.placeFutureSymbol,
+                client_order_ids=orphan_cids,
+                sync=self.sync,
             )
 
-        return subs
+        # 处理已不在交易所挂单列表中的订单, 记录重放成交时发出的对冲
+        self.replayed_hedges = []
+        for cid in list(self.cid_to_grid_pending_order.keys()):
+            if cid in open_cids:
+                continue
+            order_result = self.trader.get_order_by_id(
+                1, self.placeFutureSymbol, cid=cid
+            )
+            order = (
+                order_result.get("Ok", None) if isinstance(order_result, dict) else None
+            )
+            if order and order["status"].lower() in ("filled", "canceled"):
+                self.trader.log(
+                    f"重放快照订单 {cid} 的最终状态: {order['status']}", level="WARN"
+                )
+                order["symbol"] = self.instruments.internal_symbol(order["symbol"])
+                self.on_order(order)
+            else:
+                # 查询不到最终状态时按撤单处理, 将网格订单放回网格挂单列表
+                self.trader.log(
+                    f"快照订单 {cid} 查询失败: {order_result}, 按撤单处理",
+                    level="WARN",
+                )
+                grid_order = self.cid_to_grid_pending_order[cid]
+                grid_order.clear_quotes()
+                self._set_grid_order(grid_order)
+                self._remove_pending_order(cid)
+
+        replayed_hedges, self.replayed_hedges = self.replayed_hedges, None
+        return replayed_hedges
+
+    def replay_missed_orders(self):
+        """websocket重连后查询挂单的最终状态, 补处理断开期间丢失的成交与撤单推送"""
+        for cid in list(self.cid_to_grid_pending_order.keys()):
+            order_result = self.trader.get_order_by_id(
+                1, self.placeFutureSymbol, cid=cid
+            )
+            order = (
+                order_result.get("Ok", None) if isinstance(order_result, dict) else None
+            )
+            if order and order["status"].lower() in ("filled", "canceled"):
+                self.trader.log(
+                    f"重连后补处理订单 {cid} 的最终状态: {order['status']}",
+                    level="WARN",
+                )
+                order["symbol"] = self.instruments.internal_symbol(order["symbol"])
+                self.on_order(order)
+
+    @staticmethod
+    def _parse_kline(kline):
+        """解析K线数据，返回(时间戳, 收盘价), 兼容dict与list两种格式"""
+        if isinstance(kline, dict):
+            for key in ("timestamp", "open_time", "time", "t"):
+                if key in kline:
+                    timestamp = kline[key]
+                    break
+            else:
+                return None
+            close = kline.get("close", kline.get("c", None))
+            if close is None:
+                return None
+            return int(timestamp), float(close)
+        return int(kline[0]), float(kline[4])
+
+    def _fetch_kline_closes(self, account_id, symbol):
+        """获取历史K线收盘价, 返回<时间戳, 收盘价>"""
+        result = self.trader.get_kline(
+            account_id, symbol, self.warmup_interval, limit=self.warmup_limit
+        )
+        if result is None or "Err" in result:
+            self.trader.log(
+                f"获取{symbol}历史K线失败: {result}",
+                level="ERROR",
+            )
+            return {}
+        klines = result.get("Ok", []) if isinstance(result, dict) else result
+        if isinstance(klines, dict):
+            klines = klines.get("candles", klines.get("klines", []))
+        closes = {}
+        for kline in klines or []:
+            parsed = self._parse_kline(kline)
+            if parsed is not None:
+                closes[parsed[0]] = parsed[1]
+        return closes
+
+    def _warm_start_ewm(self, init_grid=True):
+        """使用两条腿的历史K线计算价差序列, 一次性向量化地预热短期/长期均线以及网格基准价格
+        init_grid: bool - 是否使用预热后的长期均线初始化网格
+        """
+        spot_closes = self._fetch_kline_closes(0, self.spot)
+        future_closes = self._fetch_kline_closes(1, self.placeFutureSymbol)
+        timestamps = sorted(spot_closes.keys() & future_closes.keys())
+        if len(timestamps) < 2:
+            self.trader.log(
+                f"历史K线数据不足({len(timestamps)}根), 跳过均线预热",
+                level="WARN",
+            )
+            return
 
-    def start(self):
-        """策略启动函数"""
-        # 设置杠杆
-        # for symbol in self.symbols:
-        #     self.trader.set_leverage(symbol, self.leverage)
-        pass
+        basis = np.array(
+            [spot_closes[ts] / future_closes[ts] for ts in timestamps], dtype=float
+        )
+        # 每根K线相当于ticks_per_kline次均线更新, 衰减系数为(1 - 1/span)^ticks_per_kline
+        ticks_per_kline = self.warmup_interval_seconds * self.ticks_per_second
+        self.short_ewm = self._ewm_from_series(basis, self.short_span, ticks_per_kline)
+        self.long_ewm = self._ewm_from_series(basis, self.long_span, ticks_per_kline)
+        self.warm_started = True
+        self.trader.log(
+            f"使用{len(basis)}根K线预热均线: short_ewm {self.short_ewm}, long_ewm {self.long_ewm}",
+            level="INFO",
+        )
 
-    def __process_symbol(self, symbol):
-        """对symbol进行调整，对于每一个回调数据，都需要处理"""
-        if "-" in symbol:
-            return symbol.replace("-20", "_")
-        return symbol
+        # 使用预热后的长期均线初始化网格
+        self.warm_started_grid = init_grid
+        if init_grid:
+            self.base_price = self.long_ewm
+            self._update_grid_levels(self.base_price)
+            self._update_grid_orders()
+            self._reset_continuous_open_signal()
+            self.last_grid_index = self.grid_num
+            self.trader.log(f"初始化网格级别: {self.grid_levels}", level="INFO")
+
+    @staticmethod
+    def _ewm_from_series(series, span, ticks_per_step):
+        """向量化计算序列末尾的指数移动平均值, 与_update_ewm的递推公式一致"""
+        decay = (1 - 1 / span) ** ticks_per_step
+        n = len(series)
+        weights = decay ** np.arange(n - 1, -1, -1, dtype=float)
+        weights[1:] *= 1 - decay  # 第一项作为初始值, 权重为decay^(n-1)
+        return float(np.dot(weights, series))
 
     def _update_ewm(self, price):
         """更新指数移动平均线"""
@@ -665,9 +1917,7 @@ class Strategy(BaseStrategy):
         """重置连续开仓信号"""
         self.wait_lock_release("continuous_open_signal_lock", "重置连续开仓信号")
         self.continuous_open_signal_lock = True  # 设置锁，防止多线程
-        self.continuous_open_signal = {}
-        for i in range(2 * self.grid_num + 1):
-            self.continuous_open_signal[i] = 0
+        self.grid_signal[:] = 0
         self.continuous_open_signal_lock = False
 
     def _update_grid_levels(self, base_price):
@@ -681,41 +1931,130 @@ class Strategy(BaseStrategy):
         """更新挂单列表, 确保挂单与网格级别一致"""
         self.wait_lock_release("grid_orders_lock", "更新网格挂单列表")
         self.grid_orders_lock = True  # 设置锁，防止多线程冲突
-        self.grid_orders = {}
-        for idx, level in enumerate(self.grid_levels):
-            if level == self.base_price:
-                continue
-            order = {
-                "price": level,
-                "amount": self.trade_amount,  # 假设每个网格的交易量为0.008
-                "side": "buy" if level < self.base_price else "sell",
-                "grid_index": idx,  # 网格索引
-            }
-            self.grid_orders[idx] = order  # 使用网格索引作为键
+        levels = np.asarray(self.grid_levels, dtype=float)
+        self.grid_price[:] = levels
+        self.grid_amount[:] = self.trade_amount  # 假设每个网格的交易量为0.008
+        self.grid_side[:] = np.where(
+            levels < self.base_price, self.SIDE_BUY, self.SIDE_SELL
+        )
+        self.grid_active[:] = levels != self.base_price  # 基准价格所在的网格不挂单
+        self.grid_index_dirty = True
         self.grid_orders_lock = False  # 释放锁
 
+    def _set_grid_order(self, grid_order):
+        """把网格订单放回网格挂单列表
+        taker开仓部分成交后, 同一网格可能同时放回未成交的数量与反向网格成交挂回的数量,
+        两者方向相同时合并数量
+        """
+        idx = grid_order.grid_index
+        if not 0 <= idx < len(self.grid):
+            self.trader.log(
+                f"{self.key} 网格订单索引超出范围: {grid_order}",
+                level="ERROR",
+            )
+            return
+        side = self.SIDE_BUY if grid_order.side == "buy" else self.SIDE_SELL
+        amount = grid_order.amount
+        if self.grid_active[idx] and self.grid_side[idx] == side:
+            amount += float(self.grid_amount[idx])
+        self.grid_price[idx] = grid_order.price
+        self.grid_amount[idx] = amount
+        self.grid_side[idx] = side
+        self.grid_active[idx] = True
+        self.grid_index_dirty = True
+
+    def _grid_order_at(self, idx):
+        """网格挂单数组中的一行转换为GridOrder"""
+        return GridOrder(
+            idx,
+            float(self.grid_price[idx]),
+            float(self.grid_amount[idx]),
+            "buy" if self.grid_side[idx] == self.SIDE_BUY else "sell",
+        )
+
+    def _rebuild_grid_index(self):
+        """网格挂单变化后重建触发索引与连续开仓信号不为0的网格集合"""
+        for side, index in (
+            (self.SIDE_SELL, self.sell_trigger_index),
+            (self.SIDE_BUY, self.buy_trigger_index),
+        ):
+            rows = np.flatnonzero(self.grid_active & (self.grid_side == side))
+            index.rebuild(zip(self.grid_price[rows].tolist(), rows.tolist()))
+        self.warm_levels = set(
+            np.flatnonzero(self.grid_active & (self.grid_signal > 0)).tolist()
+        )
+        self.grid_index_dirty = False
+
+    def _clear_grid_orders(self):
+        """清空网格挂单列表"""
+        self.grid_active[:] = False
+        self.grid_index_dirty = True
+
+    def _rebuild_pending_index(self):
+        """恢复快照后重建挂单触发索引, 下一个tick重新检查所有挂单价格"""
+        items = {"buy": [], "sell": []}
+        for cid in self.pending_orders:
+            grid_order = self.cid_to_grid_pending_order.get(cid, None)
+            if grid_order is not None:
+                items[grid_order.side].append((grid_order.price, cid))
+        for side, index in self.pending_index.items():
+            index.rebuild(items[side])
+        self.pending_quotes = {"buy": None, "sell": None}
+
+    def _pending_grid_order(self, cid):
+        """挂单对应的网格订单, 挂单仍有效时maker/taker价格为最近一个tick该方向的价格"""
+        grid_order = self.cid_to_grid_pending_order[cid]
+        if cid in self.pending_orders:
+            quote = self.pending_quotes[grid_order.side]
+            if quote is not None:
+                grid_order.maker_price, grid_order.taker_price = quote
+        return grid_order
+
+    def _active_grid_orders(self):
+        """当前等待开仓的网格挂单"""
+        return [
+            self._grid_order_at(idx)
+            for idx in np.flatnonzero(self.grid_active).tolist()
+        ]
+
     def _remove_pending_order(self, cid):
         """从pending_orders挂单列表中移除指定的挂单,并且删除所对应的cid_to_grid_pending_order映射"""
         self.wait_lock_release("pending_orders_lock", "移除挂单")
         self.pending_orders_lock = True  # 设置锁，防止多线程冲突
         if cid in self.pending_orders:
             del self.pending_orders[cid]
+            grid_order = self.cid_to_grid_pending_order.get(cid, None)
+            if grid_order is not None:
+                self.pending_index[grid_order.side].remove(grid_order.price, cid)
         if cid in self.cid_to_grid_pending_order:
             del self.cid_to_grid_pending_order[cid]
         self.pending_orders_lock = False  # 释放锁
 
-    def on_bbo(self, exchange, bbo):
-        """处理BBO数据
-        exchange: str - 交易所名称
-        bbo: dict - BBO数据
+    def _executable_price(self, symbol, side, amount):
+        """按数量计算可成交的价格
+        side: str - 'buy' 或 'sell'
+        amount: float - 数量
+        返回 (vwap, worst_price), 没有可用深度时返回 (一档价格, None)
         """
-        # 先对symbol进行处理
-        bbo["symbol"] = self.__process_symbol(bbo["symbol"])
-
-        # 更新最新的BBO数据
-        symbol = bbo["symbol"]
-        self.bbo[symbol] = bbo
-
+        bbo = self.bbo[symbol]
+        top_price = bbo.ask_price if side.lower() == "buy" else bbo.bid_price
+        book = self.order_books.get(symbol, None) if self.use_depth else None
+        if (
+            book is None
+            or book.timestamp is None
+            or abs(bbo.timestamp - book.timestamp) > self.time_tolerance * 1000
+        ):
+            return top_price, None
+        vwap, worst_price = book.sweep(side, amount)
+        if vwap is None:
+            return top_price, None
+        # 深度推送慢于bbo, 可成交价格不会优于一档
+        if side.lower() == "buy":
+            return max(vwap, top_price), max(worst_price, top_price)
+        return min(vwap, top_price), min(worst_price, top_price)
+
+    def on_bbo(self):
+        """交易对中任一symbol的BBO更新时由Strategy调用"""
         # ========================数据检查与状态更新========================
 
         # 检查BBO数据是否完整
@@ -728,9 +2067,13 @@ class Strategy(BaseStrategy):
             )
             return
 
+        # 使用bbo副本运行
+        spot_bbo = self.bbo[self.spot]
+        future_bbo = self.bbo[self.future]
+
         # 如果数据时间戳异常，直接返回
         if (
-            abs(self.bbo[self.spot]["timestamp"] - self.bbo[self.future]["timestamp"])
+            abs(spot_bbo.timestamp - future_bbo.timestamp)
             > self.time_tolerance * 1000
         ):
             self.trader.tlog(
@@ -741,49 +2084,60 @@ class Strategy(BaseStrategy):
             )
             return
 
-        # 使用bbo副本运行
-        bbo_copy = self.bbo.copy()
-
-        adjusted_bbo = {
-            self.spot: {
-                "ask_price": (bbo_copy[self.spot]["ask_price"]),
-                "bid_price": (bbo_copy[self.spot]["bid_price"]),
-            },
-            self.future: {
-                "ask_price": (
-                    bbo_copy[self.future]["ask_price"] - self.maker_price_offset
-                    if bbo_copy[self.future]["ask_price"] - self.maker_price_offset
-                    > bbo_copy[self.spot]["bid_price"]
-                    else bbo_copy[self.future]["bid_price"] + self.min_price_precision
-                ),
-                "bid_price": (
-                    bbo_copy[self.future]["bid_price"] + self.maker_price_offset
-                    if bbo_copy[self.future]["bid_price"] + self.maker_price_offset
-                    < bbo_copy[self.spot]["ask_price"]
-                    else bbo_copy[self.future]["ask_price"] - self.min_price_precision
-                ),
-            },
-        }
+        # 现货对冲按交易数量的实际可成交均价计算
+        spot_ask_price, _ = self._executable_price(self.spot, "buy", self.trade_amount)
+        spot_bid_price, _ = self._executable_price(self.spot, "sell", self.trade_amount)
+        adjusted_spot = Bbo(self.spot, spot_ask_price, spot_bid_price)
+        adjusted_future = Bbo(
+            self.future,
+            (
+                future_bbo.ask_price - self.maker_price_offset
+                if future_bbo.ask_price - self.maker_price_offset > spot_bbo.bid_price
+                else future_bbo.bid_price + self.min_price_precision
+            ),
+            (
+                future_bbo.bid_price + self.maker_price_offset
+                if future_bbo.bid_price + self.maker_price_offset < spot_bbo.ask_price
+                else future_bbo.ask_price - self.min_price_precision
+            ),
+            future_bbo.timestamp,
+        )
 
         # 计算买卖数据
-        buy_price = (
-            bbo_copy[self.spot]["ask_price"] / bbo_copy[self.future]["ask_price"]
-        )
-        sell_price = (
-            bbo_copy[self.spot]["bid_price"] / bbo_copy[self.future]["bid_price"]
-        )
+        buy_price = spot_bbo.ask_price / future_bbo.ask_price
+        sell_price = spot_bbo.bid_price / future_bbo.bid_price
         middle_price = (buy_price + sell_price) / 2
 
-        adjusted_buy_price = (
-            adjusted_bbo[self.spot]["ask_price"]
-            / adjusted_bbo[self.future]["ask_price"]
-        )
-        adjusted_sell_price = (
-            adjusted_bbo[self.spot]["bid_price"]
-            / adjusted_bbo[self.future]["bid_price"]
+        adjusted_buy_price = adjusted_spot.ask_price / adjusted_future.ask_price
+        adjusted_sell_price = adjusted_spot.bid_price / adjusted_future.bid_price
+
+        if self.group is not None:
+            self.group.update_edges(
+                self.group_index, adjusted_buy_price, adjusted_sell_price
+            )
+        self._on_prices(
+            adjusted_spot,
+            adjusted_future,
+            middle_price,
+            adjusted_buy_price,
+            adjusted_sell_price,
         )
 
-        #
+    def _on_prices(
+        self,
+        adjusted_spot,
+        adjusted_future,
+        middle_price,
+        adjusted_buy_price,
+        adjusted_sell_price,
+        ewm_updated=False,
+    ):
+        """根据当前价格更新均线, 检查挂单, 调整网格以及检查开仓
+        adjusted_spot/adjusted_future: Bbo - 调整后的现货与交割合约买卖价
+        middle_price: float - 中间价差
+        adjusted_buy_price/adjusted_sell_price: float - 调整后的买卖价差
+        ewm_updated: bool - 均线是否已经由ExpiryGroup批量更新
+        """
         if self.short_ewm is None or self.long_ewm is None:
             # 如果指数移动平均线未初始化，直接使用当前middle价格
             self.trader.log(
@@ -796,21 +2150,40 @@ class Strategy(BaseStrategy):
             self.last_grid_index = self.grid_num  # 初始化网格索引
             return
 
-        # 如果数据异常，直接返回
-        if (
-            abs(middle_price - self.short_ewm)
-            > self.abnormal_threshold * self.short_ewm
-        ):
-            self.trader.tlog(
-                tag="数据异常",
-                msg=f"数据异常，跳过当前处理: {middle_price}",
-                interval=2,
-                level="WARN",
-            )
-            return
+        # 预热的均线与实时价格偏差过大时放弃预热结果, 使用当前价格重新初始化
+        if self.warm_started:
+            self.warm_started = False
+            if (
+                abs(middle_price - self.short_ewm)
+                > self.abnormal_threshold * self.short_ewm
+            ):
+                self.trader.log(
+                    f"预热均线 {self.short_ewm} 与当前middle价格 {middle_price} 偏差过大, 放弃预热结果",
+                    level="WARN",
+                )
+                self.short_ewm = None
+                self.long_ewm = None
+                if self.warm_started_grid:
+                    self.grid_levels = None
+                    self._clear_grid_orders()
+                return
+
+        if not ewm_updated:
+            # 如果数据异常，直接返回
+            if (
+                abs(middle_price - self.short_ewm)
+                > self.abnormal_threshold * self.short_ewm
+            ):
+                self.trader.tlog(
+                    tag="数据异常",
+                    msg=f"{self.key} 数据异常，跳过当前处理: {middle_price}",
+                    interval=2,
+                    level="WARN",
+                )
+                return
 
-        # 更新指数移动平均线
-        self._update_ewm(middle_price)
+            # 更新指数移动平均线
+            self._update_ewm(middle_price)
 
         # 如果网格级别未初始化，使用当前价格初始化
         if self.grid_levels is None:
@@ -819,123 +2192,32 @@ class Strategy(BaseStrategy):
             self._update_grid_orders()
             self._reset_continuous_open_signal()  # 重置连续开仓信号
             self.trader.log(
-                f"初始化网格级别: {self.grid_levels}, 网格挂单: {self.grid_orders}",
+                f"初始化网格级别: {self.grid_levels}, 网格挂单: {self._active_grid_orders()}",
                 level="INFO",
             )
 
         # ========================订单检查=========================
 
-        # 这里不使用锁是因为可以接受同时有多个线程在执行订单检查
-        # 检查是否现在未成交的maker订单是否满足条件
-        pending_orders_copy = self.pending_orders.copy()
-        for cid, order in pending_orders_copy.items():
-            grid_order = self.cid_to_grid_pending_order.get(cid, None)
-            if grid_order is None:
-                self.trader.log(
-                    f"订单 {cid} 找不到对应的网格挂单",
-                    level="ERROR",
-                )
-                continue
-
-            if (
-                grid_order["side"] == "buy"
-                and grid_order["price"] >= adjusted_buy_price
-            ):
-                grid_order["maker_price"] = np.round(
-                    adjusted_bbo[self.future]["ask_price"],
-                    self.price_round_num,
-                )  # 确保自己是最前面的订单
-                grid_order["taker_price"] = np.round(
-                    adjusted_bbo[self.spot]["ask_price"], self.price_round_num
-                )
-                # 如果当前网格订单依旧满足条件，则不需要重新挂单
-                # 检查订单是否为远期卖价一档
-                if (
-                    abs(order["price"] - grid_order["maker_price"])
-                    < self.min_price_precision
-                ):
-                    continue
-                else:
-                    # 改单
-                    last_price = order["price"]
-                    order["price"] = grid_order["maker_price"]
-                    # 统计订单延迟
-                    self.order_delay_stats.add_when_submit(order, "amend_order")
-                    # 统计滑点
-                    self.slippage_stats.add_when_place(
-                        order, "grid_order", grid_order["maker_price"]
-                    )
-                    res = self.trader.amend_order(1, order, sync=self.sync)
-                    self.trader.tlog(
-                        tag="改单",
-                        msg=f"订单 {cid}, 方向 {grid_order['side']} 原价 {last_price} -> 新价 {order['price']} \
-                            \n改单结果: {res}",
-                        level="INFO",
-                        interval=1,
-                    )
-            elif (
-                grid_order["side"] == "sell"
-                and grid_order["price"] <= adjusted_sell_price
-            ):
-                grid_order["maker_price"] = np.round(
-                    adjusted_bbo[self.future]["bid_price"],
-                    self.price_round_num,
-                )  # 确保自己是最前面的订单
-                grid_order["taker_price"] = np.round(
-                    adjusted_bbo[self.spot]["bid_price"], self.price_round_num
-                )
-                # 如果当前网格订单依旧满足条件，则不需要重新挂单
-                # 检查订单是否为远期买价一档
-                if (
-                    abs(order["price"] - grid_order["maker_price"])
-                    < self.min_price_precision
-                ):
-                    continue
-                else:
-                    # 改单
-                    last_price = order["price"]
-                    order["price"] = grid_order["maker_price"]
-                    # 统计订单延迟
-                    self.order_delay_stats.add_when_submit(order, "amend_order")
-                    # 统计滑点
-                    self.slippage_stats.add_when_place(
-                        order, "grid_order", grid_order["maker_price"]
-                    )
-                    res = self.trader.amend_order(1, order, sync=self.sync)
-                    self.trader.tlog(
-                        tag="改单",
-                        msg=f"订单 {cid}, 方向 {grid_order['side']} 原价 {last_price} -> 新价 {order['price']} \
-                            \n改单结果: {res}",
-                        level="INFO",
-                        interval=1,
-                    )
-            else:
-                # 取消订单
-                # 统计订单延迟
-                self.order_delay_stats.add_when_submit(order, "cancel_order")
-                res = self.trader.batch_cancel_order_by_id(
-                    1,
-                    client_order_ids=[cid],
-                    symbol=self.placeFutureSymbol,
-                    sync=self.sync,
-                )
-                self.trader.tlog(
-                    tag="取消订单",
-                    msg=f"订单 {cid} 不满足条件，取消订单 \
-                        \n取消结果: {res}",
-                    level="INFO",
-                    interval=1,
-                )
-                self.wait_lock_release("pending_orders_lock", "检查未成交挂单")
-                self.pending_orders_lock = True  # 设置锁，防止多线程冲突
-                if cid in self.pending_orders:
-                    del self.pending_orders[cid]
-                self.pending_orders_lock = False  # 释放锁
+        # 开启提前撤单时, 使用撤单到达交易所时的预测价差判断挂单与开仓条件,
+        # 预计在撤单延迟内会失效的挂单提前撤掉, 也不再挂出
+        adjusted_buy_price, adjusted_sell_price = self._projected_prices(
+            adjusted_future.timestamp, adjusted_buy_price, adjusted_sell_price
+        )
 
-            # 按理来说取消挂单就需要将网格挂单重新挂单，也就是添加回网格挂单列表
-            # 但是我们希望在收到订单回执时知道某一订单对应的是哪个网格挂单
-            # 所以这里不需要将网格挂单重新添加到网格挂单列表，重新挂单的操作在接受到订单取消时执行
-            # 所以这里只删除self.pending_orders，取消的订单不需要再做订单检查
+        # 这里不使用锁是因为可以接受同时有多个线程在执行订单检查
+        # 检查是否现在未成交的maker订单是否满足条件, 只处理越过条件的挂单以及价格变化的方向
+        self._check_pending_side(
+            "buy",
+            self.pending_index["buy"].below(adjusted_buy_price),
+            self._round_price(self.future, adjusted_future.ask_price),
+            self._round_price(self.spot, adjusted_spot.ask_price),
+        )  # 确保自己是远期卖价一档
+        self._check_pending_side(
+            "sell",
+            self.pending_index["sell"].above(adjusted_sell_price),
+            self._round_price(self.future, adjusted_future.bid_price),
+            self._round_price(self.spot, adjusted_spot.bid_price),
+        )  # 确保自己是远期买价一档
 
         # ========================检查是否需要修改网格=========================
 
@@ -946,13 +2228,8 @@ class Strategy(BaseStrategy):
                 msg=f"基准价格 {self.base_price} 与长期均线 {self.long_ewm} 差异超过阈值，调整网格",
                 level="INFO",
             )
-            # 撤掉所有挂单
-            order_cids = list(self.pending_orders.keys())
-            if order_cids:
-                self.trader.batch_cancel_order_by_id(0, client_order_ids=order_cids)
-
-            # 市价平掉持有仓位
-            self._market_close_all()
+            # 撤掉所有挂单并同时平掉两条腿的仓位
+            self.strategy.flatten([self])
 
             # 更新网格与基准价格
             self.base_price = self.long_ewm
@@ -962,7 +2239,7 @@ class Strategy(BaseStrategy):
             self._reset_continuous_open_signal()
 
             # 清空当前网格挂单
-            self.grid_orders = {}
+            self._clear_grid_orders()
             # 检查是否需要重新挂单
             if (
                 self.base_price
@@ -984,22 +2261,14 @@ class Strategy(BaseStrategy):
                 self._update_grid_orders()
                 self.trader.tlog(
                     tag="网格调整",
-                    msg=f"重新挂单: {self.grid_orders}",
+                    msg=f"重新挂单: {self._active_grid_orders()}",
                     level="INFO",
                 )
 
         # ========================检查是否需要开仓=============================
 
         # 计算当前网格索引
-        grid_index = np.searchsorted(self.grid_levels, middle_price)
-        buy_index = np.searchsorted(self.grid_levels, adjusted_buy_price)
-        sell_index = np.searchsorted(self.grid_levels, adjusted_sell_price)
-
-        # 检查是否需要执行交易
-        if buy_index == self.last_grid_index and sell_index == self.last_grid_index:
-            # 当前网格索引与上次相同，不需要执行交易
-            self.last_grid_index = grid_index
-            return
+        grid_index = int(np.searchsorted(self.grid_levels, middle_price))
 
         # 同一时刻只能有一个线程在执行网格挂单操作以及连续开仓信号的处理
         self.wait_lock_release("grid_orders_lock")
@@ -1008,83 +2277,72 @@ class Strategy(BaseStrategy):
         self.wait_lock_release("continuous_open_signal_lock", "处理连续开仓信号")
         self.continuous_open_signal_lock = True  # 设置锁，防止多线程冲突
 
-        grid_orders_copy = self.grid_orders.copy()
-        for grid_index, grid_order in grid_orders_copy.items():
-            continuous_open_signal_count = self.continuous_open_signal[grid_index]
-            if (
-                grid_order["side"] == "sell"
-                and grid_order["price"]
-                <= adjusted_sell_price  # 这里的+0.00005调整是因为希望开仓条件苛刻一点，以免频繁的挂单又撤单，下面同理
-            ):
-                if continuous_open_signal_count < self.continuous_open_signal_min_num:
+        # 通过触发索引只取出满足开仓条件的网格, 连续开仓信号只更新越过条件或计数不为0的网格
+        if self.grid_index_dirty:
+            self._rebuild_grid_index()
+        sell_crossed = self.sell_trigger_index.at_or_below(adjusted_sell_price)
+        buy_crossed = self.buy_trigger_index.at_or_above(adjusted_buy_price)
+        signal = self.grid_signal
+        warm_levels = self.warm_levels
+        ready = []
+        crossed = set()
+        for side, crossed_levels in (("sell", sell_crossed), ("buy", buy_crossed)):
+            for idx in crossed_levels:
+                crossed.add(idx)
+                if signal[idx] >= self.continuous_open_signal_min_num:
+                    ready.append((idx, side))
+                else:
                     # 如果连续开仓信号小于最小数量，不执行交易
-                    self.continuous_open_signal[grid_index] += 1
-                    continue
-                grid_order["maker_price"] = np.round(
-                    adjusted_bbo[self.future]["bid_price"],
-                    self.price_round_num,
+                    signal[idx] += 1
+                    warm_levels.add(idx)
+        # 不满足开仓条件，减少连续开仓信号计数
+        for idx in warm_levels - crossed if warm_levels else ():
+            signal[idx] -= self.continuous_open_signal_adjust_num
+            if signal[idx] <= 0:
+                signal[idx] = 0
+                warm_levels.discard(idx)
+
+        for idx, side in sorted(ready):
+            # 多个交割合约时, 只有价差最优的交割合约执行开仓
+            if self.group is not None and not self.group.is_best(
+                self.group_index, side
+            ):
+                continue
+            grid_order = self._grid_order_at(idx)
+            if side == "sell":
+                grid_order.maker_price = self._round_price(
+                    self.future, adjusted_future.bid_price
                 )  # 由于交割合约买卖一档spread很大，可以适当提高买价
-                grid_order["taker_price"] = np.round(
-                    adjusted_bbo[self.spot]["bid_price"], self.price_round_num
-                )
-                # 执行卖出操作
-                placeSuccess = self._exec_grid_order(grid_order=grid_order)
-                if not placeSuccess:
-                    continue
-                self.trader.log(
-                    f"buy_price: {adjusted_buy_price}, sell_price: {adjusted_sell_price}\
-                        \n执行卖出操作: {json.dumps(grid_order, indent=2)}",
-                    level="INFO",
+                grid_order.taker_price = self._round_price(
+                    self.spot, adjusted_spot.bid_price
                 )
-                # 交易执行成功，需要调整连续开仓信号
-                self.continuous_open_signal[
-                    grid_index
-                ] -= self.continuous_open_signal_open_adjust_num
-                if self.continuous_open_signal[grid_index] < 0:
-                    self.continuous_open_signal[grid_index] = 0
-
-            elif (
-                grid_order["side"] == "buy"
-                and grid_order["price"] >= adjusted_buy_price
-            ):
-                if continuous_open_signal_count < self.continuous_open_signal_min_num:
-                    # 如果连续开仓信号小于最小数量，不执行交易
-                    self.continuous_open_signal[grid_index] += 1
-                    continue
-                grid_order["maker_price"] = np.round(
-                    adjusted_bbo[self.future]["ask_price"],
-                    self.price_round_num,
+            else:
+                grid_order.maker_price = self._round_price(
+                    self.future, adjusted_future.ask_price
                 )  # 由于交割合约买卖一档spread很大，可以适当降低卖价
-                grid_order["taker_price"] = np.round(
-                    adjusted_bbo[self.spot]["ask_price"], self.price_round_num
-                )
-                # 执行买入操作
-                placeSuccess = self._exec_grid_order(grid_order=grid_order)
-                if not placeSuccess:
-                    continue
-                self.trader.log(
-                    f"buy_price: {adjusted_buy_price}, sell_price: {adjusted_sell_price}\
-                        \n执行买入操作: {json.dumps(grid_order, indent=2)}",
-                    level="INFO",
+                grid_order.taker_price = self._round_price(
+                    self.spot, adjusted_spot.ask_price
                 )
-                # 交易执行成功，需要调整连续开仓信号
-                self.continuous_open_signal[
-                    grid_index
-                ] -= self.continuous_open_signal_open_adjust_num
-                if self.continuous_open_signal[grid_index] < 0:
-                    self.continuous_open_signal[grid_index] = 0
+            # 执行交易, 两条腿taker价格下的价差仍然足够时同时发送两条腿
+            taker_prices = self._taker_prices(side, grid_order, adjusted_spot)
+            if taker_prices is not None:
+                placeSuccess = self._exec_taker_pair(grid_order, *taker_prices)
             else:
-                self.continuous_open_signal[
-                    grid_index
-                ] -= (
-                    self.continuous_open_signal_adjust_num
-                )  # 如果不满足开仓条件，减少连续开仓信号计数
-                if self.continuous_open_signal[grid_index] < 0:
-                    self.continuous_open_signal[grid_index] = 0
+                placeSuccess = self._exec_grid_order(grid_order=grid_order)
+            if not placeSuccess:
                 continue
-
+            self.trader.log(
+                f"buy_price: {adjusted_buy_price}, sell_price: {adjusted_sell_price}\
+                    \n执行{'卖出' if side == 'sell' else '买入'}操作: {json.dumps(grid_order.to_dict(), indent=2)}",
+                level="INFO",
+            )
+            # 交易执行成功，需要调整连续开仓信号
+            signal[idx] = max(
+                signal[idx] - self.continuous_open_signal_open_adjust_num, 0
+            )
             # 从网格挂单中移除正在执行的订单
-            self.grid_orders.pop(grid_index, None)
+            self.grid_active[idx] = False
+            self.grid_index_dirty = True
 
         self.continuous_open_signal_lock = False  # 释放锁
         self.grid_orders_lock = False  # 释放锁
@@ -1092,174 +2350,475 @@ class Strategy(BaseStrategy):
         # 更新上次网格索引
         self.last_grid_index = grid_index
 
+    def _update_basis_velocity(self, timestamp, adjusted_buy_price, adjusted_sell_price):
+        """更新调整后买卖价差的变化速度
+        timestamp: float - 交割合约行情时间，单位为毫秒
+        """
+        now = timestamp if timestamp else time.time() * 1000
+        if self.last_basis is not None:
+            dt = (now - self.last_basis[0]) / 1000
+            if dt > 0:
+                alpha = self.basis_velocity_alpha
+                for side, price, last_price in (
+                    ("buy", adjusted_buy_price, self.last_basis[1]),
+                    ("sell", adjusted_sell_price, self.last_basis[2]),
+                ):
+                    velocity = (price - last_price) / dt
+                    self.basis_velocity[side] += alpha * (
+                        velocity - self.basis_velocity[side]
+                    )
+        self.last_basis = (now, adjusted_buy_price, adjusted_sell_price)
+
+    def _projected_prices(self, timestamp, adjusted_buy_price, adjusted_sell_price):
+        """撤单到达交易所时的预测价差, 只向不利方向预测
+        返回: (买单判断价格, 卖单判断价格)
+        """
+        if not self.early_cancel_enabled:
+            return adjusted_buy_price, adjusted_sell_price
+        self._update_basis_velocity(timestamp, adjusted_buy_price, adjusted_sell_price)
+        latency = self.order_delay_stats.percentile(
+            "cancel_order", self.early_cancel_percentile
+        )
+        if latency is None:
+            latency = self.early_cancel_default_latency
+        horizon = latency / 1000 * self.early_cancel_safety_factor
+        # 买价差上涨时买单会失效, 卖价差下跌时卖单会失效
+        return (
+            adjusted_buy_price + max(self.basis_velocity["buy"], 0.0) * horizon,
+            adjusted_sell_price + min(self.basis_velocity["sell"], 0.0) * horizon,
+        )
+
+    def _check_pending_side(self, side, invalid_cids, maker_price, taker_price):
+        """检查一个方向的挂单
+        side: str - 网格方向
+        invalid_cids: list - 不再满足条件需要取消的挂单
+        maker_price/taker_price: float - 该方向当前的挂单价格与对冲价格
+        """
+        last_quote = self.pending_quotes[side]
+        for cid in invalid_cids:
+            order = self.pending_orders.get(cid, None)
+            grid_order = self.cid_to_grid_pending_order.get(cid, None)
+            if order is None or grid_order is None:
+                self.trader.log(
+                    f"订单 {cid} 找不到对应的网格挂单",
+                    level="ERROR",
+                )
+                self.pending_index[side].discard(cid)
+                continue
+            # 保留最后一次满足条件时的价格
+            if last_quote is not None:
+                grid_order.maker_price, grid_order.taker_price = last_quote
+
+            # 取消订单
+            # 统计订单延迟
+            self.order_delay_stats.add_when_submit(order, "cancel_order")
+            res = self.request_budget.request(
+                RequestBudget.CANCEL,
+                1,
+                "batch_cancel_order_by_id",
+                client_order_ids=[cid],
+                symbol=self.placeFutureSymbol,
+                sync=self.sync,
+            )
+            self.trader.tlog(
+                tag="取消订单",
+                msg=f"订单 {cid} 不满足条件，取消订单 \
+                    \n取消结果: {res}",
+                level="INFO",
+                interval=1,
+            )
+            self.wait_lock_release("pending_orders_lock", "检查未成交挂单")
+            self.pending_orders_lock = True  # 设置锁，防止多线程冲突
+            if cid in self.pending_orders:
+                del self.pending_orders[cid]
+                self.pending_index[side].remove(grid_order.price, cid)
+            self.pending_orders_lock = False  # 释放锁
+
+            # 按理来说取消挂单就需要将网格挂单重新挂单，也就是添加回网格挂单列表
+            # 但是我们希望在收到订单回执时知道某一订单对应的是哪个网格挂单
+            # 所以这里不需要将网格挂单重新添加到网格挂单列表，重新挂单的操作在接受到订单取消时执行
+            # 所以这里只删除self.pending_orders，取消的订单不需要再做订单检查
+
+        self.pending_quotes[side] = (maker_price, taker_price)
+        if (
+            last_quote is not None
+            and last_quote[0] == maker_price
+            and side not in self.amend_deferred
+        ):
+            # 挂单价格没有变化，不需要改单
+            return
+        self.amend_deferred.discard(side)
+
+        # 如果当前网格订单依旧满足条件，则不需要重新挂单, 只在价格变化时改单
+        for cid in list(self.pending_index[side].keys):
+            order = self.pending_orders.get(cid, None)
+            grid_order = self.cid_to_grid_pending_order.get(cid, None)
+            if order is None or grid_order is None:
+                continue
+            grid_order.maker_price = maker_price
+            grid_order.taker_price = taker_price
+            if abs(order.price - maker_price) < self.min_price_precision:
+                continue
+            now = time.time() * 1000
+            reason = self.amend_policy.skip_reason(
+                cid, order.side, order.price, maker_price, self.min_price_precision, now
+            )
+            if reason is not None:
+                if reason in ("dwell", "inflight"):
+                    # 等待结束后按最新的目标价格改单
+                    self.amend_deferred.add(side)
+                continue
+            # 改单预算不足时保留原价格, 之后的tick只发送最新的价格
+            if not self.request_budget.acquire(RequestBudget.AMEND, 1, "amend_order"):
+                self.amend_deferred.add(side)
+                continue
+            # 改单
+            last_price = order.price
+            order.price = maker_price
+            # 统计订单延迟
+            self.order_delay_stats.add_when_submit(order, "amend_order")
+            # 统计滑点
+            self.slippage_stats.add_when_place(order, "grid_order", maker_price)
+            res = self.trader.amend_order(1, order.to_dict(), sync=self.sync)
+            self.amend_policy.on_sent(cid, last_price, now)
+            if self.sync:
+                # 同步改单时直接处理回报
+                self.on_order_amended(res, order.to_dict())
+            self.trader.tlog(
+                tag="改单",
+                msg=f"订单 {cid}, 方向 {side} 原价 {last_price} -> 新价 {order.price} \
+                    \n改单结果: {res}",
+                level="INFO",
+                interval=1,
+            )
+
     def _exec_grid_order(self, grid_order):
         """执行网格订单
-        grid_order: dict - 网格订单信息
+        grid_order: GridOrder - 网格订单信息
         """
         # 注意这里拿到的价格是网格的价格，而不是挂单的价格
         # 执行交易逻辑
         # 交割合约挂单
         # 交割合约挂单方向与网格方向相反
-        grid_side = grid_order["side"]
+        grid_side = grid_order.side
         actual_side = "buy" if grid_side == "sell" else "sell"
+        amount = self.instruments.round_amount(1, self.future, grid_order.amount)
+        if self.flattening:
+            return False
+        if self.strategy.opening_halted and self._increases_position(
+            actual_side, amount
+        ):
+            self.trader.tlog(
+                tag="全局风控",
+                msg=f"{self.key} 全局风控停止开仓, 跳过增加持仓的网格订单",
+                interval=10,
+                level="WARN",
+            )
+            return False
+        reject_reason = self.instruments.check_order(
+            1, self.future, grid_order.maker_price, amount
+        ) or self.pre_trade_guard.check(
+            1, self.future, actual_side, amount, grid_order.maker_price
+        )
+        if reject_reason is not None:
+            self.trader.tlog(
+                tag="网格订单检查",
+                msg=f"网格订单不满足下单规则: {reject_reason}",
+                interval=5,
+                level="ERROR",
+            )
+            return False
+        # 新挂单预算不足时不挂单, 保留给撤单与对冲
+        if not self.request_budget.acquire(RequestBudget.PLACE, 1, "place_order"):
+            self.pre_trade_guard.release(
+                1, self.future, actual_side, amount, grid_order.maker_price
+            )
+            self.trader.tlog(
+                tag="请求预算",
+                msg=f"{self.key} 请求预算不足, 跳过新挂单",
+                interval=5,
+                level="WARN",
+            )
+            return False
         cid = self.trader.create_cid(self.cex_configs[1]["exchange"])
-        order = {
-            "cid": cid,
-            "symbol": self.placeFutureSymbol,  # 使用交割合约符号
-            "order_type": "Limit",
-            "side": actual_side.capitalize(),
-            "amount": grid_order["amount"],  # 使用网格的数量
-            "price": grid_order["maker_price"],  # 使用网格的maker价格
-            "time_in_force": "PostOnly",  # 持续有效
-        }
+        order = Order(
+            cid,
+            self.placeFutureSymbol,  # 使用交割合约符号
+            "Limit",
+            actual_side.capitalize(),
+            amount,  # 使用网格的数量
+            grid_order.maker_price,  # 使用网格的maker价格
+            "PostOnly",  # 持续有效
+        )
         # 统计订单延迟
         self.order_delay_stats.add_when_submit(order, "place_order")
 
         # 统计滑点 - 记录期望价格
-        self.slippage_stats.add_when_place(
-            order, "grid_order", grid_order["maker_price"]
-        )
+        self.slippage_stats.add_when_place(order, "grid_order", grid_order.maker_price)
 
         # 执行挂单
-        place_order_result = self.trader.place_order(1, order)
+        place_order_result = self.trader.place_order(1, order.to_dict())
         if "Err" in place_order_result:
             self.trader.log(
                 f"挂单失败: {place_order_result['Err']}",
                 level="ERROR",
             )
+            self.pre_trade_guard.release(
+                1, self.future, actual_side, amount, grid_order.maker_price
+            )
+            # 本地检查通过但交易所拒单, 重新获取余额与最大可持仓
+            self.strategy.refresh_pre_trade_guard(1)
             return False
         # 记录订单信息
         self.cid_to_grid_pending_order[cid] = grid_order
         self.wait_lock_release("pending_orders_lock", "添加挂单到pending_orders")
         self.pending_orders_lock = True
         self.pending_orders[cid] = order
+        self.pending_index[grid_order.side].add(grid_order.price, cid)
         self.pending_orders_lock = False  # 释放锁
+        self.amend_policy.on_placed(cid, time.time() * 1000)
+        return True
+
+    def _taker_prices(self, side, grid_order, adjusted_spot):
+        """两条腿都以taker成交时的价格, 价差不足以覆盖taker成本时返回None
+        返回: (交割合约taker限价, 现货taker价格)
+        """
+        if not self.taker_enabled:
+            return None
+        future_bbo = self.bbo.get(self.future, None)
+        if future_bbo is None:
+            return None
+        tick = self.min_price_precision
+        if side == "sell":
+            # 现货卖出, 交割合约买入吃卖一
+            edge = adjusted_spot.bid_price / future_bbo.ask_price - grid_order.price
+            future_price = future_bbo.ask_price + self.taker_buffer_ticks * tick
+            spot_price = adjusted_spot.bid_price
+        else:
+            # 现货买入, 交割合约卖出吃买一
+            edge = grid_order.price - adjusted_spot.ask_price / future_bbo.bid_price
+            future_price = future_bbo.bid_price - self.taker_buffer_ticks * tick
+            spot_price = adjusted_spot.ask_price
+        if edge < self.taker_min_edge:
+            return None
+        return (
+            self._round_price(self.future, future_price),
+            self._round_price(self.spot, spot_price),
+        )
+
+    def _exec_taker_pair(self, grid_order, future_price, spot_price):
+        """交割合约与现货两条腿同时以taker下单
+        grid_order: GridOrder - 网格订单信息
+        future_price: float - 交割合约IOC限价
+        spot_price: float - 现货期望成交价格
+        """
+        future_side = "buy" if grid_order.side == "sell" else "sell"
+        spot_side = grid_order.side
+        amount = self.instruments.round_amount(1, self.future, grid_order.amount)
+        if self.flattening:
+            return False
+        if self.strategy.opening_halted and self._increases_position(
+            future_side, amount
+        ):
+            self.trader.tlog(
+                tag="全局风控",
+                msg=f"{self.key} 全局风控停止开仓, 跳过增加持仓的网格订单",
+                interval=10,
+                level="WARN",
+            )
+            return False
+        reject_reason = self.instruments.check_order(
+            1, self.future, future_price, amount
+        ) or self.pre_trade_guard.check(1, self.future, future_side, amount, future_price)
+        if reject_reason is not None:
+            self.trader.tlog(
+                tag="网格订单检查",
+                msg=f"taker开仓不满足下单规则: {reject_reason}",
+                interval=5,
+                level="ERROR",
+            )
+            return False
+        if not self.request_budget.acquire(RequestBudget.PLACE, 1, "place_order"):
+            self.pre_trade_guard.release(
+                1, self.future, future_side, amount, future_price
+            )
+            self.trader.tlog(
+                tag="请求预算",
+                msg=f"{self.key} 请求预算不足, 跳过taker开仓",
+                interval=5,
+                level="WARN",
+            )
+            return False
+        grid_order.maker_price = future_price
+        grid_order.taker_price = spot_price
+        future_cid = self.trader.create_cid(self.cex_configs[1]["exchange"])
+        spot_cid = self.trader.create_cid(self.cex_configs[0]["exchange"])
+        order = Order(
+            future_cid,
+            self.placeFutureSymbol,
+            "Limit",
+            future_side.capitalize(),
+            amount,
+            future_price,
+            "IOC",  # 未成交部分立即撤销
+        )
+        leg_pair = LegPair(
+            future_cid,
+            spot_cid,
+            grid_order,
+            future_side.capitalize(),
+            spot_side.capitalize(),
+            amount,
+            spot_price,
+        )
+        # 先登记再发送, 回调可能在发送返回前到达
+        self.cid_to_grid_pending_order[future_cid] = grid_order
+        self.leg_pairs[future_cid] = leg_pair
+        self.order_delay_stats.add_when_submit(order, "place_order")
+        self.slippage_stats.add_when_place(order, "grid_order", future_price)
+        self.leg_dispatcher.submit(1, self._send_future_leg, leg_pair, order)
+        self.leg_dispatcher.submit(0, self._send_spot_leg, leg_pair)
         return True
 
-    def _market_close_all(self):
-        """平掉所有仓位"""
-        # 由于有对冲机制，当交割合约成交时永续合约会自动对冲，所以这里只需要平掉交割仓位即可
-        symbol = self.placeFutureSymbol  # 使用交割合约符号
-        # 平掉所有仓位
+    def _send_future_leg(self, leg_pair, order):
+        """在账户1的线程中发送交割合约腿, 下单失败时平掉已发出的现货腿"""
+        leg_pair.sent_at[1] = time.time() * 1000
+        res = self.trader.place_order(1, order.to_dict())
+        self._log_leg_gap(leg_pair)
+        if isinstance(res, dict) and "Err" not in res:
+            return
+        self.trader.log(
+            f"taker开仓交割合约下单失败: {res}, 平掉现货腿",
+            level="ERROR",
+        )
+        self.pre_trade_guard.release(
+            1, self.future, order.side, order.amount, order.price
+        )
+        self._unwind_leg_pair(leg_pair)
+
+    def _send_spot_leg(self, leg_pair):
+        """在账户0的线程中发送现货腿, 失败时由exec_hedge重试"""
+        leg_pair.sent_at[0] = time.time() * 1000
+        self.exec_hedge(
+            leg_pair.spot_cid,
+            self.spot,
+            leg_pair.spot_side,
+            leg_pair.amount,
+            leg_pair.spot_price,
+        )
+        self._log_leg_gap(leg_pair)
+
+    def _log_leg_gap(self, leg_pair):
+        """两条腿都已发出时记录两条腿的发送间隔"""
+        if len(leg_pair.sent_at) == 2:
+            self.trader.log(
+                f"taker开仓 {leg_pair.future_cid}/{leg_pair.spot_cid} 两条腿发送间隔: "
+                f"{abs(leg_pair.sent_at[1] - leg_pair.sent_at[0]):.3f} ms",
+                level="INFO",
+            )
+
+    def _unwind_leg_pair(self, leg_pair, filled=0.0, filled_price=None):
+        """交割合约腿未完全成交时反向平掉多出的现货数量
+        已成交的部分按网格成交处理并挂对应的网格单, 只把未成交的数量放回网格挂单
+        filled: float - 交割合约腿已成交的数量
+        filled_price: float - 交割合约腿成交均价
+        """
+        self.leg_pairs.pop(leg_pair.future_cid, None)
+        self.cid_to_grid_pending_order.pop(leg_pair.future_cid, None)
+        residual = leg_pair.amount - filled
+        if residual > 0:
+            self.exec_hedge(
+                self.trader.create_cid(self.cex_configs[0]["exchange"]),
+                self.spot,
+                "Sell" if leg_pair.spot_side == "Buy" else "Buy",
+                residual,
+            )
+        grid_order = leg_pair.grid_order
+        if filled > 0:
+            self.deal_price_stats.add_deal_grid_order(
+                leg_pair.spot_cid, grid_order, filled_price
+            )
+            if not self.strategy.web_force_closing:
+                self._set_opposite_grid_order(grid_order, filled)
+        remaining = self.instruments.round_amount(
+            1, self.future, grid_order.amount - filled
+        )
+        if remaining <= 0:
+            return
+        rearm_order = GridOrder(
+            grid_order.grid_index, grid_order.price, remaining, grid_order.side
+        )
+        self.wait_lock_release("grid_orders_lock")
+        self.grid_orders_lock = True  # 设置锁，防止多线程冲突
+        self._set_grid_order(rearm_order)
+        self.grid_orders_lock = False  # 释放锁
+
+    def _set_opposite_grid_order(self, grid_order, amount):
+        """网格订单成交后在相邻网格挂反方向的网格单
+        grid_order: GridOrder - 成交的网格订单
+        amount: float - 成交数量
+        """
+        on_upper = grid_order.side == "buy"
+        new_grid_order = GridOrder(
+            (grid_order.grid_index + 1 if on_upper else grid_order.grid_index - 1),
+            (
+                grid_order.price + self.grid_interval
+                if on_upper
+                else grid_order.price - self.grid_interval
+            ),
+            amount,
+            "sell" if on_upper else "buy",
+        )
+        self.trader.log(
+            f"网格订单成交，挂对应的网格单: {json.dumps(new_grid_order.to_dict(), indent=2)}",
+            level="INFO",
+        )
+        self.wait_lock_release("grid_orders_lock")
+        self.grid_orders_lock = True  # 设置锁，防止多线程冲突
+        self._set_grid_order(new_grid_order)
+        self.grid_orders_lock = False
+
+    def _increases_position(self, side, amount):
+        """交割合约订单成交后是否会增加持仓"""
         position = self.positions.get(self.future, None)
-        cid = self.trader.create_cid(self.cex_configs[1]["exchange"])
-        if position:
-            # 执行平仓操作
-            if position["amount"] == 0:
-                self.trader.log(
-                    f"没有持仓需要平仓: {json.dumps(position, indent=2)}",
-                    level="INFO",
-                )
-                return
-            if position["side"].lower() == "long":
-                order = {
-                    "cid": cid,
-                    "symbol": symbol,
-                    "order_type": "Limit",
-                    "side": "Sell",
-                    "amount": position["amount"],
-                    "price": np.round(
-                        self.bbo[self.future]["bid_price"] * 0.99, self.price_round_num
-                    ),  # 市价平仓
-                    "time_in_force": "GTC",  # 持续有效
-                }
-                res = self.trader.place_order(1, order)
-                self.trader.log(
-                    f"市价平仓: {json.dumps(order, indent=2)}\
-                        \n平仓结果: {res}",
-                    level="INFO",
-                )
-            elif position["side"].lower() == "short":
-                order = {
-                    "cid": cid,
-                    "symbol": symbol,
-                    "order_type": "Limit",
-                    "side": "Buy",
-                    "amount": position["amount"],
-                    "price": np.round(
-                        self.bbo[self.future]["ask_price"] * 1.01, self.price_round_num
-                    ),  # 市价平仓
-                    "time_in_force": "GTC",  # 持续有效
-                }
-                res = self.trader.place_order(1, order)
-                self.trader.log(
-                    f"市价平仓: {json.dumps(order, indent=2)}\
-                        \n平仓结果: {res}",
-                    level="INFO",
-                )
-            # 清除持仓信息
-            self.positions[symbol] = None
+        current = position.signed_amount if position is not None else 0.0
+        after = current + amount if side == "buy" else current - amount
+        return abs(after) > abs(current)
 
-    def on_order(self, exchange, order):
-        """处理订单数据
-        exchange: str - 交易所名称
+    def on_order(self, order):
+        """处理交割合约订单数据, symbol已转换为内部symbol
         order: dict - 订单数据
         """
-        # 先对symbol进行处理
-        order["symbol"] = self.__process_symbol(order["symbol"])
+        if order["symbol"] == self.future and order["status"].lower() == "open":
+            # 挂单或改单回报
+            self.amend_policy.on_ack(order["cid"])
+
+        # 平仓订单的现货腿已经同时发出, 成交或撤销都不需要处理, 剩余仓位由平仓确认补单
+        if order["cid"] in self.flatten_cids:
+            if order["status"].lower() in ("filled", "canceled"):
+                self.flatten_cids.discard(order["cid"])
+            return
 
-        # 统计延迟
-        stats_cid = self.order_delay_stats._create_stats_cid(order)
-        if order["status"].lower() == "open":
-            if stats_cid in self.order_delay_stats.order_delay_stats["amend_order"]:
-                latency = self.order_delay_stats.add_when_recive(order, "amend_order")
-                if latency is not None:
-                    self.trader.log(
-                        f"改单{stats_cid}延迟: {latency} ms",
-                        level="INFO",
-                    )
-            else:
-                latency = self.order_delay_stats.add_when_recive(order, "place_order")
-                if latency is not None:
-                    self.trader.log(
-                        f"下单{stats_cid}延迟: {latency} ms",
-                        level="INFO",
-                    )
-        elif order["status"].lower() == "canceled":
-            latency = self.order_delay_stats.add_when_recive(order, "cancel_order")
-            if latency is not None:
-                self.trader.log(
-                    f"撤单{stats_cid}延迟: {latency} ms",
-                    level="INFO",
-                )
-
-        # 统计滑点
-        if order["status"].lower() == "filled":
-            cid = order["cid"]
-            slippage_abs, slippage_bps = None, None
-            if cid in self.slippage_stats.order_slippage_stats["grid_order"]:
-                slippage_abs, slippage_bps = self.slippage_stats.add_when_filled(
-                    order, "grid_order"
-                )
-            elif cid in self.slippage_stats.order_slippage_stats["hedge_order"]:
-                slippage_abs, slippage_bps = self.slippage_stats.add_when_filled(
-                    order, "hedge_order"
-                )
-            if slippage_abs is not None:
-                self.trader.log(
-                    f"订单{order['cid']}滑点: {slippage_abs:.6f} ({slippage_bps:.2f} bps)",
-                    level="INFO",
-                )
-
-        # 对冲单成交
-        if order["symbol"] == self.spot and order["status"].lower() == "filled":
-            # 统计网格成交价
-            grid_order_deal_price, grid_order_slippage = (
-                self.deal_price_stats.add_deal_hedge_order(hedge_order=order)
-            )
-            grid_order = self.deal_price_stats.grid_order_stats.get(
-                order["cid"], {}
-            ).get("grid_order", None)
+        # taker开仓的交割合约腿未完全成交, 平掉多出的现货, 已成交部分按网格成交处理
+        if (
+            order["symbol"] == self.future
+            and order["status"].lower() == "canceled"
+            and order["cid"] in self.leg_pairs
+        ):
+            leg_pair = self.leg_pairs[order["cid"]]
+            filled = order.get("filled", 0.0) or 0.0
             self.trader.log(
-                f"对冲订单成交: {json.dumps(order, indent=2)}\
-                    \n-> 对应网格订单: {json.dumps(grid_order, indent=2)}\
-                    \n-> 网格成交价: {grid_order_deal_price}\
-                    \n-> 网格滑点: {grid_order_slippage}",
-                level="INFO",
+                f"taker开仓交割合约腿未完全成交: {filled}/{leg_pair.amount}",
+                level="WARN",
             )
+            self._unwind_leg_pair(
+                leg_pair, filled, order.get("filled_avg_price", None)
+            )
+            return
 
         # 交割合约被取消
         if order["symbol"] == self.future and order["status"].lower() == "canceled":
+            self.amend_policy.on_done(order["cid"], filled=False)
             # 交割合约订单被取消
             self.trader.log(
                 f"交割合约订单被取消: {json.dumps(order, indent=2)}",
@@ -1267,24 +2826,26 @@ class Strategy(BaseStrategy):
             )
             # 将原网格订单添加到网格挂单列表
             grid_order = self.cid_to_grid_pending_order.get(order["cid"], None)
-            if grid_order:
-                if "maker_price" in grid_order:
-                    del grid_order["maker_price"]
-                if "taker_price" in grid_order:
-                    del grid_order["taker_price"]
+            if (
+                grid_order
+                and not self.flattening
+                and not self.strategy.web_force_closing
+            ):
+                grid_order.clear_quotes()
                 self.trader.log(
-                    f"交割合约订单被取消，重新挂单: {json.dumps(grid_order, indent=2)}",
+                    f"交割合约订单被取消，重新挂单: {json.dumps(grid_order.to_dict(), indent=2)}",
                     level="INFO",
                 )
                 self.wait_lock_release("grid_orders_lock")
                 self.grid_orders_lock = True  # 设置锁，防止多线程冲突
-                self.grid_orders[grid_order["grid_index"]] = grid_order
+                self._set_grid_order(grid_order)
                 self.grid_orders_lock = False  # 释放锁
             # 删除order
             self._remove_pending_order(order["cid"])
 
         # 一旦交割合约成交，使用永续/现货市价对冲
         if order["symbol"] == self.future and order["status"].lower() == "filled":
+            self.amend_policy.on_done(order["cid"], filled=True)
             self.trader.log(
                 f"交割合约订单成交: {json.dumps(order, indent=2)} \
                     \n-> 对应网格订单: {self.cid_to_grid_pending_order.get(order['cid'], None)}",
@@ -1293,48 +2854,58 @@ class Strategy(BaseStrategy):
             side = "Buy" if order["side"] == "Sell" else "Sell"
             amount = order["filled"]
             # 网格订单成交，处理
-            grid_order = self.cid_to_grid_pending_order.get(order["cid"], None)
+            grid_order = (
+                self._pending_grid_order(order["cid"])
+                if order["cid"] in self.cid_to_grid_pending_order
+                else None
+            )
+            leg_pair = self.leg_pairs.pop(order["cid"], None)
             # 统计成交价格
-            hedge_order_cid = self.trader.create_cid(self.cex_configs[0]["exchange"])
+            hedge_order_cid = (
+                leg_pair.spot_cid
+                if leg_pair is not None
+                else self.trader.create_cid(self.cex_configs[0]["exchange"])
+            )
             self.deal_price_stats.add_deal_grid_order(
                 hedge_order_cid,
                 grid_order,
                 order["filled_avg_price"],
             )
-            # 使用taker价格对冲
-            if grid_order is not None and "taker_price" in grid_order:
-                self.exec_hedge(
-                    hedge_order_cid, self.spot, side, amount, grid_order["taker_price"]
-                )
-            else:
-                self.exec_hedge(hedge_order_cid, self.spot, side, amount)
-            if grid_order:
-                # 重新挂网格
-                new_grid_order = {}
-                on_upper = grid_order["side"] == "buy"
-                new_grid_order["price"] = (
-                    grid_order["price"] + self.grid_interval
-                    if on_upper
-                    else grid_order["price"] - self.grid_interval
-                )
-                new_grid_order["amount"] = grid_order["amount"]
-                new_grid_order["side"] = "sell" if on_upper else "buy"
-                new_grid_order["grid_index"] = (
-                    grid_order["grid_index"] + 1
-                    if on_upper
-                    else grid_order["grid_index"] - 1
-                )
-                self.trader.log(
-                    f"网格订单成交，挂对应的网格单: {json.dumps(new_grid_order, indent=2)}",
-                    level="INFO",
-                )
-                self.wait_lock_release("grid_orders_lock")
-                self.grid_orders_lock = True  # 设置锁，防止多线程冲突
-                self.grid_orders[new_grid_order["grid_index"]] = new_grid_order
-                self.grid_orders_lock = False
+            # 使用taker价格对冲, taker开仓的现货腿已经同时发出
+            if leg_pair is None:
+                if grid_order is not None and grid_order.taker_price is not None:
+                    self.exec_hedge(
+                        hedge_order_cid, self.spot, side, amount, grid_order.taker_price
+                    )
+                else:
+                    self.exec_hedge(hedge_order_cid, self.spot, side, amount)
+            if grid_order and not self.strategy.web_force_closing:
+                # 重新挂网格, 平台强平期间只对冲不再挂网格
+                self._set_opposite_grid_order(grid_order, grid_order.amount)
             # 删除order
             self._remove_pending_order(order["cid"])
 
+    def on_order_amended(self, result, order):
+        """改单请求回报, 改单失败时恢复本地订单价格, 下一个tick重新判断是否改单
+        result: dict - 改单结果
+        order: dict - 改单时传入的订单信息
+        """
+        last_price = self.amend_policy.on_ack(order["cid"])
+        if not isinstance(result, dict) or "Err" not in result:
+            return
+        self.trader.tlog(
+            tag="改单失败",
+            msg=f"订单 {order['cid']} 改单失败: {result['Err']}",
+            interval=1,
+            level="WARN",
+        )
+        pending_order = self.pending_orders.get(order["cid"], None)
+        grid_order = self.cid_to_grid_pending_order.get(order["cid"], None)
+        if pending_order is not None and last_price is not None:
+            pending_order.price = last_price
+            if grid_order is not None:
+                self.amend_deferred.add(grid_order.side)
+
     def exec_hedge(self, cid, symbol, side, amount, price=None):
         """执行对冲操作, 市价对冲
         cid: str - 客户端订单ID
@@ -1343,59 +2914,1479 @@ class Strategy(BaseStrategy):
         amount: float - 数量
         price: float - 价格
         """
+        # 加上之前累计的对冲数量, 取整后的余数继续累计, 对冲数量不会丢失
+        self.wait_lock_release("hedge_residual_lock")
+        self.hedge_residual_lock = True  # 设置锁，防止多线程冲突
+        net_amount = (
+            amount if side.lower() == "buy" else -amount
+        ) + self.hedge_residual
+        if (net_amount > 0) != (side.lower() == "buy"):
+            price = None  # 累计的反向数量超过本次对冲, 期望价格不再适用
+        side = "buy" if net_amount > 0 else "sell"
+        amount = self.instruments.round_amount(0, symbol, abs(net_amount))
+
+        vwap, worst_price = self._executable_price(symbol, side, amount)
         if price is None:
-            place_price = (
-                np.round(
-                    (self.bbo[symbol]["bid_price"] * (1 - 0.002)), self.price_round_num
-                )  # 这里使用限价加上0.2%的滑点忍受，2是因为ETH的交割与永续的最小报价单位是0.01
-                if side.lower() == "sell"
-                else np.round(
-                    (self.bbo[symbol]["ask_price"] * (1 + 0.002)), self.price_round_num
+            price = vwap
+        expected_price = price
+
+        # 限价取0.2%的滑点容忍价格，有深度时收紧到吃掉对冲数量所需的最差档位外几档
+        if side.lower() == "sell":
+            place_price = price * (1 - self.hedge_slippage_tolerance)
+            if worst_price is not None:
+                place_price = max(
+                    place_price,
+                    worst_price
+                    - self.hedge_buffer_ticks * self.instruments.price_tick(0, symbol),
                 )
-            )
-            expected_price = (
-                self.bbo[symbol]["bid_price"]
-                if side.lower() == "sell"
-                else self.bbo[symbol]["ask_price"]
-            )
         else:
-            place_price = (
-                np.round(
-                    (price * (1 - 0.002)), self.price_round_num
-                )  # 这里使用限价加上0.2%的滑点忍受，2是因为ETH的交割与永续的最小报价单位是0.01
-                if side.lower() == "sell"
-                else np.round(price * (1 + 0.002), self.price_round_num)
+            place_price = price * (1 + self.hedge_slippage_tolerance)
+            if worst_price is not None:
+                place_price = min(
+                    place_price,
+                    worst_price
+                    + self.hedge_buffer_ticks * self.instruments.price_tick(0, symbol),
+                )
+        place_price = self._round_price(symbol, place_price)
+        reject_reason = (
+            self.instruments.check_order(0, symbol, place_price, amount)
+            if amount > 0
+            else f"数量 {abs(net_amount)} 不足一个下单精度"
+        )
+        if reject_reason is not None:
+            self.hedge_residual = net_amount
+            self.hedge_residual_lock = False  # 释放锁
+            self.trader.log(
+                f"{self.key} 对冲订单不满足下单规则: {reject_reason}, "
+                f"累计到下一次对冲, 当前未对冲数量 {net_amount}",
+                level="WARN",
+            )
+            return
+        self.hedge_residual = net_amount - (amount if side == "buy" else -amount)
+        self.hedge_residual_lock = False  # 释放锁
+        guard_reason = self.pre_trade_guard.check(0, symbol, side, amount, place_price)
+        if guard_reason is not None:
+            # 对冲不能放弃, 裸头寸比被拒单的代价更大, 仍然发送并告警
+            self.trader.log(
+                f"对冲订单可能被交易所拒绝: {guard_reason}",
+                level="ERROR",
             )
-            expected_price = price
 
         # cid = self.trader.create_cid(self.cex_configs[0]["exchange"])
-        order = {
-            "cid": cid,
-            "symbol": symbol,
-            "order_type": "Limit",  # 市价对冲使用限价单
-            "side": side.capitalize(),
-            "amount": amount,
-            "price": place_price,
-            "time_in_force": "GTC",  # 即时成交剩余撤销
-        }
+        order = Order(
+            cid,
+            symbol,
+            "Limit",  # 市价对冲使用限价单
+            side.capitalize(),
+            amount,
+            place_price,
+            "GTC",  # 即时成交剩余撤销
+        )
         # 统计订单延迟
         self.order_delay_stats.add_when_submit(order, "place_order")
         # 统计滑点 - 记录期望价格
         self.slippage_stats.add_when_place(order, "hedge_order", expected_price)
         # 执行对冲操作
+        order = order.to_dict()
         self.trader.log(
             f"执行市价对冲操作: {json.dumps(order, indent=2)}",
             level="INFO",
         )
         # 对冲使用同步，如果是异步可能会导致对冲订单未完成就开始下一步操作
-        order_result = self.trader.place_order(0, order)
+        order_result = self.request_budget.request(
+            RequestBudget.HEDGE, 0, "place_order", order
+        )
         while "Ok" not in order_result:
             self.trader.log(
                 f"对冲订单下单失败: {order_result}, 重试中...",
                 level="ERROR",
             )
             time.sleep(0.01)  # 等待0.01秒后重试
-            order_result = self.trader.place_order(0, order)
+            order_result = self.request_budget.request(
+                RequestBudget.HEDGE, 0, "place_order", order
+            )
+        if self.replayed_hedges is not None:
+            self.replayed_hedges.append((cid, amount if side == "buy" else -amount))
+        if guard_reason is not None:
+            # 本地缓存与交易所不一致, 重新获取
+            self.strategy.refresh_pre_trade_guard(0)
+
+
+class ExpiryGroup:
+    """同一现货对多个交割合约的价差引擎
+
+    每个交割合约仍由一个GridPair管理挂单、撤单与对冲, 但各交割合约的均线、网格基准价格以及
+    最新买卖价保存在按交割合约排列的紧凑数组中。现货更新时一次向量化计算所有交割合约的调整后价差,
+    批量更新均线与各方向相对长期均线的价差优势, 再依次交给各GridPair做挂单与开仓检查。
+    开仓时每个方向只有价差优势最大的交割合约可以执行, 网格触发会路由到价差最优的交割合约。
+    """
+
+    def __init__(self, strategy, spot, grid_pairs):
+        self.trader = strategy.trader
+        self.bbo = strategy.bbo
+        self.spot = spot
+        self.grid_pairs = grid_pairs
+        n = len(grid_pairs)
+
+        # 均线与网格基准价格, 未初始化为nan
+        self.short_ewm = np.full(n, np.nan)
+        self.long_ewm = np.full(n, np.nan)
+        self.base_price = np.full(n, np.nan)
+
+        # 交割合约的最新买卖价
+        self.future_ask = np.full(n, np.nan)
+        self.future_bid = np.full(n, np.nan)
+        self.future_timestamp = np.zeros(n)
+
+        # 各方向相对长期均线的价差优势, 越大越优
+        self.buy_edge = np.full(n, -np.inf)
+        self.sell_edge = np.full(n, -np.inf)
+
+        # 参数
+        self.short_span = np.array([p.short_span for p in grid_pairs], dtype=float)
+        self.long_span = np.array([p.long_span for p in grid_pairs], dtype=float)
+        self.abnormal_threshold = np.array(
+            [p.abnormal_threshold for p in grid_pairs], dtype=float
+        )
+        self.maker_price_offset = np.array(
+            [p.maker_price_offset for p in grid_pairs], dtype=float
+        )
+        self.time_tolerance = grid_pairs[0].time_tolerance
+        self.trade_amounts = np.array([p.trade_amount for p in grid_pairs], dtype=float)
+        self.min_price_precision = np.zeros(n)
+        self.refresh_params()
+
+        for idx, grid_pair in enumerate(grid_pairs):
+            short_ewm, long_ewm = grid_pair.short_ewm, grid_pair.long_ewm
+            base_price = grid_pair.base_price
+            grid_pair.group = self
+            grid_pair.group_index = idx
+            grid_pair.short_ewm = short_ewm
+            grid_pair.long_ewm = long_ewm
+            grid_pair.base_price = base_price
+
+    def refresh_params(self):
+        """交易对信息变化后更新价格精度"""
+        for idx, grid_pair in enumerate(self.grid_pairs):
+            self.min_price_precision[idx] = grid_pair.min_price_precision
+
+    def update_future(self, idx, bbo):
+        """交割合约bbo更新"""
+        self.future_ask[idx] = bbo.ask_price
+        self.future_bid[idx] = bbo.bid_price
+        self.future_timestamp[idx] = bbo.timestamp
+
+    def update_edges(self, idx, adjusted_buy_price, adjusted_sell_price):
+        """单个交割合约更新时更新其价差优势"""
+        long_ewm = self.long_ewm[idx]
+        if np.isnan(long_ewm):
+            self.buy_edge[idx] = -np.inf
+            self.sell_edge[idx] = -np.inf
+            return
+        self.buy_edge[idx] = (long_ewm - adjusted_buy_price) / long_ewm
+        self.sell_edge[idx] = (adjusted_sell_price - long_ewm) / long_ewm
+
+    def is_best(self, idx, side):
+        """该交割合约在指定方向上是否价差最优"""
+        edges = self.buy_edge if side == "buy" else self.sell_edge
+        return edges[idx] >= edges.max()
+
+    def on_spot_tick(self):
+        """现货bbo更新时一次处理所有交割合约"""
+        spot_bbo = self.bbo[self.spot]
+        if spot_bbo is None:
+            return
+        valid = ~np.isnan(self.future_ask) & (
+            np.abs(self.future_timestamp - spot_bbo.timestamp)
+            <= self.time_tolerance * 1000
+        )
+        if not valid.all():
+            self.trader.tlog(
+                tag="等待BBO数据接收",
+                msg=f"{self.spot} 交割合约BBO数据不完整或超过时间容忍度: \
+                    {[p.future for p, ok in zip(self.grid_pairs, valid) if not ok]}",
+                interval=2,
+                level="WARN",
+            )
+            if not valid.any():
+                return
+
+        # 现货按交易数量的实际可成交均价计算, 相同数量只计算一次
+        spot_ask = spot_bbo.ask_price
+        spot_bid = spot_bbo.bid_price
+        spot_exec_ask = np.empty(len(self.grid_pairs))
+        spot_exec_bid = np.empty(len(self.grid_pairs))
+        for trade_amount in np.unique(self.trade_amounts):
+            mask = self.trade_amounts == trade_amount
+            grid_pair = self.grid_pairs[int(np.argmax(mask))]
+            spot_exec_ask[mask], _ = grid_pair._executable_price(
+                self.spot, "buy", float(trade_amount)
+            )
+            spot_exec_bid[mask], _ = grid_pair._executable_price(
+                self.spot, "sell", float(trade_amount)
+            )
+
+        # 所有交割合约的调整后买卖价与价差
+        future_ask, future_bid = self.future_ask, self.future_bid
+        offset = self.maker_price_offset
+        adjusted_future_ask = np.where(
+            future_ask - offset > spot_bid,
+            future_ask - offset,
+            future_bid + self.min_price_precision,
+        )
+        adjusted_future_bid = np.where(
+            future_bid + offset < spot_ask,
+            future_bid + offset,
+            future_ask - self.min_price_precision,
+        )
+        middle_price = (spot_ask / future_ask + spot_bid / future_bid) / 2
+        adjusted_buy_price = spot_exec_ask / adjusted_future_ask
+        adjusted_sell_price = spot_exec_bid / adjusted_future_bid
+
+        # 批量更新均线: 已初始化、预热结果已校验且数据正常的交割合约
+        warm_started = np.fromiter(
+            (p.warm_started for p in self.grid_pairs), dtype=bool, count=len(valid)
+        )
+        short_ewm = self.short_ewm
+        with np.errstate(invalid="ignore"):
+            normal = (
+                np.abs(middle_price - short_ewm) <= self.abnormal_threshold * short_ewm
+            )
+        ewm_updated = valid & ~warm_started & normal
+        self.short_ewm[ewm_updated] = (
+            (self.short_span - 1) * short_ewm + middle_price
+        )[ewm_updated] / self.short_span[ewm_updated]
+        self.long_ewm[ewm_updated] = (
+            (self.long_span - 1) * self.long_ewm + middle_price
+        )[ewm_updated] / self.long_span[ewm_updated]
+
+        # 各方向的价差优势
+        long_ewm = self.long_ewm
+        has_ewm = valid & ~np.isnan(long_ewm)
+        with np.errstate(invalid="ignore"):
+            self.buy_edge = np.where(
+                has_ewm, (long_ewm - adjusted_buy_price) / long_ewm, -np.inf
+            )
+            self.sell_edge = np.where(
+                has_ewm, (adjusted_sell_price - long_ewm) / long_ewm, -np.inf
+            )
+
+        # 依次交给各交割合约做挂单与开仓检查
+        spot_exec_ask = spot_exec_ask.tolist()
+        spot_exec_bid = spot_exec_bid.tolist()
+        adjusted_future_ask = adjusted_future_ask.tolist()
+        adjusted_future_bid = adjusted_future_bid.tolist()
+        middle_price = middle_price.tolist()
+        adjusted_buy_price = adjusted_buy_price.tolist()
+        adjusted_sell_price = adjusted_sell_price.tolist()
+        ewm_updated = ewm_updated.tolist()
+        future_timestamp = self.future_timestamp.tolist()
+        for idx in np.flatnonzero(valid).tolist():
+            grid_pair = self.grid_pairs[idx]
+            grid_pair._on_prices(
+                Bbo(self.spot, spot_exec_ask[idx], spot_exec_bid[idx]),
+                Bbo(
+                    grid_pair.future,
+                    adjusted_future_ask[idx],
+                    adjusted_future_bid[idx],
+                    future_timestamp[idx],
+                ),
+                middle_price[idx],
+                adjusted_buy_price[idx],
+                adjusted_sell_price[idx],
+                ewm_updated=ewm_updated[idx],
+            )
+
+
+# 类名必须为Strategy
+class Strategy(BaseStrategy):
+    def __init__(self, cex_configs, dex_configs, config, trader: Trader):
+        self.cex_configs = cex_configs  # 中心化交易所配置
+        self.dex_configs = dex_configs  # 去中心化交易所配置
+        self.config = config  # 策略配置
+        self.trader = trader  # 交易执行器
+        self.stop_flag = False  # 停止标志
+
+        # has_account: bool = False  # 是否有账户信息
+        self.has_account = True  # 是否有账户信息
+
+        # 交易对列表, 使用[[pairs]]配置多个现货/交割合约对, 兼容单个[pairs]配置
+        pair_configs = self.config.get("pairs", [])
+        if isinstance(pair_configs, dict):
+            pair_configs = [pair_configs]
+
+        # 多进程分片部署, 只处理分到当前分片的交易对, 风控数据写入共享内存汇总
+        self.shard_config = self.config.get("shard_config", {})
+        self.shard_enabled = self.shard_config.get("enabled", False)
+        self.shard_slot = 0  # 当前分片编号
+        if self.shard_enabled:
+            self.shard_slot = int(
+                os.environ.get(SHARD_SLOT_ENV, self.shard_config.get("slot", 0))
+            )
+            pair_configs = partition_pairs(
+                pair_configs, self.shard_config.get("shards", 1)
+            )[self.shard_slot]
+        self.risk_board = None  # 监督进程创建的RiskBoard
+        self.risk_publish_interval = self.shard_config.get(
+            "publish_interval", 1
+        )  # 写入风控数据的间隔，单位为秒
+        self.report_slot = self.shard_config.get(
+            "report_slot", 0
+        )  # 负责上报全局持仓价值的分片
+        self.risk_halted = False  # 全局风控是否停止开仓
+
+        # 二进制日志, 记录所有回调与交易请求(含结果), 用于事后分析与回放
+        self.journal_config = self.config.get("journal_config", {})
+        self.journal = None
+        if self.journal_config.get("enabled", False):
+            self.journal = Journal(
+                self.journal_config.get("path", "journal/strategy_{slot}.bin").format(
+                    slot=self.shard_slot
+                ),
+                flush_interval=self.journal_config.get("flush_interval", 0.2),
+                max_pending=self.journal_config.get("max_pending", 1_000_000),
+            )
+            self.journal.record_config(cex_configs, dex_configs, config)
+            self.trader = JournalTrader(trader, self.journal)
+
+        # 平台控制指令, 由定时器刷新, 开仓检查与对冲只读取属性, 不在行情回调中查询
+        self.control_config = self.config.get("control_config", {})
+        self.control_enabled = self.control_config.get("enabled", False)
+        self.control_refresh_interval = self.control_config.get(
+            "refresh_interval", 1
+        )  # 刷新平台控制指令的间隔，单位为秒
+        self.web_soft_stopped = False  # 平台缓停
+        self.web_opening_stopped = False  # 平台停止开仓
+        self.web_force_closing = False  # 平台强平
+        self.opening_halted = False  # 是否停止开仓, 全局风控或平台指令任意一个生效
+
+        pair_configs = self._expand_pair_configs(pair_configs)
+        if not pair_configs:
+            raise ValueError("策略配置中未指定交易对，请检查配置文件。")
+
+        # 交易对信息缓存, symbol映射与下单精度
+        self.instruments = InstrumentCache(
+            default_price_tick=self.config.get("min_price_precision", 0.01)
+        )
+        for pair_config in pair_configs:
+            spot = pair_config.get("spot", "")
+            self.instruments.register(0, spot, spot)
+            self.instruments.register(1, pair_config.get("future", ""))
+        self.instrument_refresh_interval = self.config.get(
+            "instrument_config", {}
+        ).get(
+            "refresh_interval", 0
+        )  # 定时刷新交易对信息的间隔，单位为秒，0表示不刷新
+
+        # 所有交易对使用到的symbol, 去重后共享订阅
+        self.spots = list(dict.fromkeys(c.get("spot", "") for c in pair_configs))
+        self.futures = list(dict.fromkeys(c.get("future", "") for c in pair_configs))
+        if len(self.futures) != len(pair_configs):
+            raise ValueError("同一个交割合约只能配置在一个交易对中，请检查配置文件。")
+        self.symbols = self.spots + self.futures
+
+        # 记录最新的市场数据, 所有交易对共享
+        self.bbo = {symbol: None for symbol in self.symbols}
+
+        # 从共享内存BboBoard读取行情, 代替每个进程单独订阅BBO
+        self.bbo_board_config = self.config.get("bbo_board", {})
+        self.use_bbo_board = self.bbo_board_config.get("enabled", False)
+        self.bbo_board = None  # 行情进程创建的BboBoard
+        # 读取行情板的间隔，单位为秒。行情板没有通知机制, 间隔就是行情进入策略的最大额外延迟,
+        # 取亚毫秒级; 代价是更频繁的定时器唤醒, 没有更新时一次读取只比较各symbol的序号
+        self.bbo_board_poll_interval = self.bbo_board_config.get("poll_interval", 0.0005)
+        self.bbo_board_timeout = self.bbo_board_config.get(
+            "heartbeat_timeout", 5
+        )  # 行情进程心跳超时，单位为秒
+        self.bbo_board_seqs = {symbol: 0 for symbol in self.symbols}  # 已处理的序号
+
+        # 设置杠杆
+        self.leverage = self.config.get("leverage", 3)  # 杠杆倍数
+
+        # sync
+        self.sync = self.config.get("sync", False)  # 是否同步执行
+
+        # 仓位管理
+        self.positions = {}  # 当前持仓信息
+
+        # 本地订单簿, 使用现货深度计算对冲数量的实际可成交价格
+        self.depth_config = self.config.get("depth_config", {})
+        self.use_depth = self.depth_config.get("enabled", False)  # 是否使用深度
+        self.depth_incremental = self.depth_config.get(
+            "incremental", False
+        )  # 深度推送是否为增量
+        self.order_books = {
+            spot: LocalOrderBook(spot, self.depth_config.get("max_levels", 200))
+            for spot in self.spots
+        }  # <symbol, LocalOrderBook>
+
+        # 使用历史K线预热均线, 避免重启后长期均线从单个价格开始
+        self.warmup_enabled = self.config.get("warmup_config", {}).get(
+            "enabled", False
+        )
+
+        # 状态快照, 用于重启后快速恢复
+        self.snapshot_config = self.config.get("snapshot_config", {})
+        self.snapshot_enabled = self.snapshot_config.get("enabled", False)
+        self.snapshot_interval = self.snapshot_config.get(
+            "interval", 5
+        )  # 快照间隔，单位为秒
+        self.snapshot_max_age = self.snapshot_config.get(
+            "max_age", 60
+        )  # 快照中的均线在多少秒内有效，单位为秒
+        self.snapshotter = StateSnapshotter(self.trader)
+        self.reconcile_pending = set()  # 恢复快照后需要与交易所核对订单与持仓的现货
+
+        # 交易所请求预算, 所有下单、改单、撤单请求按优先级限流
+        self.request_budget_config = self.config.get("request_budget", {})
+        self.request_budget = RequestBudget(self.trader, self.request_budget_config)
+        self.request_budget_report_interval = self.request_budget_config.get(
+            "report_interval", 10
+        )  # 输出剩余预算的间隔，单位为秒
+
+        self.amend_report_interval = self.config.get("amend_config", {}).get(
+            "report_interval", 60
+        )  # 输出改单统计的间隔，单位为秒
+
+        # 下单前本地检查保证金与最大可持仓
+        self.pre_trade_config = self.config.get("pre_trade_config", {})
+        self.pre_trade_guard = PreTradeGuard(
+            self.trader, self.pre_trade_config, self.positions, self.leverage
+        )
+        self.pre_trade_refresh_interval = self.pre_trade_config.get(
+            "refresh_interval", 30
+        )  # 刷新余额与最大可持仓的间隔，单位为秒
+
+        # 平仓: 两个账户同时撤单与批量平仓, 后台在期限内确认仓位归零
+        flatten_config = self.config.get("flatten_config", {})
+        self.flatten_slippage = flatten_config.get("slippage", 0.01)  # 平仓限价穿价幅度
+        self.flatten_deadline = flatten_config.get(
+            "deadline", 3
+        )  # 确认仓位归零的期限，单位为秒
+        self.flatten_poll_interval = flatten_config.get(
+            "poll_interval", 0.2
+        )  # 查询持仓的间隔，单位为秒
+        self.flatten_resend_interval = flatten_config.get(
+            "resend_interval", 0.5
+        )  # 仍有剩余敞口时补单的最小间隔，单位为秒
+
+        # 双账户并行下单, taker开仓时两条腿同时发出
+        self.leg_dispatcher = LegDispatcher(
+            self.config.get("taker_config", {}).get("workers_per_account", 1)
+        )
+
+        # 对延迟进行统计，下单，撤单，取消订单延迟
+        self.order_delay_stats = LatencyStats(
+            output_file=f"./stats/{int(time.time()*1000)}_order_delay.csv"
+        )  # 延迟统计对象
+
+        # 对滑点进行统计
+        self.slippage_stats = SlippageStats(
+            output_file=f"./stats/{int(time.time()*1000)}_slippage.csv"
+        )  # 滑点统计对象
+
+        # 对网格成交价格进行统计
+        self.deal_price_stats = dealPriceStats(
+            output_file=f"./stats/{int(time.time()*1000)}_deal_price.csv"
+        )  # 成交价格统计对象
+
+        # 每个交易对的网格状态, 以及symbol到交易对的路由表
+        self.grid_pairs = [GridPair(self, pair_config) for pair_config in pair_configs]
+        self.pairs_by_symbol = {}  # <symbol, [GridPair]>, bbo更新时需要处理的交易对
+        self.pairs_by_spot = {}  # <现货symbol, [GridPair]>
+        self.pairs_by_future = {}  # <交割合约symbol, GridPair>
+        for grid_pair in self.grid_pairs:
+            self.pairs_by_symbol.setdefault(grid_pair.spot, []).append(grid_pair)
+            self.pairs_by_symbol.setdefault(grid_pair.future, []).append(grid_pair)
+            self.pairs_by_spot.setdefault(grid_pair.spot, []).append(grid_pair)
+            self.pairs_by_future[grid_pair.future] = grid_pair
+
+        # 一个现货对多个交割合约的交易对组成ExpiryGroup, 现货更新时一次处理
+        grouped_pairs = {}  # <现货symbol, [GridPair]>
+        for grid_pair, pair_config in zip(self.grid_pairs, pair_configs):
+            if pair_config.get("expiry_group", False):
+                grouped_pairs.setdefault(grid_pair.spot, []).append(grid_pair)
+        self.groups_by_spot = {
+            spot: ExpiryGroup(self, spot, grid_pairs)
+            for spot, grid_pairs in grouped_pairs.items()
+        }  # <现货symbol, ExpiryGroup>
+
+        # 回调经过日志后再进入策略
+        if self.journal is not None:
+            self.journal.attach(self)
+
+    def _expand_pair_configs(self, pair_configs):
+        """展开一个现货对多个交割合约的配置
+        futures为交割合约列表, 或"auto"表示交易所上该现货对应的所有交割合约
+        """
+        expanded = []
+        for pair_config in pair_configs:
+            futures = pair_config.get("futures", None)
+            if futures is None:
+                expanded.append(pair_config)
+                continue
+            if futures == "auto":
+                futures = self._discover_futures(pair_config.get("spot", ""))
+            for future in futures:
+                expanded_config = {
+                    key: value for key, value in pair_config.items() if key != "futures"
+                }
+                expanded_config["future"] = future
+                expanded_config["expiry_group"] = True
+                expanded.append(expanded_config)
+        return expanded
+
+    def _discover_futures(self, spot):
+        """查询账户1上该现货对应的所有交割合约, 按到期日排序"""
+        result = self.trader.get_instruments(1)
+        if result is None or "Err" in result:
+            self.trader.log(
+                f"查询{spot}的交割合约失败: {result}",
+                level="ERROR",
+            )
+            return []
+        futures = set()
+        for instrument in result.get("Ok", None) or []:
+            symbol = InstrumentCache.translate_to_internal(instrument.get("symbol", ""))
+            head, _, tail = symbol.rpartition("_")
+            if head == spot and len(tail) == 6 and tail.isdigit():
+                futures.add(symbol)
+        futures = sorted(futures, key=lambda symbol: symbol[-6:])
+        self.trader.log(f"{spot} 的交割合约: {futures}", level="INFO")
+        return futures
+
+    def name(self):
+        """返回策略名称"""
+        return "期限价差套利策略"
+
+    def subscribes(self):
+        subs = []
+        if self.use_bbo_board:
+            # BBO由行情进程写入共享内存, 定时读取
+            subs.append(self._timer_sub("bbo_board", self.bbo_board_poll_interval))
+        else:
+            subs.append(
+                {
+                    "account_id": 0,
+                    "sub": {
+                        "SubscribeWs": [
+                            {"Bbo": self.symbols},  # 订阅最优买卖价
+                        ]
+                    },
+                }
+            )
+        if self.use_depth:
+            subs.append(
+                {
+                    "account_id": 0,
+                    "sub": {
+                        "SubscribeWs": [
+                            {"Depth": list(self.order_books.keys())},  # 订阅深度
+                        ]
+                    },
+                }
+            )
+        if self.snapshot_enabled:
+            subs.append(self._timer_sub("state_snapshot", self.snapshot_interval))
+        if self.shard_enabled:
+            subs.append(self._timer_sub("risk_board", self.risk_publish_interval))
+        if self.control_enabled and self.control_refresh_interval:
+            subs.append(
+                self._timer_sub("control_flags", self.control_refresh_interval)
+            )
+        if self.amend_report_interval:
+            subs.append(self._timer_sub("amend_stats", self.amend_report_interval))
+        if self.pre_trade_guard.enabled and self.pre_trade_refresh_interval:
+            subs.append(
+                self._timer_sub("pre_trade_guard", self.pre_trade_refresh_interval)
+            )
+        if self.request_budget.enabled and self.request_budget_report_interval:
+            subs.append(
+                self._timer_sub("request_budget", self.request_budget_report_interval)
+            )
+        if self.instrument_refresh_interval:
+            for account_id in (0, 1):
+                subs.append(
+                    {
+                        "account_id": account_id,
+                        "sub": {
+                            "SubscribeRest": {
+                                "update_interval": {
+                                    "secs": int(self.instrument_refresh_interval),
+                                    "nanos": 0,
+                                },
+                                "rest_type": "Instrument",
+                            }
+                        },
+                    }
+                )
+        if self.has_account:
+            place_future_symbols = [
+                grid_pair.placeFutureSymbol for grid_pair in self.grid_pairs
+            ]
+            subs.append(
+                {
+                    "account_id": 0,
+                    "sub": {
+                        "SubscribeWs": [
+                            {"Order": self.spots},  # 订阅订单信息
+                            {"Position": self.spots},  # 订阅持仓信息
+                        ]
+                    },
+                }
+            )
+            subs.append(
+                {
+                    "account_id": 1,
+                    "sub": {
+                        "SubscribeWs": [
+                            {"Order": place_future_symbols},  # 订阅订单信息
+                            {"Position": place_future_symbols},  # 订阅持仓信息
+                        ]
+                    },
+                }
+            )
+
+        return subs
+
+    @staticmethod
+    def _timer_sub(name, interval):
+        """定时器订阅, 定时执行on_timer_subscribe回调
+        name: str - 定时器名称
+        interval: float - 间隔，单位为秒
+        """
+        return {
+            "sub": {
+                "SubscribeTimer": {
+                    "name": name,
+                    "update_interval": {
+                        "secs": int(interval),
+                        "nanos": int((interval - int(interval)) * 1e9),
+                    },
+                }
+            },
+        }
+
+    def start(self):
+        """策略启动函数"""
+        # 设置杠杆
+        # for symbol in self.symbols:
+        #     self.trader.set_leverage(symbol, self.leverage)
+        self._load_instruments()
+        if self.shard_enabled:
+            self._attach_risk_board()
+        if self.use_bbo_board:
+            self._attach_bbo_board()
+        if self.pre_trade_guard.enabled:
+            for account_id in (0, 1):
+                self.refresh_pre_trade_guard(account_id)
+        if self.control_enabled:
+            self._refresh_control_flags()
+        ewm_restored = {}
+        if self.snapshot_enabled:
+            ewm_restored = self._restore_state()
+        if self.warmup_enabled:
+            for grid_pair in self.grid_pairs:
+                if not ewm_restored.get(grid_pair.key, False):
+                    grid_pair._warm_start_ewm(init_grid=grid_pair.grid_levels is None)
+
+    def _load_instruments(self):
+        """加载两个账户的交易对信息, 更新symbol映射与下单精度"""
+        for account_id in (0, 1):
+            result = self.trader.get_instruments(account_id)
+            if result is None or "Err" in result:
+                self.trader.log(
+                    f"账户{account_id}获取交易对信息失败: {result}, 使用默认规则",
+                    level="ERROR",
+                )
+                continue
+            self.instruments.update(account_id, result.get("Ok", None))
+        self._apply_instrument_rules()
+
+    def _apply_instrument_rules(self):
+        """交易对信息变化后更新各交易对的交割合约符号与价格精度"""
+        for group in getattr(self, "groups_by_spot", {}).values():
+            group.refresh_params()
+        for grid_pair in self.grid_pairs:
+            grid_pair.apply_instrument_rules()
+            self.trader.log(
+                f"交易对信息: 现货 {grid_pair.spot} {self.instruments.rule(0, grid_pair.spot)}\
+                    \n交割合约 {grid_pair.future}({grid_pair.placeFutureSymbol}) {self.instruments.rule(1, grid_pair.future)}",
+                level="INFO",
+            )
+
+    def refresh_pre_trade_guard(self, account_id):
+        """刷新账户的可用余额与最大可持仓缓存"""
+        if not self.pre_trade_guard.enabled:
+            return
+        if account_id == 0:
+            symbols = {spot: spot for spot in self.spots}
+        else:
+            symbols = {
+                grid_pair.future: grid_pair.placeFutureSymbol
+                for grid_pair in self.grid_pairs
+            }
+        self.pre_trade_guard.refresh(account_id, symbols)
+
+    def on_balance(self, account_id, balances):
+        """余额推送, 更新下单前检查使用的可用余额
+        account_id: int - 账户ID, 部分版本传入交易所名称
+        balances: list - 余额数据
+        """
+        if isinstance(account_id, str):
+            account_id = self._account_id(account_id)
+        if account_id is None:
+            return
+        self.pre_trade_guard.on_balance(account_id, balances)
+
+    def on_ws_connected(self, exchange, account_id):
+        """websocket连接或重连, 交割合约账户补处理断开期间丢失的订单推送
+        exchange: str - 交易所名称
+        account_id: int - 账户ID
+        """
+        if account_id != 1:
+            return
+        for grid_pair in self.grid_pairs:
+            grid_pair.replay_missed_orders()
+
+    def on_ws_disconnected(self, exchange, account_id):
+        """websocket断开
+        exchange: str - 交易所名称
+        account_id: int - 账户ID
+        """
+        self.trader.log(f"{exchange} 账户{account_id} websocket断开", level="WARN")
+
+    def _account_id(self, exchange):
+        """根据交易所名称查找账户ID"""
+        for account_id, cex_config in enumerate(self.cex_configs):
+            if cex_config.get("exchange", None) == exchange:
+                return account_id
+        return None
+
+    def on_instrument(self, exchange, instruments):
+        """交易对信息更新"""
+        self.on_instrument_updated(exchange, instruments)
+
+    def on_instrument_added(self, exchange, instruments):
+        """交易对信息新增"""
+        self.on_instrument_updated(exchange, instruments)
+
+    def on_instrument_updated(self, exchange, instruments):
+        """交易对信息更新, 只在策略使用的交易对变化时更新精度"""
+        account_id = self._account_id(exchange)
+        if account_id is None:
+            return
+        updated = self.instruments.update(account_id, instruments)
+        if any(symbol in self.bbo for symbol in updated):
+            self._apply_instrument_rules()
+
+    def on_instrument_removed(self, exchange, instruments):
+        """交易对信息删除, 交割合约下架时记录错误"""
+        account_id = self._account_id(exchange)
+        if account_id is None:
+            return
+        removed = self.instruments.remove(account_id, instruments)
+        removed = [symbol for symbol in removed if symbol in self.bbo]
+        if removed:
+            self.trader.log(
+                f"策略使用的交易对已下架: {removed}, 请更新配置中的交易对",
+                level="ERROR",
+            )
+
+    def on_timer_subscribe(self, timer_name):
+        """定时器回调
+        timer_name: str - 定时器名称
+        """
+        if timer_name == "state_snapshot":
+            self.snapshotter.submit(self._capture_state())
+        elif timer_name == "risk_board":
+            self._publish_risk()
+        elif timer_name == "bbo_board":
+            self._poll_bbo_board()
+        elif timer_name == "control_flags":
+            self._refresh_control_flags()
+        elif timer_name == "pre_trade_guard":
+            for account_id in (0, 1):
+                self.refresh_pre_trade_guard(account_id)
+        elif timer_name == "amend_stats":
+            for grid_pair in self.grid_pairs:
+                self.trader.log(
+                    f"{grid_pair.key} 改单统计: {grid_pair.amend_policy.report()}",
+                    level="INFO",
+                )
+        elif timer_name == "request_budget":
+            self.trader.log(
+                f"剩余请求预算: {self.request_budget.remaining()}, "
+                f"被拒绝的请求: {self.request_budget.rejected}",
+                level="INFO",
+            )
+
+    def on_stop(self):
+        """停止策略时同步保存一次状态快照"""
+        if self.snapshot_enabled:
+            self.snapshotter.write(self._capture_state())
+        if self.risk_board is not None:
+            self.risk_board.close()
+            self.risk_board = None
+        if self.bbo_board is not None:
+            self.bbo_board.close()
+            self.bbo_board = None
+        self.leg_dispatcher.shutdown()
+        if self.journal is not None:
+            self.journal.close()
+
+    def _attach_bbo_board(self):
+        """连接行情进程创建的BboBoard, 行情进程未启动时在下次读取时重试"""
+        name = self.bbo_board_config.get("name", "grid_bbo_board")
+        self.bbo_board = BboBoard.attach(name)
+        if self.bbo_board is None:
+            self.trader.tlog(
+                tag="BBO行情板",
+                msg=f"无法连接共享内存 {name}, 请检查行情进程",
+                interval=10,
+                level="ERROR",
+            )
+            return False
+        self.trader.log(f"已连接BBO行情板 {name}", level="INFO")
+        return True
+
+    def _poll_bbo_board(self):
+        """读取行情板中序号有变化的symbol, 按收到BBO推送处理"""
+        if self.bbo_board is None and not self._attach_bbo_board():
+            return
+        board = self.bbo_board
+        if board.heartbeat_age() > self.bbo_board_timeout:
+            self.trader.tlog(
+                tag="BBO行情板",
+                msg=f"行情进程心跳超时 {board.heartbeat_age():.1f}秒, 行情可能已停止更新",
+                interval=10,
+                level="ERROR",
+            )
+        exchange = self.cex_configs[0]["exchange"]
+        for symbol, last_seq in self.bbo_board_seqs.items():
+            slot = board.slot_of(symbol)
+            if slot is None or board.seq[slot] == last_seq:
+                continue
+            seq, bbo = board.read(slot)
+            if bbo is None:
+                continue
+            self.bbo_board_seqs[symbol] = seq
+            bbo["symbol"] = symbol
+            self.on_bbo(exchange, bbo)
+
+    def _attach_risk_board(self):
+        """连接监督进程创建的RiskBoard, 监督进程未启动时在下次写入时重试"""
+        name = self.shard_config.get("shm_name", "grid_risk_board")
+        self.risk_board = RiskBoard.attach(name)
+        if self.risk_board is None or self.shard_slot >= self.risk_board.slots:
+            if self.risk_board is not None:
+                self.risk_board.close()
+                self.risk_board = None
+            self.trader.tlog(
+                tag="风控汇总",
+                msg=f"无法连接共享内存 {name}(分片 {self.shard_slot}), 请检查监督进程",
+                interval=10,
+                level="ERROR",
+            )
+            return False
+        self.trader.log(
+            f"分片 {self.shard_slot} 已连接共享内存 {name}, 交易对: {[p.key for p in self.grid_pairs]}",
+            level="INFO",
+        )
+        return True
+
+    def _position_values(self):
+        """按最新中间价计算当前分片的多空持仓价值、净敞口与浮动盈亏"""
+        long_value = 0.0
+        short_value = 0.0
+        pnl = 0.0
+        for symbol, position in self.positions.items():
+            if position is None or not position.amount:
+                continue
+            bbo = self.bbo.get(symbol, None)
+            if bbo is None:
+                continue
+            value = position.amount * (bbo.ask_price + bbo.bid_price) / 2
+            if position.side.lower() == "long":
+                long_value += value
+            else:
+                short_value += value
+            pnl += position.unrealized_pnl
+        return long_value, short_value, long_value - short_value, pnl
+
+    def _publish_risk(self):
+        """写入当前分片的风控数据并读取全局停止开仓标志"""
+        if self.risk_board is None and not self._attach_risk_board():
+            return
+        long_value, short_value, exposure, pnl = self._position_values()
+        self.risk_board.publish(
+            self.shard_slot, long_value, short_value, exposure, pnl, len(self.grid_pairs)
+        )
+        self.trader.update_current_position_value(
+            long_value + short_value, long_value, short_value
+        )
+
+        halted = self.risk_board.halted()
+        if halted != self.risk_halted:
+            self.risk_halted = halted
+            self._update_opening_halted()
+            self.trader.log(
+                f"全局风控{'停止开仓' if halted else '恢复开仓'}: {self.risk_board.totals()}",
+                level="WARN" if halted else "INFO",
+            )
+
+        # 全局持仓价值只由一个分片上报
+        if self.shard_slot == self.report_slot:
+            totals = self.risk_board.totals()
+            if totals["updated"]:
+                self.trader.update_total_position_value(
+                    totals["total_value"], totals["long_value"], totals["short_value"]
+                )
+
+    def _update_opening_halted(self):
+        """汇总全局风控与平台指令, 更新是否停止开仓"""
+        self.opening_halted = (
+            self.risk_halted
+            or self.web_soft_stopped
+            or self.web_opening_stopped
+            or self.web_force_closing
+        )
+
+    def _query_control_flag(self, query):
+        """查询一个平台控制指令, 查询失败时返回None"""
+        try:
+            result = query()
+        except Exception as e:
+            self.trader.tlog(
+                tag="平台控制指令",
+                msg=f"查询平台控制指令失败: {e}",
+                interval=10,
+                level="WARN",
+            )
+            return None
+        if isinstance(result, dict):
+            if "Err" in result:
+                return None
+            result = result.get("Ok", None)
+        return bool(result)
+
+    def _refresh_control_flags(self):
+        """刷新平台控制指令缓存, 进入强平时立即平掉所有仓位"""
+        was_force_closing = self.web_force_closing
+        for name, query in (
+            ("web_soft_stopped", self.trader.is_web_soft_stopped),
+            ("web_opening_stopped", self.trader.is_web_opening_stopped),
+            ("web_force_closing", self.trader.is_web_force_closing),
+        ):
+            value = self._query_control_flag(query)
+            if value is None or value == getattr(self, name):
+                continue
+            setattr(self, name, value)
+            self.trader.log(
+                f"平台控制指令变化: {name} = {value}",
+                level="WARN" if value else "INFO",
+            )
+        self._update_opening_halted()
+        if self.web_force_closing and not was_force_closing:
+            self._force_close_all()
+
+    def _force_close_all(self):
+        """平台强平: 撤掉所有挂单并平掉所有仓位"""
+        self.trader.log("收到平台强平指令, 撤单并平掉所有仓位", level="WARN")
+        self.flatten(self.grid_pairs, cancel_all=True)
+
+    def flatten(self, grid_pairs, cancel_all=False):
+        """撤单并同时平掉交割合约与现货两条腿, 后台确认仓位在期限内归零
+        grid_pairs: list - 需要平仓的交易对
+        cancel_all: bool - 撤掉两个账户上这些symbol的所有挂单并把现货仓位平到0(强平),
+            否则只撤这些交易对的网格挂单, 现货只平掉对应交割合约仓位的对冲部分(网格调整)
+        """
+        spots = list(dict.fromkeys(grid_pair.spot for grid_pair in grid_pairs))
+        cancel_jobs = []  # (交易对, 账户, 接口, 参数, 关键字参数), 现货撤单的交易对为None
+        order_cids = {}  # <交易对, 撤单前的挂单cid>
+        for grid_pair in grid_pairs:
+            # 平仓期间撤单回报不再把网格挂单放回
+            grid_pair.flattening = True
+            # 平仓按交易所持仓计算目标, 累计的对冲余量不再需要
+            grid_pair.hedge_residual = 0.0
+            order_cids[grid_pair] = list(grid_pair.pending_orders.keys())
+            if cancel_all:
+                cancel_jobs.append(
+                    (
+                        grid_pair,
+                        1,
+                        "batch_cancel_order",
+                        (grid_pair.placeFutureSymbol,),
+                        {},
+                    )
+                )
+            elif order_cids[grid_pair]:
+                cancel_jobs.append(
+                    (
+                        grid_pair,
+                        1,
+                        "batch_cancel_order_by_id",
+                        (),
+                        {
+                            "symbol": grid_pair.placeFutureSymbol,
+                            "client_order_ids": order_cids[grid_pair],
+                        },
+                    )
+                )
+        if cancel_all:
+            cancel_jobs.extend(
+                (None, 0, "batch_cancel_order", (spot,), {}) for spot in spots
+            )
+
+        # 两个账户的撤单同时发出
+        cancels = [
+            (
+                grid_pair,
+                self.leg_dispatcher.submit(
+                    account_id,
+                    self.request_budget.request,
+                    RequestBudget.CANCEL,
+                    account_id,
+                    endpoint,
+                    *args,
+                    **kwargs,
+                ),
+            )
+            for grid_pair, account_id, endpoint, args, kwargs in cancel_jobs
+        ]
+        failed = set()  # 撤单失败的交易对
+        for grid_pair, cancel in cancels:
+            try:
+                result = cancel.result()
+            except Exception as e:
+                result = {"Err": repr(e)}
+            if isinstance(result, dict) and "Err" in result:
+                self.trader.log(f"平仓撤单失败: {result['Err']}", level="ERROR")
+                if grid_pair is not None:
+                    failed.add(grid_pair)
+
+        # 撤单返回后再移除本地挂单, 撤单失败时保留跟踪, 挂单成交后仍按网格订单对冲
+        for grid_pair in grid_pairs:
+            if grid_pair in failed:
+                self.trader.log(
+                    f"{grid_pair.key} 撤单失败, 保留 {len(order_cids[grid_pair])} 个挂单的本地跟踪",
+                    level="WARN",
+                )
+            else:
+                for cid in order_cids[grid_pair]:
+                    grid_pair._remove_pending_order(cid)
+            grid_pair.wait_lock_release("grid_orders_lock")
+            grid_pair.grid_orders_lock = True  # 设置锁，防止多线程冲突
+            grid_pair._clear_grid_orders()
+            grid_pair.grid_orders_lock = False  # 释放锁
+
+        # 按持仓计算平仓后两条腿的目标持仓
+        targets = {}  # <symbol, 目标持仓(带方向)>
+        for grid_pair in grid_pairs:
+            targets[grid_pair.future] = 0.0
+        for spot in spots:
+            position = self.positions.get(spot, None)
+            current = position.signed_amount if position is not None else 0.0
+            if cancel_all:
+                targets[spot] = 0.0
+            else:
+                # 平掉交割合约仓位后现货只保留其它交割合约的对冲部分
+                targets[spot] = current + sum(
+                    self._signed_position(grid_pair.future)
+                    for grid_pair in grid_pairs
+                    if grid_pair.spot == spot
+                )
+        self._send_flatten_orders(grid_pairs, targets)
+
+        threading.Thread(
+            target=self._confirm_flat,
+            args=(grid_pairs, targets, time.time() + self.flatten_deadline),
+            name="flatten-confirm",
+            daemon=True,
+        ).start()
+
+    def _signed_position(self, symbol):
+        position = self.positions.get(symbol, None)
+        return position.signed_amount if position is not None else 0.0
+
+    def _flatten_order(self, grid_pair, symbol, delta):
+        """把symbol的持仓调整delta(带方向)的平仓订单, 数量不足最小下单量时返回None"""
+        account_id = 1 if symbol == grid_pair.future else 0
+        amount = self.instruments.round_amount(account_id, symbol, abs(delta))
+        bbo = self.bbo.get(symbol, None)
+        if amount <= 0 or bbo is None:
+            return None
+        side = "Buy" if delta > 0 else "Sell"
+        price = (
+            bbo.ask_price * (1 + self.flatten_slippage)
+            if side == "Buy"
+            else bbo.bid_price * (1 - self.flatten_slippage)
+        )
+        price = grid_pair._round_price(symbol, price)
+        if self.instruments.check_order(account_id, symbol, price, amount) is not None:
+            return None
+        order = Order(
+            self.trader.create_cid(self.cex_configs[account_id]["exchange"]),
+            grid_pair.placeFutureSymbol if account_id == 1 else symbol,
+            "Limit",
+            side,
+            amount,
+            price,
+            "IOC",  # 穿价限价单, 未成交部分由平仓确认补单
+        )
+        if account_id == 1:
+            grid_pair.flatten_cids.add(order.cid)
+        return order
+
+    def _send_flatten_orders(self, grid_pairs, targets):
+        """按目标持仓计算两条腿的平仓订单, 每个账户一次批量下单, 两个账户同时发出"""
+        pair_by_symbol = {}
+        for grid_pair in grid_pairs:
+            pair_by_symbol[grid_pair.future] = grid_pair
+            pair_by_symbol.setdefault(grid_pair.spot, grid_pair)
+        orders = {0: [], 1: []}
+        for symbol, target in targets.items():
+            grid_pair = pair_by_symbol[symbol]
+            order = self._flatten_order(
+                grid_pair, symbol, target - self._signed_position(symbol)
+            )
+            if order is not None:
+                orders[1 if symbol == grid_pair.future else 0].append(order.to_dict())
+        sends = {
+            account_id: self.leg_dispatcher.submit(
+                account_id,
+                self.request_budget.request,
+                RequestBudget.HEDGE,
+                account_id,
+                "batch_place_order",
+                account_orders,
+            )
+            for account_id, account_orders in orders.items()
+            if account_orders
+        }
+        for account_id, send in sends.items():
+            self.trader.log(
+                f"账户{account_id}平仓: {json.dumps(orders[account_id], indent=2)}\
+                    \n平仓结果: {send.result()}",
+                level="INFO",
+            )
+        return bool(sends)
+
+    def _refresh_positions(self, symbols):
+        """使用REST查询两个账户的持仓更新本地持仓, 查询失败时返回False"""
+        for account_id in (0, 1):
+            result = self.trader.get_positions(account_id)
+            if result is None or "Err" in result:
+                return False
+            seen = set()
+            for position in result.get("Ok", None) or []:
+                symbol = self.__process_symbol(position["symbol"])
+                if symbol in symbols:
+                    self.positions[symbol] = Position.from_trader(position, symbol)
+                    seen.add(symbol)
+            for symbol in symbols:
+                # 交易所不返回空仓位
+                account_symbol = symbol in self.pairs_by_future
+                if (account_id == 1) == account_symbol and symbol not in seen:
+                    self.positions[symbol] = None
+        return True
+
+    def _confirm_flat(self, grid_pairs, targets, deadline):
+        """在期限内确认两条腿达到目标持仓, 未达到时按剩余数量补单"""
+        last_send = time.time()
+        try:
+            while True:
+                time.sleep(self.flatten_poll_interval)
+                if not self._refresh_positions(targets):
+                    residual = None
+                else:
+                    residual = {
+                        symbol: target - self._signed_position(symbol)
+                        for symbol, target in targets.items()
+                        if self.instruments.round_amount(
+                            1 if symbol in self.futures else 0,
+                            symbol, abs(target - self._signed_position(symbol))
+                        )
+                        > 0
+                    }
+                    if not residual:
+                        self.trader.log(
+                            f"平仓完成: {[grid_pair.key for grid_pair in grid_pairs]}",
+                            level="INFO",
+                        )
+                        return
+                if time.time() >= deadline:
+                    self.trader.log(
+                        f"平仓未在期限内完成, 剩余敞口: {residual}",
+                        level="ERROR",
+                    )
+                    return
+                if (
+                    residual
+                    and time.time() - last_send >= self.flatten_resend_interval
+                ):
+                    self.trader.log(f"平仓剩余敞口 {residual}, 补单", level="WARN")
+                    self._send_flatten_orders(grid_pairs, targets)
+                    last_send = time.time()
+        finally:
+            for grid_pair in grid_pairs:
+                grid_pair.flattening = False
+
+    def _capture_state(self):
+        """采集所有交易对需要持久化的状态"""
+        return {
+            "pairs": {
+                grid_pair.key: grid_pair._capture_state()
+                for grid_pair in self.grid_pairs
+            }
+        }
+
+    def _restore_state(self):
+        """从状态快照恢复各交易对, 返回<交易对标识, 均线是否已恢复>"""
+        state, timestamp = self.snapshotter.load()
+        if state is None:
+            return {}
+        ewm_restored = {}
+        pair_states = state.get("pairs", {})
+        for grid_pair in self.grid_pairs:
+            pair_state = pair_states.get(grid_pair.key, None)
+            if pair_state is None:
+                continue
+            ewm_restored[grid_pair.key] = grid_pair._restore_state(
+                pair_state, timestamp, self.snapshot_max_age
+            )
+            # 需要在收到完整的bbo后与交易所核对订单与持仓
+            self.reconcile_pending.add(grid_pair.spot)
+        unknown = set(pair_states.keys()) - {p.key for p in self.grid_pairs}
+        if unknown:
+            self.trader.log(
+                f"状态快照中的交易对 {sorted(unknown)} 不在当前配置中, 请手动检查挂单与持仓",
+                level="WARN",
+            )
+        return ewm_restored
+
+    def _reconcile_after_restore(self, spot):
+        """恢复快照后与交易所核对同一现货下所有交易对的挂单与持仓
+        1. 各交易对核对挂单: 撤销孤儿订单, 重放已不在交易所挂单列表中的订单的最终状态
+        2. 核对现货与所有交割合约的持仓, 对未对冲的部分执行对冲。重放时发出的对冲
+           已成交的部分已经计入持仓, 只加上交易所确认仍未成交的部分, 避免重复对冲
+        """
+        grid_pairs = self.pairs_by_spot[spot]
+        if any(
+            self.bbo[symbol] is None
+            for grid_pair in grid_pairs
+            for symbol in grid_pair.symbols
+        ):
+            return
+        self.reconcile_pending.discard(spot)
+
+        replayed_hedges = []  # 重放成交订单时发出的现货对冲
+        for grid_pair in grid_pairs:
+            pair_hedges = grid_pair._reconcile_orders()
+            if pair_hedges is None:
+                return
+            replayed_hedges.extend(pair_hedges)
+
+        # 核对现货与所有交割合约的持仓
+        net_amounts = {}
+        legs = [(0, spot)] + [(1, grid_pair.future) for grid_pair in grid_pairs]
+        positions_results = {}
+        for account_id, symbol in legs:
+            if account_id not in positions_results:
+                positions_results[account_id] = self.trader.get_positions(account_id)
+            positions_result = positions_results[account_id]
+            if positions_result is None or "Err" in positions_result:
+                self.trader.log(
+                    f"恢复快照后查询持仓失败: {positions_result}, 跳过持仓核对",
+                    level="ERROR",
+                )
+                return
+            net_amounts[symbol] = 0.0
+            for position in positions_result.get("Ok", None) or []:
+                if self.__process_symbol(position["symbol"]) != symbol:
+                    continue
+                position = Position.from_trader(position, symbol)
+                self.positions[symbol] = position
+                net_amounts[symbol] += position.signed_amount
+
+        # 重放的对冲中仍挂在交易所未成交的数量, 查询失败时只按持仓计算
+        pending_hedge = 0.0
+        for cid, signed_amount in replayed_hedges:
+            order_result = self.trader.get_order_by_id(0, spot, cid=cid)
+            order = (
+                order_result.get("Ok", None) if isinstance(order_result, dict) else None
+            )
+            if order is None:
+                self.trader.log(
+                    f"恢复快照后查询对冲订单 {cid} 失败: {order_result}, 按持仓核对",
+                    level="WARN",
+                )
+                continue
+            if order["status"].lower() in (
+                "filled",
+                "canceled",
+                "rejected",
+                "expired",
+            ):
+                continue
+            unfilled = max(abs(signed_amount) - (order.get("filled", 0.0) or 0.0), 0.0)
+            pending_hedge += unfilled if signed_amount > 0 else -unfilled
+        # 持仓已包含累计的对冲余量, 按持仓重新计算
+        for grid_pair in grid_pairs:
+            grid_pair.hedge_residual = 0.0
+        residual = sum(net_amounts.values()) + pending_hedge
+        if abs(residual) > 1e-9:
+            side = "Sell" if residual > 0 else "Buy"
+            self.trader.log(
+                f"持仓未对冲: {net_amounts}, \
+                    \n执行对冲 {side} {abs(residual)}",
+                level="WARN",
+            )
+            hedge_order_cid = self.trader.create_cid(self.cex_configs[0]["exchange"])
+            grid_pairs[0].exec_hedge(hedge_order_cid, spot, side, abs(residual))
+
+    def __process_symbol(self, symbol):
+        """对symbol进行调整，对于每一个回调数据，都需要处理"""
+        return self.instruments.internal_symbol(symbol)
+
+    def on_depth(self, exchange, depth):
+        """处理深度数据
+        exchange: str - 交易所名称
+        depth: dict - 深度数据
+        """
+        symbol = self.__process_symbol(depth["symbol"])
+        book = self.order_books.get(symbol, None)
+        if book is None:
+            return
+        book.apply(
+            depth.get("bids", []),
+            depth.get("asks", []),
+            timestamp=depth.get("timestamp", None),
+            incremental=self.depth_incremental,
+        )
+
+    def on_bbo(self, exchange, bbo):
+        """处理BBO数据
+        exchange: str - 交易所名称
+        bbo: dict - BBO数据
+        """
+        # 先对symbol进行处理, 转换为Bbo
+        symbol = self.__process_symbol(bbo["symbol"])
+        bbo = Bbo.from_trader(bbo, symbol)
+
+        # 更新最新的BBO数据
+        self.bbo[symbol] = bbo
+
+        # 平台强平期间不再处理网格
+        if self.web_force_closing:
+            return
+
+        # 交给包含该symbol的交易对处理
+        for grid_pair in self.pairs_by_symbol.get(symbol, ()):
+            group = grid_pair.group
+            if group is not None and symbol == grid_pair.future:
+                group.update_future(grid_pair.group_index, bbo)
+
+            # 恢复快照后第一次收到完整的bbo时与交易所核对订单与持仓
+            if grid_pair.spot in self.reconcile_pending:
+                self._reconcile_after_restore(grid_pair.spot)
+                if grid_pair.spot in self.reconcile_pending:
+                    continue
+
+            if group is None or symbol == grid_pair.future:
+                # 单个交易对, 或者交割合约更新时只处理该交易对
+                grid_pair.on_bbo()
+            elif grid_pair.group_index == 0:
+                # 现货更新时一次处理该现货下的所有交割合约
+                group.on_spot_tick()
+
+    def on_order(self, exchange, order):
+        """处理订单数据
+        exchange: str - 交易所名称
+        order: dict - 订单数据
+        """
+        # 先对symbol进行处理
+        order["symbol"] = self.__process_symbol(order["symbol"])
+
+        # 统计延迟
+        stats_cid = self.order_delay_stats._create_stats_cid(order)
+        if order["status"].lower() == "open":
+            if stats_cid in self.order_delay_stats.order_delay_stats["amend_order"]:
+                latency = self.order_delay_stats.add_when_recive(order, "amend_order")
+                if latency is not None:
+                    self.trader.log(
+                        f"改单{stats_cid}延迟: {latency} ms",
+                        level="INFO",
+                    )
+            else:
+                latency = self.order_delay_stats.add_when_recive(order, "place_order")
+                if latency is not None:
+                    self.trader.log(
+                        f"下单{stats_cid}延迟: {latency} ms",
+                        level="INFO",
+                    )
+        elif order["status"].lower() == "canceled":
+            latency = self.order_delay_stats.add_when_recive(order, "cancel_order")
+            if latency is not None:
+                self.trader.log(
+                    f"撤单{stats_cid}延迟: {latency} ms",
+                    level="INFO",
+                )
+
+        # 统计滑点
+        if order["status"].lower() == "filled":
+            cid = order["cid"]
+            slippage_abs, slippage_bps = None, None
+            if cid in self.slippage_stats.order_slippage_stats["grid_order"]:
+                slippage_abs, slippage_bps = self.slippage_stats.add_when_filled(
+                    order, "grid_order"
+                )
+            elif cid in self.slippage_stats.order_slippage_stats["hedge_order"]:
+                slippage_abs, slippage_bps = self.slippage_stats.add_when_filled(
+                    order, "hedge_order"
+                )
+            if slippage_abs is not None:
+                self.trader.log(
+                    f"订单{order['cid']}滑点: {slippage_abs:.6f} ({slippage_bps:.2f} bps)",
+                    level="INFO",
+                )
+
+        # 对冲单成交
+        if order["symbol"] in self.pairs_by_spot and order["status"].lower() == "filled":
+            # 统计网格成交价, 平仓单等非对冲单没有对应的网格订单
+            grid_order_deal_price, grid_order_slippage = (
+                self.deal_price_stats.add_deal_hedge_order(hedge_order=order)
+                or (None, None)
+            )
+            grid_order = self.deal_price_stats.grid_order_stats.get(
+                order["cid"], {}
+            ).get("grid_order", None)
+            self.trader.log(
+                f"对冲订单成交: {json.dumps(order, indent=2)}\
+                    \n-> 对应网格订单: {json.dumps(grid_order.to_dict() if grid_order else None, indent=2)}\
+                    \n-> 网格成交价: {grid_order_deal_price}\
+                    \n-> 网格滑点: {grid_order_slippage}",
+                level="INFO",
+            )
+
+        # 交割合约订单交给对应的交易对处理
+        grid_pair = self.pairs_by_future.get(order["symbol"], None)
+        if grid_pair is not None:
+            grid_pair.on_order(order)
+
+    def on_order_amended(self, account_id, result, order):
+        """改单请求回报
+        account_id: int - 账户ID
+        result: dict - 改单结果
+        order: dict - 改单时传入的订单信息
+        """
+        if account_id != 1:
+            return
+        grid_pair = self.pairs_by_future.get(
+            self.__process_symbol(order["symbol"]), None
+        )
+        if grid_pair is not None:
+            grid_pair.on_order_amended(result, order)
 
     def on_position(self, exchange, position):
         """处理持仓数据
@@ -1416,4 +4407,6 @@ class Strategy(BaseStrategy):
         )
 
         # 更新持仓信息
-        self.positions[position["symbol"]] = position
+        self.positions[position["symbol"]] = Position.from_trader(
+            position, position["symbol"]
+        )
@@ -1,193 +1,684 @@
 from interface.trader import Trader
 from interface.base_strategy import BaseStrategy
-import numpy as np
-import time
+from strategyV2 import InstrumentCache
+import bisect
 import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+
+class LatencyHistogram:
+    """对数分桶的延迟直方图，单位为毫秒"""
+
+    def __init__(self, low=0.1, high=60000, buckets_per_decade=20):
+        self.low = low
+        self.bounds = [
+            low * 10 ** (i / buckets_per_decade)
+            for i in range(int(math.log10(high / low) * buckets_per_decade) + 1)
+        ]  # 每个桶的上界
+        self.counts = [0] * (len(self.bounds) + 1)  # 最后一个桶存放超过上限的样本
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        """按桶内线性插值估计分位数"""
+        if not self.count:
+            return None
+        target = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                lower = self.bounds[index - 1] if index > 0 else self.min
+                upper = self.bounds[index] if index < len(self.bounds) else self.max
+                value = lower + (upper - lower) * (target - seen) / count
+                return min(max(value, self.min), self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3),
+            "p50": round(self.percentile(50), 3),
+            "p90": round(self.percentile(90), 3),
+            "p99": round(self.percentile(99), 3),
+            "max": round(self.max, 3),
+        }
+
+    def to_dict(self):
+        """非空的桶, <桶上界, 数量>"""
+        buckets = {}
+        for index, count in enumerate(self.counts):
+            if count:
+                bound = self.bounds[index] if index < len(self.bounds) else math.inf
+                buckets[str(round(bound, 3))] = count
+        return buckets
+
+
+class ProfileOp:
+    """一次被测量的请求, 批量请求包含多个订单"""
+
+    __slots__ = (
+        "campaign",
+        "kind",
+        "account_id",
+        "cids",
+        "prices",
+        "send_ms",
+        "rtt_ms",
+        "failed",
+        "waiting_push",
+    )
 
-# class Order:
-# class GridOrder:
+    def __init__(self, campaign, kind, account_id, cids, prices, send_ms):
+        self.campaign = campaign
+        self.kind = kind  # place, amend, cancel, batch_place, batch_cancel
+        self.account_id = account_id
+        self.cids = cids
+        self.prices = prices  # <cid, 改单后的价格>
+        self.send_ms = send_ms
+        self.rtt_ms = None  # 请求返回(同步)或结果回调(异步)的耗时
+        self.failed = False
+        self.waiting_push = set(cids)  # 尚未收到推送确认的cid
+
+    @property
+    def done(self):
+        return self.failed or (self.rtt_ms is not None and not self.waiting_push)
+
+
+class Campaign:
+    """一组相同类型的请求
+    kind: place / amend / cancel / batch_place / batch_cancel
+    """
+
+    KINDS = ("place", "amend", "cancel", "batch_place", "batch_cancel")
+
+    def __init__(self, config):
+        self.kind = config.get("kind", "place")
+        if self.kind not in self.KINDS:
+            raise ValueError(f"未知的请求类型: {self.kind}")
+        self.account_id = config.get("account_id", 1)
+        self.sync = config.get("sync", False)
+        self.count = config.get("count", 20)  # 请求次数
+        self.rate = config.get("rate", 5)  # 每秒最多发出的请求数
+        # 最多同时等待确认的请求数, 同步请求在定时器线程中依次执行, 并发固定为1
+        self.concurrency = 1 if self.sync else config.get("concurrency", 2)
+        self.batch_size = (
+            config.get("batch_size", 5) if self.kind.startswith("batch") else 1
+        )
+        self.sent = 0
+        self.next_send_ms = None
+        self.inflight = 0
+
+    @property
+    def key(self):
+        mode = "sync" if self.sync else "async"
+        batch = f" x{self.batch_size}" if self.batch_size > 1 else ""
+        return f"账户{self.account_id} {self.kind}{batch} {mode}"
+
+    def resting_needed(self):
+        """开始前需要的挂单数量"""
+        if self.kind == "amend":
+            return self.concurrency
+        if self.kind in ("cancel", "batch_cancel"):
+            return self.count * self.batch_size
+        return 0
 
 
 # 类名必须为Strategy
 class Strategy(BaseStrategy):
+    """下单/改单/撤单延迟测量策略
+
+    按配置依次执行多组请求(campaign), 控制每组的发送速率与并发数, 统计:
+    - rtt: 请求发出到同步返回或异步结果回调的耗时
+    - push: 请求发出到收到对应订单推送的耗时
+    - uplink: 请求发出到交易所撮合时间(订单推送中的timestamp)的耗时, 按时钟偏差修正
+    时钟偏差取往返耗时最小的一次推送估计: 偏差 = 交易所时间 - (发出时间 + 收到推送时间) / 2。
+    结束后输出同步与异步、单笔与批量请求的对比报告, 并写入./stats。
+
+    挂单价格偏离一档price_offset比例, PostOnly订单不会成交, 结束后撤销所有测试挂单。
+
+    配置:
+        [[pairs]]  # 账户0使用spot下单, 账户1使用future下单
+        spot = "ETH_USDT"
+        future = "ETH_USDT_250926"
+        [latency_profiler]
+        amount = 0.008  # 每笔订单的数量
+        price_offset = 0.05  # 挂单价格偏离一档的比例
+        tick_interval_ms = 10  # 发送请求的定时器间隔
+        ack_timeout = 5  # 等待确认的超时时间，单位为秒
+        prepare_rate = 5  # 准备测试挂单时每秒最多发出的下单数
+        prepare_concurrency = 2  # 准备测试挂单时最多同时等待确认的数量
+        [[latency_profiler.campaigns]]  # 未配置时使用DEFAULT_CAMPAIGNS
+        kind = "place"  # place / amend / cancel / batch_place / batch_cancel
+        account_id = 1
+        sync = false
+        count = 20  # 请求次数
+        rate = 5  # 每秒最多发出的请求数
+        concurrency = 2  # 异步请求最多同时等待确认的数量
+        batch_size = 5  # 批量请求每次的订单数量
+    """
+
+    DEFAULT_CAMPAIGNS = [
+        {"kind": kind, "account_id": account_id, "sync": sync}
+        for account_id in (0, 1)
+        for kind in ("place", "amend", "cancel", "batch_place", "batch_cancel")
+        for sync in (True, False)
+    ]
+
     def __init__(self, cex_configs, dex_configs, config, trader: Trader):
         self.cex_configs = cex_configs  # 中心化交易所配置
         self.dex_configs = dex_configs  # 去中心化交易所配置
         self.config = config  # 策略配置
         self.trader = trader  # 交易执行器
-        self.stop_flag = False  # 停止标志
 
         # has_account: bool = False  # 是否有账户信息
         self.has_account = True  # 是否有账户信息
 
         # 交易币种
-        self.pairs = self.config.get("pairs", {})
-        if not self.pairs:
+        pairs = self.config.get("pairs", {})
+        if isinstance(pairs, list):
+            pairs = pairs[0] if pairs else {}
+        if not pairs:
             raise ValueError("策略配置中未指定交易对，请检查配置文件。")
-        self.spot = self.pairs.get("spot", "")
-        self.future = self.pairs.get("future", "")
-        self.placeFutureSymbol = self.future.replace("_25", "-2025")  # 交割合约符号
-        self.symbols = [symbol for symbol in self.pairs.values()]
+        self.spot = pairs.get("spot", "")
+        self.future = pairs.get("future", "")
+        self.placeFutureSymbol = InstrumentCache.translate_to_exchange(self.future)
+        self.symbols = [self.spot, self.placeFutureSymbol]  # 账户对应的下单symbol
+
+        profiler_config = self.config.get("latency_profiler", {})
+        self.amount = profiler_config.get("amount", 0.008)
+        self.price_offset = profiler_config.get("price_offset", 0.05)
+        self.tick_interval_ms = profiler_config.get("tick_interval_ms", 10)
+        self.ack_timeout_ms = profiler_config.get("ack_timeout", 5) * 1000
+        self.campaigns = [
+            Campaign(campaign)
+            for campaign in profiler_config.get("campaigns", self.DEFAULT_CAMPAIGNS)
+        ]
+        self.campaign_index = 0
+        # 改单与撤单campaign开始前准备测试挂单, 同样控制速率与并发, 避免触发交易所限频影响测量
+        self.prepare_rate = profiler_config.get("prepare_rate", 5)
+        self.prepare_concurrency = profiler_config.get("prepare_concurrency", 2)
+        self.prepare_next_ms = None  # 下一笔准备挂单的最早发送时间
 
         # 记录最新的市场数据
-        self.bbo = {symbol: None for symbol in self.symbols}
+        self.bbo = {}  # <symbol, bbo>
 
-        # 时间参数
-        self.time_tolerance = 3  # 时间容忍度，单位为秒
+        # 订单与请求状态
+        self.lock = threading.Lock()
+        self.resting = [deque(), deque()]  # 每个账户已确认的测试挂单cid
+        self.order_prices = {}  # <cid, 当前价格>
+        self.placing = {}  # <cid, 发出时间>, 准备阶段已发出、尚未确认的挂单
+        self.ops = []  # 未完成的请求
+        self.push_waiters = {}  # <cid, 等待推送确认的请求>
+        self.result_waiters = {}  # <(类型, 账户, cid), 等待异步结果回调的请求>
+        self.batch_waiters = {}  # <(类型, 账户), 等待异步结果回调的批量请求队列>
+        self.finished = False
 
-        # 辅助变量
-        self.short_span = 3 * 60 * 60 * 100
-        self.long_span = 36 * 60 * 60 * 100
-        self.short_ewm = None
-        self.long_ewm = None
-        self.buy_price = None
-        self.sell_price = None
+        # 统计结果
+        self.histograms = {}  # <(campaign, 指标), LatencyHistogram>
+        self.failures = {}  # <campaign, 失败次数>
+        self.clock_samples = [[], []]  # 每个账户的(发出时间, 交易所时间, 收到推送时间)
 
-        # 异常阈值
-        self.abnormal_threshold = 0.003
+    def name(self):
+        """返回策略名称"""
+        return "下单延迟测量"
 
-        # 网格
-        self.grid_interval = self.config.get("grid_config", {}).get(
-            "grid_interval", 0.0007
-        )
-        self.grid_num = self.config.get("grid_config", {}).get("grid_num", 4)
-        self.base_price = None
-        self.grid_levels = None
-        self.last_grid_index = None
-        # 网格挂单
-        self.grid_orders = []  # 挂单列表
-        self.reorder_threshold = (
-            0.5  # 网格重新挂单的阈值, 需要更新网格是base_price在网格中部50%以内
+    def subscribes(self):
+        return [
+            {
+                "account_id": 0,
+                "sub": {
+                    "SubscribeWs": [
+                        {"Bbo": [self.spot, self.placeFutureSymbol]},  # 订阅最优买卖价
+                    ]
+                },
+            },
+            {
+                "account_id": 0,
+                "sub": {"SubscribeWs": [{"Order": [self.spot]}]},  # 订阅订单信息
+            },
+            {
+                "account_id": 1,
+                "sub": {
+                    "SubscribeWs": [{"Order": [self.placeFutureSymbol]}]
+                },  # 订阅订单信息
+            },
+            {
+                "sub": {
+                    "SubscribeTimer": {
+                        "name": "profiler_tick",
+                        "update_interval": {
+                            "secs": self.tick_interval_ms // 1000,
+                            "nanos": (self.tick_interval_ms % 1000) * 1_000_000,
+                        },
+                    }
+                },
+            },
+        ]
+
+    def start(self):
+        """策略启动函数"""
+        self.trader.log(
+            f"延迟测量开始, 共{len(self.campaigns)}组: {[c.key for c in self.campaigns]}",
+            level="INFO",
         )
-        self.cid_to_grid_pending_order = (
-            {}
-        )  # cid到网格挂单的映射, 用于跟踪网格挂单{"cid": grid_order}
 
-        # trade
-        self.trade_amount = 0.008  # 每次交易的数量
+    def on_bbo(self, exchange, bbo):
+        """记录最新的BBO, 用于计算挂单价格"""
+        self.bbo[InstrumentCache.translate_to_exchange(bbo["symbol"])] = bbo
 
-        # 设置杠杆
-        self.leverage = 3
+    @staticmethod
+    def _now():
+        return time.time() * 1000
 
-        # sync
-        self.sync = False  # 是否同步执行
+    def _price(self, account_id, side, shift=0):
+        """偏离一档price_offset比例的挂单价格, shift用于改单时换一个价格"""
+        bbo = self.bbo.get(self.symbols[account_id], None)
+        if bbo is None:
+            return None
+        offset = self.price_offset * (1 + 0.1 * shift)
+        if side == "Buy":
+            return round(bbo["bid_price"] * (1 - offset), 2)
+        return round(bbo["ask_price"] * (1 + offset), 2)
 
-        # 订单管理
-        self.pending_orders = {}  # 等待执行的订单列表
+    def _order(self, account_id, cid, price):
+        return {
+            "cid": cid,
+            "symbol": self.symbols[account_id],
+            "side": "Buy",
+            "order_type": "Limit",
+            "amount": self.amount,
+            "time_in_force": "PostOnly",
+            "price": price,
+        }
 
-        # 仓位管理
-        self.positions = {}  # 当前持仓信息
+    def _histogram(self, campaign, metric):
+        key = (campaign.key, metric)
+        if key not in self.histograms:
+            self.histograms[key] = LatencyHistogram()
+        return self.histograms[key]
 
-        #
-        self.total_trade_num = 0  # 总交易次数
+    # ========================发送请求=========================
+    def on_timer_subscribe(self, timer_name):
+        if timer_name != "profiler_tick" or self.finished:
+            return
+        now = self._now()
+        with self.lock:
+            self._expire_ops(now)
+        if self.campaign_index >= len(self.campaigns):
+            self._finish()
+            return
+        campaign = self.campaigns[self.campaign_index]
+        if campaign.next_send_ms is None and self._prepare(campaign):
+            # 只在campaign开始前准备挂单, 开始后撤掉的挂单不再补充
+            return
+        if campaign.sent >= campaign.count:
+            if campaign.inflight == 0:
+                self.trader.log(f"{campaign.key} 完成", level="INFO")
+                self.campaign_index += 1
+            return
+        if campaign.next_send_ms is None:
+            campaign.next_send_ms = now
+        # 按速率与并发发送, 每个定时器回调最多补发到当前时间
+        while (
+            campaign.sent < campaign.count
+            and campaign.inflight < campaign.concurrency
+            and campaign.next_send_ms <= now
+        ):
+            if not self._send(campaign):
+                break
+            campaign.sent += 1
+            campaign.next_send_ms += 1000 / campaign.rate
+            now = self._now()
 
-        # Lock
-        self.pending_orders_lock = False  # 锁，防止多线程冲突
-        self.grid_orders_lock = False  # 锁，防止多线程冲突
+    def _prepare(self, campaign):
+        """按prepare_rate与prepare_concurrency补足campaign需要的测试挂单, 准备中返回True"""
+        account_id = campaign.account_id
+        with self.lock:
+            placing = len(self.placing)
+            missing = campaign.resting_needed() - len(self.resting[account_id]) - placing
+        if missing <= 0:
+            self.prepare_next_ms = None
+            return placing > 0
+        price = self._price(account_id, "Buy")
+        if price is None:
+            return True
+        now = self._now()
+        if self.prepare_next_ms is None:
+            self.prepare_next_ms = now
+        while (
+            missing > 0
+            and placing < self.prepare_concurrency
+            and self.prepare_next_ms <= now
+        ):
+            cid = self.trader.create_cid(self.cex_configs[account_id]["exchange"])
+            with self.lock:
+                self.placing[cid] = now
+                self.order_prices[cid] = price
+            res = self.trader.place_order(
+                account_id, self._order(account_id, cid, price), sync=False
+            )
+            if isinstance(res, dict) and "Err" in res:
+                with self.lock:
+                    self.placing.pop(cid, None)
+            missing -= 1
+            placing += 1
+            self.prepare_next_ms += 1000 / self.prepare_rate
+        return True
 
-        self.execMaxNum = 3  # 是否执行交易
-        self.execNum = 0  # 当前执行次数
+    def _send(self, campaign):
+        """发出一次请求, 返回是否发出"""
+        account_id = campaign.account_id
+        symbol = self.symbols[account_id]
+        kind = campaign.kind
+        sync = campaign.sync
+        with self.lock:
+            if kind in ("place", "batch_place"):
+                price = self._price(account_id, "Buy")
+                if price is None:
+                    return False
+                cids = [
+                    self.trader.create_cid(self.cex_configs[account_id]["exchange"])
+                    for _ in range(campaign.batch_size)
+                ]
+                prices = {cid: price for cid in cids}
+            elif kind == "amend":
+                if not self.resting[account_id]:
+                    return False
+                cid = self.resting[account_id].popleft()
+                # 在两个价格之间来回改单
+                shift = 1 if self.order_prices.get(cid, None) == self._price(
+                    account_id, "Buy"
+                ) else 0
+                price = self._price(account_id, "Buy", shift)
+                if price is None:
+                    self.resting[account_id].appendleft(cid)
+                    return False
+                cids = [cid]
+                prices = {cid: price}
+            else:
+                if len(self.resting[account_id]) < campaign.batch_size:
+                    return False
+                cids = [
+                    self.resting[account_id].popleft()
+                    for _ in range(campaign.batch_size)
+                ]
+                prices = {}
+            op = ProfileOp(campaign, kind, account_id, cids, prices, self._now())
+            self.ops.append(op)
+            for cid in cids:
+                self.push_waiters[cid] = op
+            if not sync:
+                if kind.startswith("batch"):
+                    self.batch_waiters.setdefault((kind, account_id), deque()).append(op)
+                else:
+                    self.result_waiters[(kind, account_id, cids[0])] = op
+            campaign.inflight += 1
 
-    def wait_lock_release(self, lock_name, msg=None, timeout=5):
-        """等待锁释放"""
-        start_time = time.time()
-        if getattr(self, lock_name):
-            self.trader.log(
-                f"等待锁 {lock_name} 释放. {msg if msg else ''}",
-                level="WARN",
+        if kind == "place":
+            res = self.trader.place_order(
+                account_id, self._order(account_id, cids[0], prices[cids[0]]), sync=sync
             )
-            while getattr(self, lock_name):
-                time.sleep(0.001)
-                if time.time() - start_time > timeout:
-                    self.trader.log(f"锁 {lock_name} 超时释放!", level="ERROR")
-                    setattr(self, lock_name, False)  # 强制释放
-                    break
-            self.trader.log(
-                f"锁 {lock_name} 已释放",
-                level="INFO",
+        elif kind == "batch_place":
+            res = self.trader.batch_place_order(
+                account_id,
+                [self._order(account_id, cid, prices[cid]) for cid in cids],
+                sync=sync,
             )
-
-    def name(self):
-        """返回策略名称"""
-        return "期限价差套利策略"
-
-    def subscribes(self):
-        subs = [
-            {
-                "account_id": 0,
-                "sub": {
-                    "SubscribeWs": [
-                        {"Bbo": self.symbols},  # 订阅最优买卖价
-                    ]
-                },
-            }
-        ]
-        if self.has_account:
-            subs.append(
-                {
-                    "account_id": 0,
-                    "sub": {
-                        "SubscribeWs": [
-                            {"Order": [self.spot]},  # 订阅订单信息
-                            {"Position": [self.spot]},  # 订阅持仓信息
-                        ]
-                    },
-                }
+        elif kind == "amend":
+            res = self.trader.amend_order(
+                account_id, self._order(account_id, cids[0], prices[cids[0]]), sync=sync
             )
-            subs.append(
-                {
-                    "account_id": 1,
-                    "sub": {
-                        "SubscribeWs": [
-                            {"Order": [self.placeFutureSymbol]},  # 订阅订单信息
-                            {"Position": [self.placeFutureSymbol]},  # 订阅持仓信息
-                        ]
-                    },
-                }
+        elif kind == "cancel":
+            res = self.trader.cancel_order(account_id, symbol, cid=cids[0], sync=sync)
+        else:
+            res = self.trader.batch_cancel_order_by_id(
+                account_id, symbol, client_order_ids=cids, sync=sync
             )
+        with self.lock:
+            if sync or (isinstance(res, dict) and "Err" in res):
+                self._on_result(op, res)
+        return True
 
-        return subs
+    # ========================确认=========================
+    def _on_result(self, op, result):
+        """请求同步返回或异步结果回调"""
+        if op.rtt_ms is not None or op.failed:
+            return
+        op.rtt_ms = self._now() - op.send_ms
+        if result is None or (isinstance(result, dict) and "Err" in result):
+            op.failed = True
+            campaign = op.campaign
+            self.failures[campaign.key] = self.failures.get(campaign.key, 0) + 1
+            self.trader.log(f"{campaign.key} 请求失败: {result}", level="WARN")
+            for cid in op.waiting_push:
+                self.push_waiters.pop(cid, None)
+                if op.kind == "amend" or op.kind.endswith("cancel"):
+                    # 改单或撤单失败时订单仍然挂着
+                    self.resting[op.account_id].append(cid)
+            op.waiting_push.clear()
+        else:
+            self._histogram(op.campaign, "rtt").add(op.rtt_ms)
+        self._complete(op)
 
-    def start(self):
-        """策略启动函数"""
-        # 设置杠杆
-        # for symbol in self.symbols:
-        #     self.trader.set_leverage(symbol, self.leverage)
-        pass
+    def _complete(self, op):
+        if op.done and op in self.ops:
+            self.ops.remove(op)
+            op.campaign.inflight -= 1
 
-    def on_bbo(self, exchange, bbo):
-        time.sleep(1)  # 确保数据处理不会过快
-        if self.execNum < self.execMaxNum:
-            cid = self.trader.create_cid("BinanceSwap")  # 创建一个唯一的cid
-            order = {
-                "cid": cid,
-                "symbol": self.spot,
-                "side": "Buy",
-                "order_type": "Limit",
-                "amount": 0.008,  # 设置一个初始的买入数量
-                "time_in_force": "PostOnly",
-                "price": 2900,
-            }
-            send_time = int(time.time() * 1000)
-            self.trader.place_order(0, order, sync=False)  # 异步下单
-            order["send_time"] = send_time  # 添加发送时间戳到订单信息
-            self.pending_orders[cid] = order
-            self.execNum += 1
+    def _expire_ops(self, now):
+        """超时未确认的请求按失败处理, 超时未确认的准备挂单不再等待"""
+        for cid, send_ms in list(self.placing.items()):
+            if now - send_ms > self.ack_timeout_ms:
+                self.trader.log(f"准备挂单 {cid} 超时未确认", level="WARN")
+                del self.placing[cid]
+        for op in list(self.ops):
+            if now - op.send_ms > self.ack_timeout_ms:
+                self.trader.log(
+                    f"{op.campaign.key} 请求超时, 未确认的订单: {op.waiting_push}",
+                    level="WARN",
+                )
+                self.failures[op.campaign.key] = (
+                    self.failures.get(op.campaign.key, 0) + 1
+                )
+                for cid in op.waiting_push:
+                    self.push_waiters.pop(cid, None)
+                op.failed = True
+                self._complete(op)
 
     def on_order(self, exchange, order):
-        """处理订单数据
-        exchange: str - 交易所名称
-        order: dict - 订单数据
-        """
+        """订单推送, 作为请求在交易所生效的确认"""
+        now = self._now()
         cid = order.get("cid", None)
-        self.trader.log(
-            f"收到订单数据: {json.dumps(order, indent=2)}",
-            level="INFO",
-        )
-        if cid in self.pending_orders:
-            # 如果订单在待处理列表中，更新订单状态
-            time_cost = order["timestamp"] - self.pending_orders[cid]["send_time"]
-            self.trader.log(
-                f"订单 {cid} 从发出到被服务器接受耗时: {time_cost} ms",
-                level="INFO",
+        status = order["status"].lower()
+        with self.lock:
+            if cid in self.placing:
+                # 准备阶段的挂单
+                del self.placing[cid]
+                if status == "open":
+                    account_id = self.symbols.index(order["symbol"]) if order[
+                        "symbol"
+                    ] in self.symbols else 1
+                    self.resting[account_id].append(cid)
+                return
+            op = self.push_waiters.get(cid, None)
+            if op is None:
+                return
+            if op.kind in ("place", "batch_place", "amend"):
+                if status != "open" or (
+                    op.kind == "amend" and float(order["price"]) != op.prices[cid]
+                ):
+                    if status in ("canceled", "filled"):
+                        op.waiting_push.discard(cid)
+                        self.push_waiters.pop(cid, None)
+                        self._complete(op)
+                    return
+                self.order_prices[cid] = op.prices[cid]
+                self.resting[op.account_id].append(cid)
+            elif status != "canceled":
+                return
+            del self.push_waiters[cid]
+            op.waiting_push.discard(cid)
+            self._histogram(op.campaign, "push").add(now - op.send_ms)
+            server_ms = order.get("timestamp", None)
+            if server_ms:
+                self.clock_samples[op.account_id].append(
+                    (op.campaign.key, op.send_ms, float(server_ms), now)
+                )
+            self._complete(op)
+
+    def _on_async_result(self, kind, account_id, cid, result):
+        with self.lock:
+            op = self.result_waiters.pop((kind, account_id, cid), None)
+            if op is not None:
+                self._on_result(op, result)
+
+    def _on_async_batch_result(self, kind, account_id, result):
+        with self.lock:
+            waiters = self.batch_waiters.get((kind, account_id), None)
+            if waiters:
+                self._on_result(waiters.popleft(), result)
+
+    def on_order_submitted(self, account_id, order_id_result, order):
+        self._on_async_result("place", account_id, order.get("cid", None), order_id_result)
+
+    def on_order_amended(self, account_id, result, order):
+        self._on_async_result("amend", account_id, order.get("cid", None), result)
+
+    def on_order_canceled(self, account_id, result, id, symbol):
+        self._on_async_result("cancel", account_id, id, result)
+
+    def on_batch_order_submitted(self, account_id, order_ids_result):
+        self._on_async_batch_result("batch_place", account_id, order_ids_result)
+
+    def on_batch_order_canceled_by_ids(self, account_id, order_ids_result):
+        self._on_async_batch_result("batch_cancel", account_id, order_ids_result)
+
+    # ========================报告=========================
+    def _clock_offset(self, account_id):
+        """往返耗时最小的一次推送估计的时钟偏差(交易所时间 - 本地时间)"""
+        samples = self.clock_samples[account_id]
+        if not samples:
+            return None
+        _, send_ms, server_ms, recv_ms = min(samples, key=lambda s: s[3] - s[1])
+        return server_ms - (send_ms + recv_ms) / 2
+
+    def report(self):
+        """汇总各组请求的延迟, 对比同步与异步、单笔与批量"""
+        offsets = [self._clock_offset(account_id) for account_id in (0, 1)]
+        for account_id, samples in enumerate(self.clock_samples):
+            if offsets[account_id] is None:
+                continue
+            for key, send_ms, server_ms, _ in samples:
+                histogram = self.histograms.setdefault(
+                    (key, "uplink"), LatencyHistogram()
+                )
+                histogram.add(max(server_ms - offsets[account_id] - send_ms, 0.0))
+
+        rows = {}
+        for campaign in self.campaigns:
+            rows[campaign.key] = {
+                metric: self.histograms[(campaign.key, metric)].summary()
+                for metric in ("rtt", "push", "uplink")
+                if (campaign.key, metric) in self.histograms
+            }
+            rows[campaign.key]["failures"] = self.failures.get(campaign.key, 0)
+            rows[campaign.key]["batch_size"] = campaign.batch_size
+
+        comparisons = []
+        for campaign in self.campaigns:
+            row = rows[campaign.key].get("rtt", {})
+            if not row.get("count", 0):
+                continue
+            if campaign.sync:
+                # 同步与异步对比
+                other = next(
+                    (
+                        c
+                        for c in self.campaigns
+                        if not c.sync
+                        and c.kind == campaign.kind
+                        and c.account_id == campaign.account_id
+                    ),
+                    None,
+                )
+                other_row = rows[other.key].get("rtt", {}) if other else {}
+                if other_row.get("count", 0):
+                    comparisons.append(
+                        f"{campaign.key} vs async: rtt p50 {row['p50']} / {other_row['p50']} ms"
+                    )
+            if campaign.batch_size > 1:
+                # 批量与单笔对比, 批量按每笔订单平均
+                single = next(
+                    (
+                        c
+                        for c in self.campaigns
+                        if c.kind == campaign.kind.replace("batch_", "")
+                        and c.account_id == campaign.account_id
+                        and c.sync == campaign.sync
+                    ),
+                    None,
+                )
+                single_row = rows[single.key].get("rtt", {}) if single else {}
+                if single_row.get("count", 0):
+                    comparisons.append(
+                        f"{campaign.key} vs single: 每笔rtt p50 "
+                        f"{round(row['p50'] / campaign.batch_size, 3)} / {single_row['p50']} ms"
+                    )
+
+        lines = [f"时钟偏差(交易所 - 本地): 账户0 {offsets[0]} ms, 账户1 {offsets[1]} ms"]
+        for key, row in rows.items():
+            lines.append(f"{key}: 失败 {row['failures']}")
+            for metric in ("rtt", "push", "uplink"):
+                if metric in row:
+                    lines.append(f"    {metric:<6} {row[metric]}")
+        lines.extend(comparisons)
+        self.trader.log("延迟测量报告:\n" + "\n".join(lines), level="INFO")
+
+        os.makedirs("./stats", exist_ok=True)
+        with open(
+            f"./stats/{int(time.time() * 1000)}_latency_profile.json",
+            "w",
+            encoding="utf-8",
+        ) as f:
+            json.dump(
+                {
+                    "clock_offset_ms": offsets,
+                    "campaigns": rows,
+                    "comparisons": comparisons,
+                    "histograms": {
+                        f"{key} {metric}": histogram.to_dict()
+                        for (key, metric), histogram in self.histograms.items()
+                    },
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
             )
+        return rows, comparisons
+
+    def _finish(self):
+        """所有campaign完成后输出报告并撤销测试挂单"""
+        self.finished = True
+        self.report()
+        for account_id, symbol in enumerate(self.symbols):
+            self.trader.batch_cancel_order(account_id, symbol, sync=False)
+
+    def on_stop(self):
+        if not self.finished:
+            self._finish()
@@ -0,0 +1,95 @@
+"""
+AsyncStrategy/AsyncTrader: 并发等待的请求各自拿到自己的回报
+
+运行: python -m unittest discover -s tests
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from interface.async_trader import AsyncStrategy  # noqa: E402
+
+
+class FakeTrader:
+    """异步请求在另一个线程中延迟回调, 后提交的请求先回报"""
+
+    def __init__(self):
+        self.strategy = None
+        self.requests = 0
+        self.logs = []
+
+    def _reply(self, callback, *args):
+        self.requests += 1
+        delay = 0.05 / self.requests
+        threading.Timer(delay, getattr(self.strategy, callback), args).start()
+
+    def place_order(self, account_id, order, params=None, extra=None, sync=True):
+        result = {"Ok": f"id-{order['cid']}"}
+        self._reply("on_order_submitted", account_id, result, order)
+
+    def batch_place_order(self, account_id, orders, params=None, extra=None, sync=True):
+        result = {"Ok": [f"id-{order['cid']}" for order in orders]}
+        self._reply("on_batch_order_submitted", account_id, result)
+
+    def log(self, msg, level="INFO"):
+        self.logs.append((level, msg))
+
+
+class RecordingStrategy(AsyncStrategy):
+    def __init__(self, trader):
+        super().__init__(trader, timeout=2)
+        self.submitted = []
+
+    async def on_batch_order_submitted(self, account_id, order_ids_result):
+        self.submitted.append(order_ids_result)
+
+
+class AsyncStrategyTest(unittest.TestCase):
+    def setUp(self):
+        self.trader = FakeTrader()
+        self.strategy = RecordingStrategy(self.trader)
+        self.trader.strategy = self.strategy
+
+    def tearDown(self):
+        self.strategy.on_stop()
+
+    def test_concurrent_batch_place_order_results(self):
+        async def place_batches():
+            batches = [
+                [{"cid": f"a{i}"} for i in range(2)],
+                [{"cid": f"b{i}"} for i in range(3)],
+            ]
+            return await asyncio.gather(
+                *(
+                    self.strategy.async_trader.batch_place_order(1, orders)
+                    for orders in batches
+                )
+            )
+
+        first, second = self.strategy.run(place_batches())
+        self.assertEqual(first, {"Ok": ["id-a0", "id-a1"]})
+        self.assertEqual(second, {"Ok": ["id-b0", "id-b1", "id-b2"]})
+        # 子类的协程回调同样执行
+        self.strategy.run(asyncio.sleep(0.01))
+        self.assertEqual(len(self.strategy.submitted), 2)
+
+    def test_concurrent_place_order_results(self):
+        async def place_orders():
+            return await asyncio.gather(
+                *(
+                    self.strategy.async_trader.place_order(1, {"cid": cid})
+                    for cid in ("c0", "c1", "c2")
+                )
+            )
+
+        results = self.strategy.run(place_orders())
+        self.assertEqual(results, [{"Ok": "id-c0"}, {"Ok": "id-c1"}, {"Ok": "id-c2"}])
+
+
+if __name__ == "__main__":
+    unittest.main()